@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from textblob import TextBlob
 import re
@@ -5,6 +6,38 @@ from datetime import datetime
 
 
 # Funciones
+def tipos_de_datos(serie):
+    '''
+    Tipos de Python presentes en una columna, en orden de aparición (como
+    serie.apply(type).unique()).
+
+    En las columnas que no son de tipo object todos los valores iguales tienen el mismo
+    tipo, así que alcanza con mirar los valores distintos. En las de tipo object (que
+    pueden tener listas, no hasheables) se toma el tipo de cada valor sin pasar por apply.
+    '''
+    if serie.dtype != object:
+        serie = serie.drop_duplicates()
+    return pd.unique(np.fromiter(map(type, serie.to_numpy(dtype=object)), dtype=object, count=len(serie)))
+
+
+def aplicar_por_valor(serie, funcion):
+    '''
+    Aplica una función fila por fila (como serie.apply(funcion)) evaluándola una sola vez
+    por valor distinto. Las columnas de fechas o años tienen pocos valores distintos, así
+    que el costo pasa a depender de esa cantidad y no de la cantidad de filas.
+
+    Parameters:
+    - serie (pd.Series): Columna a transformar (valores hasheables).
+    - funcion (callable): Función escalar.
+
+    Returns:
+    - pd.Series: El resultado, con el mismo índice y nombre que la serie.
+    '''
+    codigos, unicos = pd.factorize(serie, use_na_sentinel=False)
+    resultados = pd.Series(unicos).apply(funcion)
+    return pd.Series(resultados.to_numpy()[codigos], index=serie.index, name=serie.name, dtype=resultados.dtype)
+
+
 def verificar_tipo_datos(df):
     '''
     Realiza un análisis de los tipos de datos y la presencia de valores nulos en un DataFrame.
@@ -30,7 +63,7 @@ def verificar_tipo_datos(df):
     for columna in df.columns:
         porcentaje_no_nulos = (df[columna].count() / len(df)) * 100
         mi_dict["nombre"].append(columna)
-        mi_dict["tipo_datos"].append(df[columna].apply(type).unique())
+        mi_dict["tipo_datos"].append(tipos_de_datos(df[columna]))
         mi_dict["porcentaje_no_nulos"].append(round(porcentaje_no_nulos, 2))
         mi_dict["porcentaje_nulos"].append(round(100-porcentaje_no_nulos, 2))
         mi_dict["nulos"].append(df[columna].isnull().sum())
@@ -43,6 +76,31 @@ def verificar_tipo_datos(df):
 
 #Se convierten las listas en tuplas para verificar los duplicados
 
+def listas_a_tuplas(dataframe):
+    '''
+    Convierte las listas en tuplas para poder comparar filas. Solo se recorren las
+    columnas de tipo object (las únicas que pueden tener listas) y solo se copian las que
+    efectivamente tienen alguna.
+
+    Parameters:
+    - dataframe (pd.DataFrame): El DataFrame a convertir.
+
+    Returns:
+    - pd.DataFrame: El DataFrame con tuplas en lugar de listas.
+    '''
+    convertidas = {}
+    for columna in dataframe.columns[dataframe.dtypes == object]:
+        valores = dataframe[columna].to_numpy()
+        es_lista = np.fromiter(map(type, valores), dtype=object, count=len(valores)) == list
+        if es_lista.any():
+            valores = valores.copy()
+            valores[es_lista] = np.fromiter(map(tuple, valores[es_lista]), dtype=object, count=int(es_lista.sum()))
+            convertidas[columna] = valores
+    if not convertidas:
+        return dataframe
+    return dataframe.assign(**convertidas)
+
+
 def filas_duplicadas(dataframe):
     """
     Verifica si hay filas duplicadas en un DataFrame de Pandas.
@@ -54,7 +112,7 @@ def filas_duplicadas(dataframe):
     - bool: True si hay al menos una fila duplicada, False si no hay filas duplicadas.
     """
     
-    dataframe = dataframe.applymap(lambda x: tuple(x) if isinstance(x, list) else x)
+    dataframe = listas_a_tuplas(dataframe)
     
    
     duplicados = dataframe.duplicated()
@@ -74,7 +132,7 @@ def eliminar_filas_duplicadas(dataframe):
     Returns:
     - pd.DataFrame: Un nuevo DataFrame sin filas duplicadas.
     """
-    dataframe = dataframe.applymap(lambda x: tuple(x) if isinstance(x, list) else x)
+    dataframe = listas_a_tuplas(dataframe)
     dataframe_sin_duplicados = dataframe.drop_duplicates()
     
     return dataframe_sin_duplicados
@@ -174,6 +232,13 @@ def convertir_fecha(fecha):
 """Para el análisis de sentimiento utilizaremos Textblob"""
 
 
+def convertir_fechas(serie):
+    '''
+    Versión por columna de convertir_fecha: aplica la conversión una vez por fecha distinta.
+    '''
+    return aplicar_por_valor(serie, convertir_fecha)
+
+
 def analisis_de_sentimiento(review):
     """
     Analiza el sentimiento de un texto utilizando la librería TextBlob.
@@ -210,11 +275,10 @@ def analizar_ejemplos(ejemplos):
       Si la lista de ejemplos está vacía, devuelve 0 asumiendo una polaridad neutra.
     """
 
-    total_polaridad = 0
+    import sentimiento
 
-    for ejemplo in ejemplos:
-        analysis = TextBlob(ejemplo)
-        total_polaridad += analysis.sentiment.polarity
+    # Cada texto distinto se analiza una sola vez
+    total_polaridad = sum(sentimiento.puntuar(ejemplos, procesos=1))
 
     if ejemplos:
         return total_polaridad / len(ejemplos)
@@ -259,11 +323,10 @@ def calcular_polaridad_promedio(ejemplos):
     Retorna:
     - Un valor entre -1 y 1 representando la polaridad promedio del sentimiento.
     """
-    total_polaridad = 0
+    import sentimiento
 
-    for ejemplo in ejemplos:
-        analysis = TextBlob(str(ejemplo))
-        total_polaridad += analysis.sentiment.polarity
+    # Cada texto distinto se analiza una sola vez
+    total_polaridad = sum(sentimiento.puntuar([str(ejemplo) for ejemplo in ejemplos], procesos=1))
 
     if ejemplos:
         return total_polaridad / len(ejemplos)
@@ -297,6 +360,20 @@ def extraer_anio(date_str):
     except (ValueError, IndexError):
         return 'sin fecha'
 
+def obtener_anios_release(serie):
+    '''
+    Versión por columna de obtener_anio_release: extrae el año una vez por fecha distinta.
+    '''
+    return aplicar_por_valor(serie, obtener_anio_release)
+
+
+def extraer_anios(serie):
+    '''
+    Versión por columna de extraer_anio: extrae el año una vez por fecha distinta.
+    '''
+    return aplicar_por_valor(serie, extraer_anio)
+
+
 def cantidad_porcentaje(df, columna):
     '''
     Cuanta la cantidad de True/False luego calcula el porcentaje.
@@ -314,4 +391,21 @@ def cantidad_porcentaje(df, columna):
         "Cantidad": counts,
         "Porcentaje": percentages
     })
-    return df_results
\ No newline at end of file
+    return df_results
+
+
+def escribir_parquet_ordenado(df, ruta, columna_orden, filas_por_row_group=50000):
+    '''
+    Guarda un DataFrame en Parquet (gzip) ordenado por una columna y dividido en row groups.
+
+    Cada row group guarda el mínimo y el máximo de sus columnas. Con el archivo ordenado por
+    año, la API puede saltear los row groups que no contienen el año consultado.
+
+    Parameters:
+    - df (DataFrame): El DataFrame a guardar.
+    - ruta (str): Ruta del archivo Parquet.
+    - columna_orden (str): Columna por la que se ordenan las filas, por ejemplo el año.
+    - filas_por_row_group (int): Cantidad máxima de filas por row group.
+    '''
+    df_ordenado = df.sort_values(by=columna_orden, kind='stable').reset_index(drop=True)
+    df_ordenado.to_parquet(ruta, engine='pyarrow', compression='gzip', row_group_size=filas_por_row_group)
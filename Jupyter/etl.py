@@ -0,0 +1,369 @@
+'''
+ETL por bloques de los archivos crudos de Steam.
+
+Los notebooks leen cada archivo completo con readlines(), interpretan línea por línea
+con ast.literal_eval y arman listas intermedias antes de json_normalize, de modo que
+el archivo y varias copias quedan en memoria a la vez. Este módulo hace lo mismo por
+bloques de líneas:
+
+1. lee el archivo (JSON lines o literales de Python, con o sin gzip) de a bloques;
+2. interpreta cada línea con json.loads. Los archivos de Steam son literales de Python
+   (comillas simples, True/False/None): cada línea se reescribe como JSON reemplazando
+   esos tokens, y solo se usa ast.literal_eval si la reescritura no se puede interpretar
+   (escapes sin equivalente en JSON, tuplas, claves no textuales);
+3. desanida la lista 'items' o 'reviews' de cada usuario en filas y agrega el año de
+   la reseña o del lanzamiento con las funciones de Funciones.py que usan los notebooks;
+4. escribe cada bloque al Parquet de salida con un ParquetWriter.
+
+La memoria queda acotada por el tamaño de bloque y la cantidad de procesos. Desde un
+notebook:
+
+    import etl
+    etl.procesar('items', r'..\\Data\\australian_users_items.json', r'..\\Data\\users_items.parquet')
+
+o desde consola:
+
+    python etl.py reviews ../Data/australian_user_reviews.json ../Data/user_reviews.parquet --procesos 4
+
+Las limpiezas que necesitan ver todo el archivo (por ejemplo, los duplicados por
+usuario) se siguen haciendo en el notebook sobre el Parquet resultante.
+'''
+
+import argparse
+import ast
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+from collections import deque
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import Funciones
+
+
+logger = logging.getLogger(__name__)
+
+_TEXTO = pa.string()
+_LISTA_TEXTO = pa.list_(pa.string())
+
+# tipo: (esquema de salida, campo con la lista anidada, campos del usuario, prefijo de los campos anidados)
+TIPOS = {
+    'items': (
+        pa.schema([('item_id', _TEXTO), ('item_name', _TEXTO), ('playtime_forever', pa.int64()),
+                   ('playtime_2weeks', pa.int64()), ('steam_id', _TEXTO), ('items_count', pa.int64()),
+                   ('user_id', _TEXTO), ('user_url', _TEXTO)]),
+        'items', ['steam_id', 'items_count', 'user_id', 'user_url'], '',
+    ),
+    'reviews': (
+        pa.schema([('user_id', _TEXTO), ('user_url', _TEXTO), ('reviews_funny', _TEXTO), ('reviews_posted', _TEXTO),
+                   ('reviews_last_edited', _TEXTO), ('reviews_item_id', _TEXTO), ('reviews_helpful', _TEXTO),
+                   ('reviews_recommend', pa.bool_()), ('reviews_review', _TEXTO)]),
+        'reviews', ['user_id', 'user_url'], 'reviews_',
+    ),
+    'juegos': (
+        pa.schema([('publisher', _TEXTO), ('genres', _LISTA_TEXTO), ('app_name', _TEXTO), ('title', _TEXTO),
+                   ('url', _TEXTO), ('release_date', _TEXTO), ('tags', _LISTA_TEXTO), ('reviews_url', _TEXTO),
+                   ('specs', _LISTA_TEXTO), ('price', _TEXTO), ('early_access', pa.bool_()), ('id', _TEXTO),
+                   ('developer', _TEXTO)]),
+        None, [], '',
+    ),
+}
+
+
+# Columnas derivadas que se agregan a cada bloque: tipo: (columna, columna de origen, función
+# de Funciones.py sobre la columna de origen)
+DERIVADAS = {
+    # Como el notebook de reseñas: las fechas faltantes quedan 'sin fecha' y extraer_anio
+    # toma el año de 'Posted April 21, 2011.'
+    'reviews': ('reviews_posted_anio', 'reviews_posted', lambda serie: Funciones.extraer_anios(serie.fillna('sin fecha'))),
+    'juegos': ('release_anio', 'release_date', Funciones.obtener_anios_release),
+}
+
+
+def esquema_salida(tipo):
+    '''
+    Esquema del Parquet de un tipo: el de TIPOS más la columna derivada, si la tiene.
+    '''
+    esquema = TIPOS[tipo][0]
+    if tipo in DERIVADAS:
+        esquema = esquema.append(pa.field(DERIVADAS[tipo][0], pa.int64()))
+    return esquema
+
+
+def abrir(ruta):
+    '''
+    Abre un archivo de texto, descomprimiéndolo si está en gzip.
+    '''
+    with open(ruta, 'rb') as f:
+        comprimido = f.read(2) == b'\x1f\x8b'
+    if comprimido:
+        return gzip.open(ruta, 'rt', encoding='utf-8')
+    return open(ruta, 'r', encoding='utf-8')
+
+
+def leer_bloques(ruta, filas_por_bloque):
+    '''
+    Recorre un archivo de a bloques de líneas no vacías.
+
+    Yields:
+    - list: Hasta filas_por_bloque líneas.
+    '''
+    bloque = []
+    with abrir(ruta) as f:
+        for linea in f:
+            if linea.strip():
+                bloque.append(linea)
+                if len(bloque) == filas_por_bloque:
+                    yield bloque
+                    bloque = []
+    if bloque:
+        yield bloque
+
+
+def es_json(linea):
+    try:
+        json.loads(linea)
+        return True
+    except ValueError:
+        return False
+
+
+# Cadenas entre comillas simples o dobles (con sus escapes) y las constantes de Python
+_TOKENS_LITERAL = re.compile(r"'((?:[^'\\]|\\.)*)'|\"((?:[^\"\\]|\\.)*)\"|\b(True|False|None)\b")
+_CONSTANTES = {'True': 'true', 'False': 'false', 'None': 'null'}
+_CONSTANTE = re.compile(r'\b(?:True|False|None)\b')
+# Escapes que significan lo mismo en Python y en JSON; \' y \" se resuelven aparte
+_ESCAPES_COMUNES = set('\\bfnrtu')
+_ESCAPE = re.compile(r'\\(.)|"', re.DOTALL)
+
+
+class _SinEquivalente(ValueError):
+    pass
+
+
+def _escape_json(coincidencia):
+    escapado = coincidencia.group(1)
+    if escapado is None:
+        return '\\"'
+    if escapado == "'":
+        return "'"
+    if escapado == '"':
+        return '\\"'
+    if escapado in _ESCAPES_COMUNES:
+        return coincidencia.group(0)
+    # \x, \N, octales, \a, \v, \/ (que en JSON es '/' y en Python conserva la barra)...
+    raise _SinEquivalente(escapado)
+
+
+def _constante_json(coincidencia):
+    return _CONSTANTES[coincidencia.group(0)]
+
+
+def _token_json(coincidencia):
+    simple, doble, constante = coincidencia.groups()
+    if constante is not None:
+        return _CONSTANTES[constante]
+    cuerpo = simple if simple is not None else doble
+    if '\\' not in cuerpo and '"' not in cuerpo:
+        return f'"{cuerpo}"'
+    return '"' + _ESCAPE.sub(_escape_json, cuerpo) + '"'
+
+
+def literal_a_json(linea):
+    '''
+    Reescribe una línea de literales de Python como JSON: las cadenas pasan a comillas
+    dobles y True/False/None a true/false/null.
+
+    Returns:
+    - str or None: La línea en JSON, None si tiene escapes de cadena sin equivalente
+      exacto en JSON. El resto de las diferencias (tuplas, claves numéricas, prefijos de
+      cadena) hacen fallar a json.loads sobre el resultado.
+    '''
+    if '"' not in linea and '\\' not in linea:
+        # Caso más común: sin comillas dobles ni escapes, cada comilla simple abre o cierra
+        # una cadena, y las constantes se reemplazan en los tramos de afuera (los pares)
+        partes = linea.split("'")
+        partes[::2] = [_CONSTANTE.sub(_constante_json, parte) for parte in partes[::2]]
+        return '"'.join(partes)
+    try:
+        return _TOKENS_LITERAL.sub(_token_json, linea)
+    except _SinEquivalente:
+        return None
+
+
+def _literal_rapido(linea):
+    convertida = literal_a_json(linea)
+    if convertida is None:
+        raise ValueError("escape sin equivalente en JSON")
+    # strict=False: las cadenas de Python pueden tener tabulaciones sin escapar
+    return json.loads(convertida, strict=False)
+
+
+def interpretar_linea(linea, formato_json):
+    '''
+    Convierte una línea en un diccionario. Un archivo JSON se interpreta con json.loads;
+    uno de literales de Python, con json.loads sobre la línea reescrita (literal_a_json).
+    Si eso falla se usa ast.literal_eval, y en un archivo JSON se prueban también los
+    literales de Python.
+
+    Returns:
+    - dict or None: El registro, None si la línea no se puede interpretar.
+    '''
+    interpretes = (json.loads, ast.literal_eval) if formato_json else (_literal_rapido, ast.literal_eval)
+    for interpretar in interpretes:
+        try:
+            registro = interpretar(linea)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            continue
+        return registro if isinstance(registro, dict) else None
+    return None
+
+
+def _valor(valor, tipo):
+    if valor is None or valor == '':
+        return None
+    if pa.types.is_string(tipo):
+        return str(valor)
+    if pa.types.is_list(tipo):
+        return [str(v) for v in valor] if isinstance(valor, (list, tuple)) else None
+    if pa.types.is_integer(tipo):
+        try:
+            return int(valor)
+        except (TypeError, ValueError):
+            return None
+    if pa.types.is_boolean(tipo):
+        return valor if isinstance(valor, bool) else None
+    return valor
+
+
+def aplanar(registros, tipo):
+    '''
+    Desanida los registros de un bloque: una fila por elemento de la lista anidada,
+    con los campos del usuario repetidos (como json_normalize con record_path y meta).
+    Los textos vacíos quedan como nulos.
+
+    Parameters:
+    - registros (list): Diccionarios del bloque.
+    - tipo (str): 'items', 'reviews' o 'juegos'.
+
+    Returns:
+    - pa.Table: Las filas del bloque con el esquema del tipo.
+    '''
+    esquema, anidado, campos_usuario, prefijo = TIPOS[tipo]
+    columnas = {campo.name: [] for campo in esquema}
+    tipos = {campo.name: campo.type for campo in esquema}
+
+    for registro in registros:
+        if anidado is None:
+            for nombre in columnas:
+                columnas[nombre].append(_valor(registro.get(nombre), tipos[nombre]))
+            continue
+        usuario = {campo: registro.get(campo) for campo in campos_usuario}
+        for elemento in registro.get(anidado) or []:
+            if not isinstance(elemento, dict):
+                continue
+            for nombre in columnas:
+                if nombre in usuario:
+                    valor = usuario[nombre]
+                else:
+                    valor = elemento.get(nombre[len(prefijo):])
+                columnas[nombre].append(_valor(valor, tipos[nombre]))
+    return pa.table(columnas, schema=esquema)
+
+
+def procesar_bloque(lineas, tipo, formato_json):
+    '''
+    Interpreta y desanida un bloque de líneas.
+
+    Returns:
+    - tuple: (pa.Table con las filas del bloque, cantidad de líneas que no se pudieron interpretar)
+    '''
+    registros = [interpretar_linea(linea, formato_json) for linea in lineas]
+    errores = sum(r is None for r in registros)
+    tabla = aplanar([r for r in registros if r is not None], tipo)
+    if tipo in DERIVADAS:
+        columna, origen, funcion = DERIVADAS[tipo]
+        anios = funcion(tabla[origen].to_pandas())
+        # Las funciones devuelven el año o un texto/None cuando no lo hay
+        anios = pd.to_numeric(anios, errors='coerce').astype('Int64')
+        tabla = tabla.append_column(pa.field(columna, pa.int64()), pa.array(anios, type=pa.int64()))
+    return tabla, errores
+
+
+def procesar(tipo, ruta_entrada, ruta_salida, filas_por_bloque=5000, procesos=None, compression='gzip'):
+    '''
+    Convierte un archivo crudo en Parquet, bloque por bloque.
+
+    Parameters:
+    - tipo (str): 'items' (australian_users_items), 'reviews' (australian_user_reviews)
+      o 'juegos' (output_steam_games).
+    - ruta_entrada (str): Archivo JSON lines o de literales de Python, opcionalmente en gzip.
+    - ruta_salida (str): Archivo Parquet a escribir.
+    - filas_por_bloque (int): Líneas por bloque.
+    - procesos (int): Procesos para interpretar los bloques, por defecto la cantidad de CPUs.
+      Con 1 se procesa en el proceso actual.
+    - compression (str): Compresión del Parquet.
+
+    Returns:
+    - dict: Líneas leídas, líneas con error, filas escritas y segundos.
+    '''
+    if tipo not in TIPOS:
+        raise ValueError(f"Tipo inválido: {tipo}. Usar {', '.join(TIPOS)}")
+    procesos = procesos or os.cpu_count() or 1
+    inicio = time.perf_counter()
+
+    with abrir(ruta_entrada) as f:
+        primera = next((linea for linea in f if linea.strip()), '')
+    formato_json = es_json(primera)
+
+    resumen = {"lineas": 0, "errores": 0, "filas": 0}
+
+    def escribir(writer, bloque, resultado):
+        tabla, errores = resultado
+        writer.write_table(tabla)
+        resumen["lineas"] += len(bloque)
+        resumen["errores"] += errores
+        resumen["filas"] += tabla.num_rows
+
+    with pq.ParquetWriter(ruta_salida, esquema_salida(tipo), compression=compression) as writer:
+        if procesos == 1:
+            for bloque in leer_bloques(ruta_entrada, filas_por_bloque):
+                escribir(writer, bloque, procesar_bloque(bloque, tipo, formato_json))
+        else:
+            # Se mantienen a lo sumo dos bloques por proceso en vuelo, y se escriben en orden
+            with multiprocessing.Pool(procesos) as pool:
+                pendientes = deque()
+                for bloque in leer_bloques(ruta_entrada, filas_por_bloque):
+                    pendientes.append((bloque, pool.apply_async(procesar_bloque, (bloque, tipo, formato_json))))
+                    if len(pendientes) >= 2 * procesos:
+                        bloque_listo, resultado = pendientes.popleft()
+                        escribir(writer, bloque_listo, resultado.get())
+                while pendientes:
+                    bloque_listo, resultado = pendientes.popleft()
+                    escribir(writer, bloque_listo, resultado.get())
+
+    resumen["segundos"] = round(time.perf_counter() - inicio, 2)
+    if resumen["errores"]:
+        logger.warning("%d líneas de %s no se pudieron interpretar", resumen["errores"], ruta_entrada)
+    return resumen
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Convierte los archivos crudos de Steam a Parquet por bloques")
+    parser.add_argument('tipo', choices=list(TIPOS))
+    parser.add_argument('entrada')
+    parser.add_argument('salida')
+    parser.add_argument('--filas-por-bloque', type=int, default=5000)
+    parser.add_argument('--procesos', type=int)
+    args = parser.parse_args()
+
+    resumen = procesar(args.tipo, args.entrada, args.salida, args.filas_por_bloque, args.procesos)
+    logger.info("%s: %d líneas, %d filas escritas en %s (%.1f s)", args.entrada, resumen["lineas"],
+                resumen["filas"], args.salida, resumen["segundos"])
@@ -0,0 +1,129 @@
+'''
+Análisis de sentimiento por lotes para las reseñas.
+
+Produce las mismas etiquetas que Funciones.analisis_de_sentimiento (0 negativo,
+1 neutro, 2 positivo, 1 para reseñas nulas), pero:
+
+- calcula la polaridad una sola vez por texto distinto;
+- guarda la polaridad de cada texto, indexada por su hash, en un cache que se puede
+  persistir en Parquet, así una nueva corrida del ETL solo procesa las reseñas nuevas;
+- reparte los textos pendientes en lotes entre varios procesos.
+
+    import sentimiento
+    cache = sentimiento.CachePolaridad(r'..\\Data\\cache_polaridad.parquet')
+    df['sentiment_analysis'] = sentimiento.analisis_de_sentimiento_lote(df['reviews_review'], cache=cache)
+    cache.guardar()
+'''
+
+import hashlib
+import multiprocessing
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from textblob import TextBlob
+
+
+def hash_texto(texto):
+    return hashlib.blake2b(texto.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def polaridad(texto):
+    return TextBlob(texto).sentiment.polarity
+
+
+def _polaridades(textos):
+    return [polaridad(texto) for texto in textos]
+
+
+def etiqueta(valor):
+    '''
+    Convierte una polaridad en la etiqueta 0 (negativa), 1 (neutra) o 2 (positiva).
+    '''
+    if valor < 0:
+        return 0
+    elif valor > 0:
+        return 2
+    else:
+        return 1
+
+
+class CachePolaridad:
+    '''
+    Polaridad de cada texto ya analizado, indexada por el hash del texto.
+    '''
+
+    def __init__(self, ruta=None):
+        '''
+        Parameters:
+        - ruta (str): Archivo Parquet donde se persiste el cache. Si existe, se carga.
+        '''
+        self.ruta = ruta
+        self.polaridades = {}
+        if ruta and os.path.exists(ruta):
+            tabla = pq.read_table(ruta)
+            self.polaridades = dict(zip(tabla['hash'].to_pylist(), tabla['polaridad'].to_pylist()))
+
+    def __len__(self):
+        return len(self.polaridades)
+
+    def guardar(self, ruta=None):
+        ruta = ruta or self.ruta
+        tabla = pa.table({'hash': pa.array(list(self.polaridades), pa.string()),
+                          'polaridad': pa.array(list(self.polaridades.values()), pa.float64())})
+        pq.write_table(tabla, ruta, compression='zstd')
+
+
+def puntuar(textos, procesos=None, tamano_lote=2000, cache=None):
+    '''
+    Calcula la polaridad de cada texto, analizando una sola vez cada texto distinto.
+
+    Parameters:
+    - textos (iterable): Textos a analizar (sin nulos).
+    - procesos (int): Procesos para analizar los textos pendientes, por defecto la cantidad
+      de CPUs. Si hay pocos textos pendientes se analizan en el proceso actual.
+    - tamano_lote (int): Textos por lote enviado a cada proceso.
+    - cache (CachePolaridad): Cache de polaridades ya calculadas, se actualiza con las nuevas.
+
+    Returns:
+    - list: La polaridad de cada texto, en el mismo orden.
+    '''
+    textos = list(textos)
+    cache = cache if cache is not None else CachePolaridad()
+    hashes = {texto: hash_texto(texto) for texto in dict.fromkeys(textos)}
+    pendientes = [texto for texto, clave in hashes.items() if clave not in cache.polaridades]
+
+    procesos = procesos or os.cpu_count() or 1
+    lotes = [pendientes[i:i + tamano_lote] for i in range(0, len(pendientes), tamano_lote)]
+    if procesos == 1 or len(lotes) <= 1:
+        resultados = [_polaridades(lote) for lote in lotes]
+    else:
+        with multiprocessing.Pool(min(procesos, len(lotes))) as pool:
+            resultados = pool.map(_polaridades, lotes)
+    for lote, valores in zip(lotes, resultados):
+        for texto, valor in zip(lote, valores):
+            cache.polaridades[hashes[texto]] = valor
+
+    return [cache.polaridades[hashes[texto]] for texto in textos]
+
+
+def analisis_de_sentimiento_lote(reviews, procesos=None, tamano_lote=2000, cache=None):
+    '''
+    Etiqueta el sentimiento de una colección de reseñas con el mismo criterio que
+    Funciones.analisis_de_sentimiento.
+
+    Parameters:
+    - reviews (pd.Series or list): Textos de las reseñas; los nulos se etiquetan como neutros (1).
+    - procesos, tamano_lote, cache: Ver puntuar().
+
+    Returns:
+    - pd.Series or list: Etiquetas 0, 1 o 2, con el mismo índice que reviews si es una Series.
+    '''
+    serie = reviews if isinstance(reviews, pd.Series) else pd.Series(list(reviews), dtype=object)
+    nulos = serie.isna().to_numpy()
+    textos = serie[~nulos].astype(str)
+    etiquetas = pd.Series(1, index=serie.index, dtype='int64')
+    if len(textos):
+        etiquetas[~nulos] = [etiqueta(v) for v in puntuar(textos, procesos, tamano_lote, cache)]
+    return etiquetas if isinstance(reviews, pd.Series) else etiquetas.tolist()
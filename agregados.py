@@ -0,0 +1,178 @@
+'''
+Tablas de respuestas precalculadas para los endpoints por género y por año.
+
+La construcción se ejecuta offline con:
+
+    python agregados.py
+
+Lee los datasets con las mismas reglas de carga que la API, calcula la respuesta de
+cada endpoint para todos los géneros y todos los años, y la guarda en un JSON
+comprimido con gzip. La API carga ese archivo al iniciar y responde con una búsqueda
+en un diccionario.
+'''
+
+import gzip
+import json
+import logging
+import os
+import time
+
+import configuracion
+import consultas
+import lectura
+from datos import AlmacenDatos
+
+
+logger = logging.getLogger(__name__)
+
+
+def huella_archivos(rutas, raiz=''):
+    '''
+    Identifica la versión de los archivos fuente por tamaño y fecha de modificación,
+    junto con el modo de consulta con el que se calculan los resultados.
+
+    Parameters:
+    - rutas (list): Rutas de los archivos.
+    - raiz (str): Directorio de artefactos contra el que se resuelven las rutas (ver
+      instantaneas.py), por defecto el directorio actual.
+
+    Returns:
+    - dict: {"modo": str, ruta: [tamaño, mtime_ns]} de los archivos existentes, con la ruta
+      relativa a la raíz. Para un directorio por lotes, el tamaño total, la última
+      modificación y la cantidad de archivos.
+    '''
+    huella = {"modo": configuracion.modo_consulta}
+    for ruta in rutas:
+        completa = os.path.join(raiz, ruta)
+        if os.path.isdir(completa):
+            estados = [os.stat(archivo) for archivo in lectura.archivos(completa)]
+            huella[ruta] = [sum(e.st_size for e in estados), max((e.st_mtime_ns for e in estados), default=0), len(estados)]
+        elif os.path.exists(completa):
+            estado = os.stat(completa)
+            huella[ruta] = [estado.st_size, estado.st_mtime_ns]
+    return huella
+
+
+def _parciales_por_clave(fragmentos, claves, parcial):
+    '''
+    Recorre el dataset una sola vez acumulando el resultado parcial de cada clave.
+
+    Parameters:
+    - fragmentos (iterable): Tuplas (DataFrame, IndiceGeneros o None) del dataset.
+    - claves (callable): Devuelve las claves (géneros o años) presentes en un fragmento.
+    - parcial (callable): Calcula el resultado parcial de una clave en un fragmento.
+
+    Returns:
+    - dict: {clave: resultado parcial combinado}
+    '''
+    acumulados = {}
+    for df, indice in fragmentos:
+        for clave in claves(df, indice):
+            resultado = parcial(df, indice, clave)
+            acumulados[clave] = consultas.combinar([acumulados[clave], resultado]) if clave in acumulados else resultado
+    return acumulados
+
+
+def _generos(df, indice):
+    return indice.generos
+
+
+def construir_agregados(almacen):
+    '''
+    Calcula las respuestas de todos los endpoints por género y por año, con una pasada
+    por dataset (en modo 'exacto', una lectura completa del archivo por tabla). Los
+    datasets por año se cuentan agrupando por año y título o sentimiento a la vez.
+
+    Parameters:
+    - almacen (AlmacenDatos): Almacén con los datasets cargados.
+
+    Returns:
+    - dict: Una tabla por endpoint, indexada por género o por año (como texto, para JSON).
+    '''
+    disponibles = set(almacen.datasets) | almacen.en_disco
+    tablas = {}
+
+    if 'PlayTimeGenre' in disponibles:
+        parciales = _parciales_por_clave(almacen.fragmentos('PlayTimeGenre'), _generos, consultas.parcial_play_time_genre)
+        tablas['PlayTimeGenre'] = {g: consultas.final_play_time_genre(p) for g, p in sorted(parciales.items())}
+
+    if 'UserForGenre' in disponibles:
+        parciales = _parciales_por_clave(almacen.fragmentos('UserForGenre'), _generos, consultas.parcial_user_for_genre)
+        tablas['UserForGenre'] = {g: consultas.final_user_for_genre(p) for g, p in sorted(parciales.items())}
+
+    if 'UsersRecommend' in disponibles:
+        tablas['UsersRecommend'] = {str(a): r for a, r in consultas.users_recommend_lote(almacen).items()}
+        tablas['UsersNotRecommend'] = {str(a): r for a, r in consultas.users_not_recommend_lote(almacen).items()}
+
+    if 'sentiment_analysis' in disponibles:
+        tablas['sentiment_analysis'] = {str(a): r for a, r in consultas.sentiment_analysis_lote(almacen).items()}
+
+    return tablas
+
+
+def guardar_agregados(tablas, ruta=None):
+    '''
+    Guarda las tablas junto con la huella de los archivos fuente.
+
+    Parameters:
+    - tablas (dict): Resultado de construir_agregados.
+    - ruta (str): Archivo de salida, por defecto configuracion.ruta_agregados.
+    '''
+    ruta = ruta or configuracion.ruta_agregados
+    os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+    contenido = {"fuentes": huella_archivos(configuracion.rutas_datasets), "tablas": tablas}
+    with gzip.open(ruta, 'wt', encoding='utf-8') as f:
+        json.dump(contenido, f, ensure_ascii=False, separators=(',', ':'))
+
+
+class Agregados:
+    '''
+    Tablas precalculadas cargadas en memoria.
+
+    Las tablas solo se usan si la huella guardada coincide con los archivos actuales;
+    si los datos se regeneraron sin reconstruir los agregados, la API calcula en vivo.
+    '''
+
+    def __init__(self):
+        self.tablas = {}
+
+    def cargar(self, ruta=None, raiz=''):
+        ruta = ruta or os.path.join(raiz, configuracion.ruta_agregados)
+        if not os.path.exists(ruta):
+            logger.info("No hay agregados precalculados en %s", ruta)
+            return
+        with gzip.open(ruta, 'rt', encoding='utf-8') as f:
+            contenido = json.load(f)
+        if contenido["fuentes"] != huella_archivos(configuracion.rutas_datasets, raiz):
+            logger.warning("Los agregados de %s no corresponden a los datos actuales, se ignoran", ruta)
+            return
+        self.tablas = contenido["tablas"]
+
+    def buscar(self, endpoint, clave):
+        '''
+        Busca una respuesta precalculada.
+
+        Parameters:
+        - endpoint (str): Nombre de la tabla (por ejemplo 'PlayTimeGenre').
+        - clave (str or int): Género o año.
+
+        Returns:
+        - tuple: (encontrado, respuesta). La respuesta puede ser None cuando el
+          resultado precalculado es "sin datos".
+        '''
+        tabla = self.tablas.get(endpoint)
+        if tabla is None or str(clave) not in tabla:
+            return False, None
+        return True, tabla[str(clave)]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    inicio = time.perf_counter()
+    almacen = AlmacenDatos()
+    almacen.cargar()
+    tablas = construir_agregados(almacen)
+    guardar_agregados(tablas)
+    claves = sum(len(t) for t in tablas.values())
+    logger.info("Agregados guardados en %s: %d respuestas en %.1f s (%d KB)", configuracion.ruta_agregados, claves,
+                time.perf_counter() - inicio, os.path.getsize(configuracion.ruta_agregados) // 1024)
@@ -0,0 +1,139 @@
+'''
+Arranque de la API en segundo plano.
+
+Importar pandas, pyarrow y scikit-learn, cargar los datasets y los modelos y ejecutar
+las primeras consultas lleva varios segundos. Si eso ocurre antes de que el servidor
+escuche, la plataforma da la instancia por caída; si ocurre en la primera consulta, esa
+consulta tarda segundos. Por eso:
+
+- main.py no importa los módulos pesados: el hook lifespan lanza la carga en un hilo y
+  el servidor empieza a escuchar enseguida;
+- la carga se divide en etapas con nombre, cuya duración se registra y se informa en
+  /health/ready, en /metrics y en el log al terminar;
+- hasta que la carga y el calentamiento terminan, /health/ready responde 503 y el resto
+  de los endpoints (salvo los de configuracion.rutas_sin_espera) también, con
+  Retry-After, para que el balanceador no mande tráfico a una instancia fría.
+
+Con configuracion.arranque_en_segundo_plano desactivado, el lifespan espera la carga
+antes de aceptar consultas, como un arranque tradicional.
+'''
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import configuracion
+
+
+logger = logging.getLogger(__name__)
+
+
+class Arranque:
+    '''
+    Progreso de la carga: etapas terminadas con su duración, etapa en curso y error.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.inicio = time.perf_counter()
+        self.etapas = {}
+        self.etapa = None
+        self.listo = False
+        self.error = None
+        self.segundos = None
+
+    @contextmanager
+    def medir(self, nombre):
+        '''
+        Registra la duración de una etapa de la carga.
+        '''
+        with self._lock:
+            self.etapa = nombre
+        inicio = time.perf_counter()
+        yield
+        # Si la etapa falla queda como etapa en curso, para informar dónde se detuvo la carga
+        with self._lock:
+            self.etapas[nombre] = time.perf_counter() - inicio
+            self.etapa = None
+
+    def _correr(self, cargar):
+        try:
+            cargar()
+        except Exception as e:
+            with self._lock:
+                self.error = f"{type(e).__name__}: {e}"
+            logger.exception("Falló el arranque en la etapa %s", self.etapa)
+            return e
+        with self._lock:
+            self.segundos = time.perf_counter() - self.inicio
+            self.listo = True
+        logger.info("API lista en %.2f s (%s)", self.segundos,
+                    ", ".join(f"{nombre} {segundos:.2f} s" for nombre, segundos in self.etapas.items()))
+        return None
+
+    def iniciar(self, cargar):
+        '''
+        Ejecuta la función de carga en un hilo aparte.
+
+        Parameters:
+        - cargar (callable): Carga completa; sus etapas se miden con medir().
+
+        Returns:
+        - threading.Thread: El hilo de la carga.
+        '''
+        hilo = threading.Thread(target=self._correr, args=(cargar,), name="arranque", daemon=True)
+        hilo.start()
+        return hilo
+
+    def correr(self, cargar):
+        '''
+        Ejecuta la función de carga en el hilo actual y propaga su error.
+        '''
+        error = self._correr(cargar)
+        if error is not None:
+            raise error
+
+    def estado(self):
+        '''
+        Returns:
+        - dict: Si la API está lista, la etapa en curso, la duración de cada etapa terminada
+          (en segundos), el tiempo total y el error, si lo hubo.
+        '''
+        with self._lock:
+            return {
+                "listo": self.listo,
+                "etapa": self.etapa,
+                "etapas_segundos": {nombre: round(segundos, 3) for nombre, segundos in self.etapas.items()},
+                "segundos": round(self.segundos if self.listo else time.perf_counter() - self.inicio, 3),
+                "error": self.error,
+            }
+
+
+class EsperaArranque:
+    '''
+    Middleware ASGI que responde 503 mientras la API no terminó de arrancar, salvo en las
+    rutas de configuracion.rutas_sin_espera (salud, métricas y documentación).
+    '''
+
+    def __init__(self, app, arranque):
+        self.app = app
+        self.arranque = arranque
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.arranque.listo or scope["path"] in configuracion.rutas_sin_espera:
+            return await self.app(scope, receive, send)
+
+        estado = self.arranque.estado()
+        if estado["error"] is not None:
+            detalle = f"La API no pudo iniciar: {estado['error']}"
+        else:
+            detalle = f"La API se está iniciando (etapa: {estado['etapa']})"
+        cuerpo = json.dumps({"detail": detalle}).encode()
+        await send({"type": "http.response.start", "status": 503, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(cuerpo)).encode()),
+            (b"retry-after", b"1"),
+        ]})
+        await send({"type": "http.response.body", "body": cuerpo})
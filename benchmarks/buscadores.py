@@ -0,0 +1,197 @@
+'''
+Benchmark de los buscadores de juegos similares (similitud.py): recall@K y latencia del
+buscador 'lsh' con distintas tablas y bits y del buscador 'particionado' con distintas
+cantidades de procesos, contra el buscador 'exacto'.
+
+    python benchmarks/buscadores.py --datos benchmarks/datos/1M
+    python benchmarks/buscadores.py --juegos 200000 --tablas 8 16 --bits 12 16
+    python benchmarks/buscadores.py --juegos 200000 --tablas --particiones 1 2 4 8 --hilos 8
+
+Con --datos se entrena el modelo sobre el catálogo completo de ese directorio; con
+--juegos, sobre un catálogo sintético de ese tamaño armado como en generar_datos.py.
+
+El recall@K cuenta, de los K juegos que devuelve 'lsh', los que tienen un score al menos
+igual al del K-ésimo juego exacto: con textos repetidos hay muchos empates y dos listas
+igual de buenas pueden tener juegos distintos. Se informa la latencia por consulta
+(consultas de a una) y el tiempo de calcular los vecinos de todas las consultas por bloques,
+que es lo que escala con el catálogo al entrenar el modelo. Para 'exacto' y 'particionado'
+se informan además las consultas por segundo con --hilos consultas de a una en paralelo,
+como las atiende la API: 'particionado' debería escalar con los núcleos de la máquina hasta
+--particiones, mientras que 'exacto' queda limitado por el GIL en la parte en Python.
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generar_datos import _catalogo
+from medir import resumir
+
+
+def juegos_sinteticos(num_juegos, semilla=0):
+    catalogo = _catalogo(np.random.default_rng(semilla), num_juegos)
+    titulos = catalogo['title'].to_pylist()
+    generos = catalogo['genres'].to_pylist()
+    return pd.DataFrame({'item_id': catalogo['item_id'], 'title': titulos,
+                         'texto': [f'{t} {g}' for t, g in zip(titulos, generos)]})
+
+
+def vecinos(modelo, item_ids, k, tamano_bloque):
+    inicio = time.perf_counter()
+    resultado = dict(modelo._mas_similares(item_ids, k, tamano_bloque))
+    return resultado, round(time.perf_counter() - inicio, 3)
+
+
+def latencias(modelo, item_ids, k):
+    duraciones = []
+    for item_id in item_ids:
+        inicio = time.perf_counter()
+        list(modelo._mas_similares([item_id], k))
+        duraciones.append(time.perf_counter() - inicio)
+    return resumir(duraciones)
+
+
+def rendimiento(modelo, item_ids, k, hilos):
+    '''
+    Consultas por segundo con `hilos` consultas de a una en paralelo.
+    '''
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(hilos) as pool:
+        for _ in pool.map(lambda item_id: list(modelo._mas_similares([item_id], k)), item_ids):
+            pass
+    return round(len(item_ids) / (time.perf_counter() - inicio), 1)
+
+
+def recall(exactos, aproximados, k):
+    '''
+    Fracción de los juegos aproximados cuyo score alcanza el del K-ésimo juego exacto.
+    '''
+    aciertos = total = 0
+    for item_id, elegidos in exactos.items():
+        if not elegidos:
+            continue
+        umbral = elegidos[-1][2] - 1e-6
+        aciertos += min(sum(score >= umbral for _, _, score in aproximados[item_id]), len(elegidos))
+        total += len(elegidos)
+    return round(aciertos / total, 4) if total else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara los buscadores de similitud exacto, LSH y particionado")
+    parser.add_argument('--datos', help="Directorio con Jupyter/df_RecomendacionJuego_gzip.parquet")
+    parser.add_argument('--juegos', type=int, default=50000, help="Tamaño del catálogo sintético, sin --datos")
+    parser.add_argument('--consultas', type=int, default=1000)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--tablas', type=int, nargs='*', default=[4, 8, 16], help="Sin valores se omite 'lsh'")
+    parser.add_argument('--bits', type=int, nargs='+', default=[8, 12, 16])
+    parser.add_argument('--sondeos', type=int, nargs='+', default=[2])
+    parser.add_argument('--particiones', type=int, nargs='*', default=[1, 2, 4], help="Sin valores se omite 'particionado'")
+    parser.add_argument('--hilos', type=int, default=4, help="Consultas simultáneas al medir consultas por segundo")
+    parser.add_argument('--salida', help="Archivo JSON de resultados, por defecto se imprime")
+    args = parser.parse_args()
+
+    salida = os.path.abspath(args.salida) if args.salida else None
+    if args.datos:
+        os.chdir(os.path.abspath(args.datos))
+    from datos import AlmacenDatos
+    from recomendacion import ModeloRecomendacion
+    from similitud import crear_buscador
+
+    if args.datos:
+        almacen = AlmacenDatos('exacto')
+        almacen.cargar(['RecomendacionJuego'])
+        juegos = almacen.obtener('RecomendacionJuego')
+    else:
+        juegos = juegos_sinteticos(args.juegos)
+    inicio = time.perf_counter()
+    modelo = ModeloRecomendacion.entrenar(juegos, calcular_vecinos=False)
+    entrenamiento = round(time.perf_counter() - inicio, 3)
+
+    rng = np.random.default_rng(0)
+    todos = list(modelo._filas_por_item)
+    consultas = [todos[i] for i in rng.choice(len(todos), min(args.consultas, len(todos)), replace=False)]
+
+    modelo._buscador = crear_buscador(modelo.matriz, 'exacto')
+    exactos, t_exacto = vecinos(modelo, consultas, args.k, 512)
+    informe = {
+        "juegos": modelo.matriz.shape[0],
+        "terminos": modelo.matriz.shape[1],
+        "consultas": len(consultas),
+        "k": args.k,
+        "entrenamiento_s": entrenamiento,
+        "hilos": args.hilos,
+        "exacto": {"vecinos_s": t_exacto, "latencia": latencias(modelo, consultas[:200], args.k),
+                   "consultas_por_segundo": rendimiento(modelo, consultas, args.k, args.hilos)},
+        "lsh": [],
+        "particionado": [],
+    }
+    print(f"exacto: vecinos {t_exacto:.2f} s, p50 {informe['exacto']['latencia']['p50_ms']:.2f} ms, "
+          f"{informe['exacto']['consultas_por_segundo']} consultas/s", file=sys.stderr)
+
+    for tablas in args.tablas:
+        for bits in args.bits:
+            for sondeos in args.sondeos:
+                inicio = time.perf_counter()
+                buscador = crear_buscador(modelo.matriz, 'lsh', tablas=tablas, bits=bits, sondeos=sondeos)
+                construccion = round(time.perf_counter() - inicio, 3)
+                modelo._buscador = buscador
+                aproximados, t_lsh = vecinos(modelo, consultas, args.k, 512)
+                filas = [modelo._filas_por_item[i][0] for i in consultas]
+                candidatos = len(buscador.candidatos(np.asarray(modelo.matriz[filas] @ buscador.planos))[0]) / len(filas)
+                resultado = {
+                    "tablas": tablas, "bits": bits, "sondeos": sondeos,
+                    "construccion_s": construccion,
+                    "candidatos_medios": round(float(candidatos), 1),
+                    f"recall@{args.k}": recall(exactos, aproximados, args.k),
+                    "vecinos_s": t_lsh,
+                    "aceleracion_vecinos": round(t_exacto / t_lsh, 2) if t_lsh else None,
+                    "latencia": latencias(modelo, consultas[:200], args.k),
+                }
+                informe["lsh"].append(resultado)
+                print(f"lsh tablas={tablas} bits={bits} sondeos={sondeos}: recall {resultado[f'recall@{args.k}']}, "
+                      f"candidatos {resultado['candidatos_medios']}, vecinos {t_lsh:.2f} s, "
+                      f"p50 {resultado['latencia']['p50_ms']:.2f} ms", file=sys.stderr)
+
+    for particiones in args.particiones:
+        inicio = time.perf_counter()
+        buscador = crear_buscador(modelo.matriz, 'particionado', particiones=particiones)
+        construccion = round(time.perf_counter() - inicio, 3)
+        modelo._buscador = buscador
+        # La primera consulta espera a que los procesos terminen de importar numpy y scipy
+        list(modelo._mas_similares(consultas[:1], args.k))
+        arranque = round(time.perf_counter() - inicio, 3)
+        particionados, t_particionado = vecinos(modelo, consultas, args.k, 512)
+        resultado = {
+            "particiones": buscador.particiones,
+            "construccion_s": construccion,
+            "arranque_s": arranque,
+            f"recall@{args.k}": recall(exactos, particionados, args.k),
+            "vecinos_s": t_particionado,
+            "aceleracion_vecinos": round(t_exacto / t_particionado, 2) if t_particionado else None,
+            "latencia": latencias(modelo, consultas[:200], args.k),
+            "consultas_por_segundo": rendimiento(modelo, consultas, args.k, args.hilos),
+        }
+        buscador.cerrar()
+        informe["particionado"].append(resultado)
+        print(f"particionado particiones={buscador.particiones}: recall {resultado[f'recall@{args.k}']}, "
+              f"vecinos {t_particionado:.2f} s, p50 {resultado['latencia']['p50_ms']:.2f} ms, "
+              f"{resultado['consultas_por_segundo']} consultas/s", file=sys.stderr)
+    modelo._buscador = None
+
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if salida:
+        with open(salida, 'w', encoding='utf-8') as f:
+            f.write(texto + '\n')
+    else:
+        print(texto)
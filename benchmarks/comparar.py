@@ -0,0 +1,85 @@
+'''
+Compara dos resultados de medir.py (por ejemplo, antes y después de un commit).
+
+    python benchmarks/comparar.py base.json nuevo.json --umbral 10
+
+Muestra la variación porcentual de cada métrica por endpoint y termina con código 1
+si alguna empeora más que el umbral: latencias que suben o throughput que baja. El
+crecimiento de memoria de cada endpoint (rss_delta_MB) suele estar cerca de cero, así que
+se compara en MB contra --umbral-mb y no en porcentaje.
+'''
+
+import argparse
+import json
+import sys
+
+
+# métrica: True si un valor más alto es mejor
+METRICAS = {"p50_ms": False, "p95_ms": False, "p99_ms": False, "rps": True}
+# Métricas que se comparan por diferencia absoluta (más alto es peor)
+METRICAS_MB = ("rss_delta_MB",)
+
+
+def comparar(base, nuevo, umbral, umbral_mb=5.0):
+    '''
+    Compara los resultados endpoint por endpoint.
+
+    Parameters:
+    - base (dict): Informe de referencia.
+    - nuevo (dict): Informe a evaluar.
+    - umbral (float): Porcentaje de empeoramiento tolerado.
+    - umbral_mb (float): Crecimiento de memoria tolerado, en MB.
+
+    Returns:
+    - list: Tuplas (medición, endpoint, métrica, base, nuevo, variación, es_regresion).
+      La variación es en % salvo en las métricas de METRICAS_MB, donde es en MB.
+    '''
+    filas = []
+    for medicion, endpoints in nuevo["resultados"].items():
+        for endpoint, metricas in endpoints.items():
+            referencia = base["resultados"].get(medicion, {}).get(endpoint)
+            if referencia is None:
+                continue
+            for metrica, mayor_es_mejor in METRICAS.items():
+                antes, despues = referencia[metrica], metricas[metrica]
+                variacion = 100 * (despues - antes) / antes if antes else 0.0
+                empeora = -variacion if mayor_es_mejor else variacion
+                filas.append((medicion, endpoint, metrica, antes, despues, variacion, empeora > umbral))
+            # Los informes anteriores a rss_delta_MB no tienen con qué comparar
+            for metrica in METRICAS_MB:
+                if metrica in referencia and metrica in metricas:
+                    variacion = metricas[metrica] - referencia[metrica]
+                    filas.append((medicion, endpoint, metrica, referencia[metrica], metricas[metrica], variacion, variacion > umbral_mb))
+    return filas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara dos resultados de benchmark")
+    parser.add_argument('base')
+    parser.add_argument('nuevo')
+    parser.add_argument('--umbral', type=float, default=10.0, help="Porcentaje de empeoramiento tolerado")
+    parser.add_argument('--umbral-mb', type=float, default=5.0, help="Crecimiento de memoria tolerado por endpoint, en MB")
+    args = parser.parse_args()
+
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.nuevo, encoding='utf-8') as f:
+        nuevo = json.load(f)
+
+    print(f"base: {base['metadatos'].get('commit')}  nuevo: {nuevo['metadatos'].get('commit')}")
+    if base['metadatos'].get('filas') != nuevo['metadatos'].get('filas'):
+        print("Aviso: los resultados se midieron sobre datos distintos")
+    opciones = [opcion for opcion in ('modo', 'artefactos', 'cubo', 'cache')
+                if base['metadatos'].get(opcion) != nuevo['metadatos'].get(opcion)]
+    if opciones:
+        print(f"Aviso: los resultados se midieron con opciones distintas ({', '.join(opciones)})")
+
+    regresiones = 0
+    for medicion, endpoint, metrica, antes, despues, variacion, es_regresion in comparar(base, nuevo, args.umbral, args.umbral_mb):
+        marca = "  REGRESIÓN" if es_regresion else ""
+        regresiones += es_regresion
+        unidad = " MB" if metrica in METRICAS_MB else "%"
+        print(f"{medicion:>10} {endpoint:<20} {metrica:<12} {antes:>10.2f} -> {despues:>10.2f} ({variacion:+7.1f}{unidad}){marca}")
+
+    print(f"{regresiones} regresiones con umbral {args.umbral}% y {args.umbral_mb} MB")
+    sys.exit(1 if regresiones else 0)
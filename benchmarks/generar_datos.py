@@ -0,0 +1,142 @@
+'''
+Generador de datos sintéticos con los esquemas de los archivos que consume la API.
+
+Escribe los cinco archivos df_*_gzip.parquet en <salida>/Jupyter, con las mismas
+columnas y tipos que los generados por los notebooks: un catálogo de juegos con
+géneros, títulos y años de lanzamiento, usuarios, horas jugadas y reseñas con
+recomendación y sentimiento. La popularidad de los juegos sigue una ley de potencia,
+como en los datos reales de Steam.
+
+    python benchmarks/generar_datos.py --filas 10k
+    python benchmarks/generar_datos.py --filas 1M
+    python benchmarks/generar_datos.py --filas 10M --salida /datos/bench/10M
+
+Las filas se generan y se escriben por bloques, así que la memoria no depende del
+tamaño pedido. Con la misma semilla los archivos son idénticos.
+'''
+
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+logger = logging.getLogger(__name__)
+
+GENEROS = ['Action', 'Indie', 'Adventure', 'Casual', 'Simulation', 'Strategy', 'RPG', 'Free to Play',
+           'Early Access', 'Sports', 'Massively Multiplayer', 'Racing', 'Design &amp; Illustration', 'Utilities']
+PALABRAS = ['Space', 'Dark', 'Legend', 'Kart', 'Quest', 'Wars', 'Farm', 'City', 'Hero', 'Dungeon', 'Zombie', 'Tactics']
+
+TAMANOS = {'10k': 10_000, '1M': 1_000_000, '10M': 10_000_000}
+
+ARCHIVOS = {
+    'df_PlayTimeGenre_gzip.parquet': pa.schema([('genres', pa.string()), ('release_date', pa.int32()),
+                                                 ('item_id', pa.int32()), ('playtime_forever', pa.int64())]),
+    'df_UserForGenre_gzip.parquet': pa.schema([('genres', pa.string()), ('release_date', pa.int32()), ('item_id', pa.int32()),
+                                                ('playtime_forever', pa.int64()), ('user_id', pa.string())]),
+    'df_UsersRecommend_gzip.parquet': pa.schema([('title', pa.string()), ('item_id', pa.int32()), ('reviews_posted', pa.int64()),
+                                                  ('reviews_recommend', pa.bool_()), ('sentiment_analysis', pa.int64())]),
+    'df_sentiment_analysis_gzip.parquet': pa.schema([('release_date', pa.int32()), ('item_id', pa.int32()),
+                                                      ('sentiment_analysis', pa.int64())]),
+    'df_RecomendacionJuego_gzip.parquet': pa.schema([('genres', pa.string()), ('title', pa.string()), ('item_id', pa.int32())]),
+}
+
+
+def interpretar_tamano(texto):
+    '''
+    Convierte '10k', '1M', '10M' o un número en cantidad de filas.
+    '''
+    if texto in TAMANOS:
+        return TAMANOS[texto]
+    return int(texto)
+
+
+def _catalogo(rng, num_juegos):
+    generos = []
+    for _ in range(num_juegos):
+        cantidad = rng.integers(1, 4)
+        generos.append(str([str(g) for g in rng.choice(GENEROS, cantidad, replace=False)]))
+    titulos = [f"{rng.choice(PALABRAS)} {rng.choice(PALABRAS)} {i}" for i in range(num_juegos)]
+    return {
+        'item_id': np.arange(1, num_juegos + 1, dtype=np.int32) * 10,
+        'title': pa.array(titulos, pa.string()),
+        'genres': pa.array(generos, pa.string()),
+        'release_date': rng.integers(1990, 2022, num_juegos).astype(np.int32),
+    }
+
+
+def _texto(indices, valores):
+    # Las columnas de texto se arman como diccionario y se expanden a string, como en los originales
+    return pa.DictionaryArray.from_arrays(pa.array(indices, pa.int32()), valores).cast(pa.string())
+
+
+def generar(filas, salida, semilla=0, filas_por_bloque=1_000_000, filas_por_row_group=1_000_000):
+    '''
+    Genera los cinco archivos Parquet.
+
+    Parameters:
+    - filas (int): Filas de cada archivo.
+    - salida (str): Directorio base; los archivos se escriben en <salida>/Jupyter.
+    - semilla (int): Semilla del generador aleatorio.
+    - filas_por_bloque (int): Filas que se generan en memoria a la vez.
+    - filas_por_row_group (int): Filas por row group de los archivos.
+
+    Returns:
+    - dict: Tamaño en bytes de cada archivo.
+    '''
+    rng = np.random.default_rng(semilla)
+    num_juegos = int(np.clip(filas // 200, 200, 50_000))
+    num_usuarios = max(100, filas // 50)
+    catalogo = _catalogo(rng, num_juegos)
+    popularidad = 1 / np.arange(1, num_juegos + 1) ** 1.1
+    popularidad /= popularidad.sum()
+    usuarios = pa.array([f"usuario{u}" for u in range(num_usuarios)], pa.string())
+
+    directorio = os.path.join(salida, 'Jupyter')
+    os.makedirs(directorio, exist_ok=True)
+    writers = {nombre: pq.ParquetWriter(os.path.join(directorio, nombre), esquema, compression='gzip')
+               for nombre, esquema in ARCHIVOS.items()}
+    try:
+        for inicio in range(0, filas, filas_por_bloque):
+            n = min(filas_por_bloque, filas - inicio)
+            juego = rng.choice(num_juegos, n, p=popularidad)
+            columnas = {
+                'genres': _texto(juego, catalogo['genres']),
+                'title': _texto(juego, catalogo['title']),
+                'item_id': pa.array(catalogo['item_id'][juego]),
+                'release_date': pa.array(catalogo['release_date'][juego]),
+                'playtime_forever': pa.array(rng.lognormal(5, 1.5, n).astype(np.int64)),
+                'user_id': _texto(rng.integers(0, num_usuarios, n), usuarios),
+                'reviews_posted': pa.array(rng.integers(2010, 2016, n).astype(np.int64)),
+                'reviews_recommend': pa.array(rng.random(n) < 0.85),
+                'sentiment_analysis': pa.array(rng.choice(3, n, p=[0.15, 0.35, 0.5]).astype(np.int64)),
+            }
+            for nombre, esquema in ARCHIVOS.items():
+                tabla = pa.table({campo.name: columnas[campo.name] for campo in esquema}, schema=esquema)
+                writers[nombre].write_table(tabla, row_group_size=filas_por_row_group)
+            logger.info("%d de %d filas generadas", inicio + n, filas)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return {nombre: os.path.getsize(os.path.join(directorio, nombre)) for nombre in ARCHIVOS}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Genera datos sintéticos para los benchmarks")
+    parser.add_argument('--filas', default='10k', help="10k, 1M, 10M o una cantidad de filas")
+    parser.add_argument('--salida', help="Directorio de salida, por defecto benchmarks/datos/<filas>")
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--filas-por-row-group', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    salida = args.salida or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datos', args.filas)
+    inicio = time.perf_counter()
+    tamanos = generar(interpretar_tamano(args.filas), salida, args.semilla, filas_por_row_group=args.filas_por_row_group)
+    logger.info("Datos generados en %s en %.1f s", salida, time.perf_counter() - inicio)
+    for nombre, tamano in tamanos.items():
+        logger.info("  %s: %.1f MB", nombre, tamano / 2**20)
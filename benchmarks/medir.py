@@ -0,0 +1,271 @@
+'''
+Benchmark de los endpoints de la API.
+
+Mide cada endpoint de dos formas sobre un directorio de datos (por ejemplo, el
+generado con generar_datos.py):
+
+- 'en_proceso': llama directamente a las funciones que calculan la respuesta.
+- 'asgi': hace los GET a través de la aplicación FastAPI con un cliente ASGI,
+  incluyendo validación, serialización y middlewares.
+
+Para cada endpoint informa latencia p50/p95/p99, throughput secuencial y cuánto creció
+la memoria residente del proceso durante sus consultas (rss_delta_MB: RSS actual al
+terminar menos RSS antes del calentamiento, no el pico del proceso, que arrastraría el
+de los endpoints anteriores). El pico del proceso se informa aparte, tras la carga y al
+final. Guarda todo en un JSON que se puede comparar entre commits con comparar.py:
+
+    BENCH_DATOS=benchmarks/datos/1M python benchmarks/medir.py --salida base.json
+    python benchmarks/comparar.py base.json nuevo.json
+
+Por defecto se mide el cálculo en vivo en las dos formas: no se usan agregados ni modelo
+guardados, no se arma el cubo de agregados por año (cubo.py) y el cache de respuestas está
+desactivado. --artefactos construye agregados y modelo antes de medir, --cubo arma el cubo
+(con el que 'asgi' responde desde el cubo las consultas que cubre, mientras 'en_proceso'
+sigue calculando en vivo) y --cache deja el cache activo. Solo conviene comparar
+resultados medidos con las mismas opciones.
+'''
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow.parquet as pq
+
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generar_datos import GENEROS
+
+
+# Dataset que necesita cada endpoint (el de recomendación usa el modelo)
+DATASETS = {
+    'PlayTimeGenre': 'PlayTimeGenre',
+    'UserForGenre': 'UserForGenre',
+    'UsersRecommend': 'UsersRecommend',
+    'UsersNotRecommend': 'UsersRecommend',
+    'sentiment_analysis': 'sentiment_analysis',
+}
+
+
+def _rss_pico_mb():
+    # En Linux ru_maxrss está expresado en KB
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10, 1)
+
+
+def _rss_actual_mb():
+    # La segunda columna de /proc/self/statm son las páginas residentes
+    with open('/proc/self/statm') as f:
+        paginas = int(f.read().split()[1])
+    return paginas * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def resumir(latencias, errores=0, rss_delta_mb=0.0):
+    '''
+    Resume las latencias de un endpoint.
+
+    Parameters:
+    - latencias (list): Duración de cada consulta en segundos.
+    - errores (int): Respuestas HTTP distintas de 200.
+    - rss_delta_mb (float): Crecimiento del RSS durante las consultas del endpoint.
+
+    Returns:
+    - dict: Percentiles y media en milisegundos, consultas por segundo, errores y
+      crecimiento del RSS.
+    '''
+    ms = np.array(latencias) * 1000
+    return {
+        "consultas": len(ms),
+        "errores": errores,
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "media_ms": round(float(ms.mean()), 3),
+        "max_ms": round(float(ms.max()), 3),
+        "rps": round(len(ms) / (ms.sum() / 1000), 2),
+        "rss_delta_MB": round(rss_delta_mb, 1),
+    }
+
+
+def medir(funcion, claves, repeticiones, calentamiento):
+    '''
+    Ejecuta la función recorriendo las claves en forma cíclica y devuelve el resumen.
+    Si la función devuelve una respuesta HTTP, cuenta las que no son 200. La memoria se
+    mide como RSS actual antes y después, así que solo cuenta lo que creció con este
+    endpoint.
+    '''
+    rss_inicial = _rss_actual_mb()
+    for i in range(calentamiento):
+        funcion(claves[i % len(claves)])
+    latencias = []
+    errores = 0
+    for i in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion(claves[i % len(claves)])
+        latencias.append(time.perf_counter() - inicio)
+        errores += getattr(resultado, 'status_code', 200) != 200
+    return resumir(latencias, errores, _rss_actual_mb() - rss_inicial)
+
+
+def claves_de_prueba(semilla=0):
+    '''
+    Elige las claves consultadas a partir de los archivos de datos del directorio actual.
+
+    Returns:
+    - dict: Géneros, años de reseña, años de lanzamiento e item_id a consultar.
+    '''
+    import configuracion
+
+    def unicos(ruta, columna):
+        return sorted(set(pq.read_table(ruta, columns=[columna])[columna].to_pylist()) - {None})
+
+    rng = np.random.default_rng(semilla)
+    item_ids = unicos(configuracion.parquet_file_path5, 'item_id')
+    return {
+        "generos": GENEROS,
+        "anios_resenas": [int(a) for a in unicos(configuracion.parquet_file_path3, 'reviews_posted')],
+        "anios_lanzamiento": [int(a) for a in unicos(configuracion.parquet_file_path4, 'release_date')],
+        "item_ids": [int(i) for i in rng.choice(item_ids, min(100, len(item_ids)), replace=False)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide latencia, throughput y memoria de los endpoints")
+    parser.add_argument('--datos', default=os.getenv('BENCH_DATOS', os.path.join(RAIZ, 'benchmarks', 'datos', '10k')),
+                        help="Directorio con Jupyter/df_*_gzip.parquet (variable de entorno BENCH_DATOS)")
+    parser.add_argument('--modo', choices=['muestra', 'exacto'], default=os.getenv('MODO_CONSULTA', 'muestra'))
+    parser.add_argument('--repeticiones', type=int, default=100)
+    parser.add_argument('--calentamiento', type=int, default=5)
+    parser.add_argument('--artefactos', action='store_true', help="Construye y usa agregados y modelo guardados")
+    parser.add_argument('--cubo', action='store_true', help="Arma el cubo de agregados por año")
+    parser.add_argument('--cache', action='store_true', help="Deja activo el cache de respuestas")
+    parser.add_argument('--salida', help="Archivo JSON de resultados, por defecto se imprime")
+    args = parser.parse_args()
+
+    salida = os.path.abspath(args.salida) if args.salida else None
+    # La configuración se lee de variables de entorno al importar los módulos de la API
+    os.environ['MODO_CONSULTA'] = args.modo
+    # La carga se mide completa al iniciar el cliente, no en segundo plano
+    os.environ['ARRANQUE_SEGUNDO_PLANO'] = '0'
+    if not args.cache:
+        os.environ['CACHE_MAX_ENTRADAS'] = '0'
+    os.environ['CUBO_AGREGADOS'] = '1' if args.cubo else '0'
+    os.chdir(os.path.abspath(args.datos))
+
+    import configuracion
+    if args.artefactos:
+        configuracion.ruta_agregados = os.path.join('Artefactos', 'agregados.json.gz')
+        configuracion.directorio_modelo = os.path.join('Artefactos', 'modelo_recomendacion')
+    else:
+        vacio = tempfile.mkdtemp(prefix='bench_')
+        configuracion.ruta_agregados = os.path.join(vacio, 'agregados.json.gz')
+        configuracion.directorio_modelo = os.path.join(vacio, 'modelo_recomendacion')
+
+    import consultas
+    from fastapi.testclient import TestClient
+
+    artefactos = {}
+    if args.artefactos:
+        from agregados import construir_agregados, guardar_agregados
+        from datos import AlmacenDatos
+        from recomendacion import ModeloRecomendacion
+
+        inicio = time.perf_counter()
+        almacen_construccion = AlmacenDatos()
+        almacen_construccion.cargar()
+        guardar_agregados(construir_agregados(almacen_construccion))
+        artefactos['agregados_s'] = round(time.perf_counter() - inicio, 3)
+        inicio = time.perf_counter()
+        ModeloRecomendacion.entrenar(almacen_construccion.obtener('RecomendacionJuego')).guardar()
+        artefactos['modelo_s'] = round(time.perf_counter() - inicio, 3)
+        del almacen_construccion
+
+    claves = claves_de_prueba()
+    import main as api
+
+    inicio = time.perf_counter()
+    with TestClient(api.app) as cliente:
+        carga = {"segundos": round(time.perf_counter() - inicio, 3), "rss_pico_MB": _rss_pico_mb()}
+
+        instantanea = api.gestor.actual
+        almacen, modelo_recomendacion = instantanea.almacen, instantanea.modelo_recomendacion
+        en_proceso = {
+            'PlayTimeGenre': (claves['generos'], lambda g: consultas.play_time_genre(almacen.fragmentos('PlayTimeGenre'), [g])),
+            'UserForGenre': (claves['generos'], lambda g: consultas.user_for_genre(almacen.fragmentos('UserForGenre'), [g])),
+            'UsersRecommend': (claves['anios_resenas'], lambda a: consultas.users_recommend(almacen, a)),
+            'UsersNotRecommend': (claves['anios_resenas'], lambda a: consultas.users_not_recommend(almacen, a)),
+            'sentiment_analysis': (claves['anios_lanzamiento'], lambda a: consultas.sentiment_analysis(almacen, a)),
+            'Recomendacion_Juego': (claves['item_ids'], lambda i: modelo_recomendacion.recomendar(i, 5)),
+        }
+        asgi = {
+            'PlayTimeGenre': (claves['generos'], lambda g: cliente.get(f'/PlayTimeGenre/{g}')),
+            'UserForGenre': (claves['generos'], lambda g: cliente.get(f'/UserForGenre/{g}')),
+            'UsersRecommend': (claves['anios_resenas'], lambda a: cliente.get(f'/UsersRecommend/{a}')),
+            'UsersNotRecommend': (claves['anios_resenas'], lambda a: cliente.get(f'/UsersNotRecommend/{a}')),
+            'sentiment_analysis': (claves['anios_lanzamiento'], lambda a: cliente.get(f'/sentiment_analysis/{a}')),
+            'Recomendacion_Juego': (claves['item_ids'], lambda i: cliente.get(f'/Recomendacion_Juego/{i}')),
+        }
+
+        resultados = {"en_proceso": {}, "asgi": {}}
+        for medicion, endpoints in (("en_proceso", en_proceso), ("asgi", asgi)):
+            for endpoint, (claves_endpoint, funcion) in endpoints.items():
+                if endpoint == 'Recomendacion_Juego':
+                    if modelo_recomendacion is None:
+                        continue
+                elif DATASETS[endpoint] not in almacen.datasets and DATASETS[endpoint] not in almacen.en_disco:
+                    continue
+                resultados[medicion][endpoint] = medir(funcion, claves_endpoint, args.repeticiones, args.calentamiento)
+                print(f"{medicion:>10} {endpoint:<20} p50 {resultados[medicion][endpoint]['p50_ms']:>9.2f} ms  "
+                      f"p95 {resultados[medicion][endpoint]['p95_ms']:>9.2f} ms  "
+                      f"RSS {resultados[medicion][endpoint]['rss_delta_MB']:>+7.1f} MB", file=sys.stderr)
+    rss_pico = _rss_pico_mb()
+
+    filas = {os.path.basename(ruta): pq.ParquetFile(ruta).metadata.num_rows
+             for ruta in configuracion.rutas_datasets if os.path.exists(ruta)}
+    informe = {
+        "metadatos": {
+            "commit": _commit(),
+            "fecha": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "cpus": os.cpu_count(),
+            "datos": os.path.abspath('.'),
+            "filas": filas,
+            "modo": args.modo,
+            "repeticiones": args.repeticiones,
+            "artefactos": args.artefactos,
+            "cubo": args.cubo,
+            "cache": args.cache,
+        },
+        "construccion_artefactos": artefactos,
+        "carga": carga,
+        "rss_pico_MB": rss_pico,
+        "resultados": resultados,
+    }
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if salida:
+        with open(salida, 'w', encoding='utf-8') as f:
+            f.write(texto + '\n')
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
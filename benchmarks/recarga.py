@@ -0,0 +1,75 @@
+'''
+Recarga de instantáneas a través de la API.
+
+Arranca la API sobre un directorio de datos, pide POST /admin/recargar y espera a que la
+recarga termine. Informa la duración de cada etapa y termina con código 1 si la
+instantánea nueva no se publicó. Por defecto usa el directorio del proyecto, que no
+tiene todos los datasets: una recarga tiene que publicarse aunque falten los mismos
+datasets que en la instantánea vigente.
+
+    python benchmarks/recarga.py
+    python benchmarks/recarga.py --datos benchmarks/datos/10k --salida recarga.json
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide una recarga de instantánea y verifica que se publique")
+    parser.add_argument('--datos', default=RAIZ, help="Directorio con Jupyter/df_*_gzip.parquet")
+    parser.add_argument('--modo', choices=['muestra', 'exacto'], default=os.getenv('MODO_CONSULTA', 'muestra'))
+    parser.add_argument('--espera', type=float, default=300, help="Segundos máximos de espera de la recarga")
+    parser.add_argument('--salida', help="Archivo JSON de resultados, por defecto se imprime")
+    args = parser.parse_args()
+
+    salida = os.path.abspath(args.salida) if args.salida else None
+    # La configuración se lee de variables de entorno al importar los módulos de la API
+    token = 'recarga'
+    os.environ.update(MODO_CONSULTA=args.modo, ARRANQUE_SEGUNDO_PLANO='0', TOKEN_ADMIN=token, VIGILANCIA_SEGUNDOS='0')
+    os.chdir(os.path.abspath(args.datos))
+
+    from fastapi.testclient import TestClient
+    import main as api
+
+    with TestClient(api.app) as cliente:
+        inicial = cliente.get('/admin/instantanea').json()['vigente']
+        respuesta = cliente.post('/admin/recargar', headers={'Authorization': f'Bearer {token}'})
+        if respuesta.status_code != 202:
+            print(f"POST /admin/recargar respondió {respuesta.status_code}: {respuesta.text}", file=sys.stderr)
+            sys.exit(1)
+        limite = time.monotonic() + args.espera
+        estado = cliente.get('/admin/instantanea').json()
+        while estado['recarga']['en_curso'] and time.monotonic() < limite:
+            time.sleep(0.1)
+            estado = cliente.get('/admin/instantanea').json()
+
+    recarga = estado['recarga']
+    publicada = not recarga['en_curso'] and recarga['error'] is None and estado['vigente']['numero'] > inicial['numero']
+    informe = {
+        "datos": os.path.abspath('.'),
+        "modo": args.modo,
+        "disponibles": estado['vigente']['disponibles'],
+        "publicada": publicada,
+        "error": recarga['error'],
+        "segundos": recarga['segundos'],
+        "etapas_segundos": recarga['etapas_segundos'],
+    }
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if salida:
+        with open(salida, 'w', encoding='utf-8') as f:
+            f.write(texto + '\n')
+    else:
+        print(texto)
+    sys.exit(0 if publicada else 1)
+
+
+if __name__ == "__main__":
+    main()
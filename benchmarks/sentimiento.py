@@ -0,0 +1,82 @@
+'''
+Benchmark del análisis de sentimiento: Funciones.analisis_de_sentimiento reseña por
+reseña contra sentimiento.analisis_de_sentimiento_lote, con el cache vacío (primera
+corrida) y con el cache completo (corrida incremental).
+
+    python benchmarks/sentimiento.py --reseñas 20000
+    python benchmarks/sentimiento.py --parquet Data/user_reviews.parquet --columna reviews_review
+
+Verifica que las etiquetas sean idénticas y escribe los tiempos en JSON.
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(RAIZ, 'Jupyter'))
+
+import Funciones
+import sentimiento
+
+
+FRASES = ['great game', 'bad controls', 'fun with friends', 'boring story', 'not worth the price', 'amazing graphics',
+          'too many bugs', 'best game ever', 'it is ok', 'terrible servers', 'good soundtrack', 'awful ending',
+          'buy it', 'worst purchase', 'nice', '10/10', 'meh', 'love it', 'hate it', 'recommended']
+
+
+def resenas_sinteticas(cantidad, semilla=0):
+    '''
+    Reseñas cortas armadas con frases frecuentes, con repeticiones como en los datos reales
+    ("10/10", "great game") y algunas nulas.
+    '''
+    rng = np.random.default_rng(semilla)
+    resenas = [' '.join(rng.choice(FRASES, rng.integers(1, 4))) for _ in range(cantidad)]
+    for i in rng.choice(cantidad, cantidad // 100, replace=False):
+        resenas[i] = None
+    return pd.Series(resenas, dtype=object)
+
+
+def cronometrar(funcion):
+    inicio = time.perf_counter()
+    resultado = funcion()
+    return resultado, round(time.perf_counter() - inicio, 3)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara el análisis de sentimiento por reseña y por lotes")
+    parser.add_argument('--reseñas', type=int, default=20000, help="Cantidad de reseñas sintéticas")
+    parser.add_argument('--parquet', help="Archivo con reseñas reales, en lugar de las sintéticas")
+    parser.add_argument('--columna', default='reviews_review')
+    parser.add_argument('--procesos', type=int)
+    parser.add_argument('--salida', help="Archivo JSON de resultados, por defecto se imprime")
+    args = parser.parse_args()
+
+    resenas = pd.read_parquet(args.parquet, columns=[args.columna])[args.columna] if args.parquet else resenas_sinteticas(args.reseñas)
+
+    referencia, t_referencia = cronometrar(lambda: resenas.apply(Funciones.analisis_de_sentimiento))
+    cache = sentimiento.CachePolaridad()
+    primera, t_primera = cronometrar(lambda: sentimiento.analisis_de_sentimiento_lote(resenas, args.procesos, cache=cache))
+    incremental, t_incremental = cronometrar(lambda: sentimiento.analisis_de_sentimiento_lote(resenas, args.procesos, cache=cache))
+
+    informe = {
+        "reseñas": len(resenas),
+        "textos_distintos": int(resenas.dropna().nunique()),
+        "procesos": args.procesos or os.cpu_count(),
+        "segundos": {"por_reseña": t_referencia, "lote_cache_vacio": t_primera, "lote_cache_completo": t_incremental},
+        "aceleracion": {"lote_cache_vacio": round(t_referencia / t_primera, 1) if t_primera else None,
+                        "lote_cache_completo": round(t_referencia / t_incremental, 1) if t_incremental else None},
+        "etiquetas_identicas": bool(referencia.equals(primera) and referencia.equals(incremental)),
+    }
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto + '\n')
+    else:
+        print(texto)
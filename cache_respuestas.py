@@ -0,0 +1,134 @@
+'''
+Cache en memoria de las respuestas GET de la API.
+
+Guarda el cuerpo de cada respuesta exitosa con una clave formada por la ruta, los
+parámetros de la consulta y la versión de los datos (la de la instantánea vigente, ver
+instantaneas.py). Al publicarse una instantánea nueva cambia la versión, y las entradas
+anteriores dejan de usarse y se van descartando por LRU o por TTL.
+
+Cada respuesta lleva un ETag débil, de modo que un cliente o una CDN que ya tiene la
+respuesta puede revalidarla con If-None-Match y recibir un 304 sin cuerpo.
+'''
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import configuracion
+
+
+def version_datos(rutas=None, raiz=''):
+    '''
+    Resume la huella de los archivos de datos en un identificador corto.
+
+    Parameters:
+    - rutas (list): Archivos de datos, por defecto configuracion.rutas_datasets.
+    - raiz (str): Directorio de artefactos contra el que se resuelven las rutas.
+
+    Returns:
+    - str: Hash de tamaño, fecha de modificación y modo de consulta de los archivos.
+    '''
+    # agregados importa pandas y pyarrow: se importa recién al cargar los datos, no al
+    # importar main (ver arranque.py)
+    from agregados import huella_archivos
+
+    huella = huella_archivos(rutas or configuracion.rutas_datasets, raiz)
+    return hashlib.sha1(json.dumps(huella, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def etag_debil(version, cuerpo):
+    '''
+    ETag débil de una respuesta: versión de los datos más hash del cuerpo.
+    '''
+    return f'W/"{version}-{hashlib.sha1(cuerpo).hexdigest()[:16]}"'
+
+
+def coincide_etag(if_none_match, etag):
+    '''
+    Indica si el encabezado If-None-Match incluye el ETag (comparación débil).
+    '''
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    valor = etag[2:] if etag.startswith('W/') else etag
+    for candidato in if_none_match.split(','):
+        candidato = candidato.strip()
+        if (candidato[2:] if candidato.startswith('W/') else candidato) == valor:
+            return True
+    return False
+
+
+class CacheRespuestas:
+    '''
+    Diccionario LRU con vencimiento por TTL y contadores de aciertos y fallos.
+    '''
+
+    def __init__(self, max_entradas=None, ttl=None):
+        '''
+        Parameters:
+        - max_entradas (int): Cantidad máxima de respuestas guardadas, 0 desactiva el cache.
+        - ttl (float): Segundos que una respuesta se considera vigente.
+        '''
+        self.max_entradas = configuracion.cache_max_entradas if max_entradas is None else max_entradas
+        self.ttl = configuracion.cache_ttl_segundos if ttl is None else ttl
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.descartes = 0
+
+    @property
+    def habilitado(self):
+        return self.max_entradas > 0 and self.ttl > 0
+
+    def obtener(self, clave):
+        '''
+        Devuelve la respuesta guardada para la clave, o None si no está o venció.
+        '''
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] < time.monotonic():
+                del self._entradas[clave]
+                self.descartes += 1
+                entrada = None
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[1]
+
+    def guardar(self, clave, respuesta):
+        '''
+        Guarda una respuesta, descartando la usada hace más tiempo si se supera el tamaño.
+        '''
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + self.ttl, respuesta)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+                self.descartes += 1
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def estadisticas(self):
+        '''
+        Returns:
+        - dict: Entradas, capacidad, TTL, aciertos, fallos, descartes y tasa de aciertos.
+        '''
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
+                "ttl_segundos": self.ttl,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "descartes": self.descartes,
+                "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else None,
+            }
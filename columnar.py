@@ -0,0 +1,247 @@
+'''
+Formato columnar de los datasets servidos.
+
+    python columnar.py
+
+Los archivos df_*_gzip.parquet repiten en cada fila los textos de 'genres' (una lista
+escrita como texto), 'title' y 'user_id', y cada carga vuelve a decodificar millones de
+textos repetidos. La exportación escribe en configuracion.directorio_columnar:
+
+- dim_generos.parquet: un género por fila;
+- dim_listas_generos.parquet: cada valor distinto de 'genres', con su texto y la lista
+  de códigos de sus géneros (columna lista de Arrow: offsets y valores, como CSR);
+- dim_titulos.parquet y dim_usuarios.parquet: los títulos y usuarios distintos;
+- hechos_<dataset>.parquet: las filas de cada dataset con el código int32 de cada texto
+  (la posición del valor en su dimensión) y enteros chicos para años, minutos y
+  sentimientos.
+
+Todo se comprime con zstd, que se descomprime bastante más rápido que gzip. Las tablas
+de hechos conservan los row groups de los archivos originales, de modo que la muestra
+del modo 'muestra' (el primer row group) es la misma.
+
+Con FORMATO_DATOS=columnar la API lee las tablas de hechos y convierte cada columna de
+códigos en una columna de diccionario de Arrow (categórica en pandas) que apunta a su
+dimensión, sin decodificar textos fila por fila.
+'''
+
+import logging
+import os
+import time
+from functools import lru_cache
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import configuracion
+import lectura
+from indice_generos import interpretar_generos
+
+
+logger = logging.getLogger(__name__)
+
+# columna de texto: columna con su código en las tablas de hechos
+CODIGOS = {'genres': 'codigo_generos', 'title': 'codigo_titulo', 'user_id': 'codigo_usuario'}
+_ORIGINALES = {codigo: columna for columna, codigo in CODIGOS.items()}
+
+# Tipos de las columnas numéricas en las tablas de hechos
+TIPOS = {
+    'release_date': pa.int16(),
+    'item_id': pa.int32(),
+    'playtime_forever': pa.int32(),
+    'reviews_posted': pa.int16(),
+    'reviews_recommend': pa.bool_(),
+    'sentiment_analysis': pa.int8(),
+}
+
+COMPRESION = 'zstd'
+
+
+def columnas_hechos(columnas):
+    '''
+    Nombres en las tablas de hechos de las columnas de un dataset.
+    '''
+    return [CODIGOS.get(columna, columna) for columna in columnas]
+
+
+@lru_cache(maxsize=None)
+def _diccionario(ruta, _version):
+    columna = pq.read_schema(ruta).names[0]
+    return pq.read_table(ruta, columns=[columna])[columna].combine_chunks()
+
+
+def diccionario(columna, raiz=''):
+    '''
+    Valores distintos de una columna de texto, leídos una sola vez por versión del archivo.
+
+    Parameters:
+    - columna (str): 'genres', 'title' o 'user_id'.
+    - raiz (str): Directorio de artefactos de las dimensiones, por defecto el actual.
+
+    Returns:
+    - pa.Array: Los valores; el código de cada uno es su posición.
+    '''
+    ruta = os.path.join(raiz, configuracion.rutas_dimensiones[columna])
+    return _diccionario(ruta, os.stat(ruta).st_mtime_ns)
+
+
+def decodificar(tabla, raiz=''):
+    '''
+    Reemplaza las columnas de códigos de una tabla de hechos por columnas de diccionario
+    con el nombre original. Solo se arman los arreglos de diccionario: los textos no se copian.
+
+    Parameters:
+    - tabla (pa.Table): Columnas leídas de una tabla de hechos.
+    - raiz (str): Directorio de artefactos de las dimensiones, por defecto el actual.
+
+    Returns:
+    - pa.Table: La tabla con 'genres', 'title' y 'user_id' como columnas de diccionario.
+    '''
+    columnas = {}
+    for nombre, columna in zip(tabla.column_names, tabla.columns):
+        if nombre in _ORIGINALES:
+            valores = diccionario(_ORIGINALES[nombre], raiz)
+            nombre = _ORIGINALES[nombre]
+            columna = pa.chunked_array([pa.DictionaryArray.from_arrays(parte, valores) for parte in columna.chunks],
+                                       type=pa.dictionary(pa.int32(), valores.type))
+        columnas[nombre] = columna
+    return pa.table(columnas)
+
+
+def _texto(columna):
+    # 'genres' puede venir como lista de Arrow: se escribe igual que en los archivos de texto
+    if pa.types.is_list(columna.type) or pa.types.is_large_list(columna.type):
+        return pa.array([None if v is None else str([str(g) for g in v]) for v in columna.to_pylist()], pa.string())
+    return columna.cast(pa.string())
+
+
+def _row_groups(ruta, columnas=None):
+    for archivo in lectura.archivos(ruta):
+        parquet_file = pq.ParquetFile(archivo)
+        for i in range(parquet_file.num_row_groups):
+            yield parquet_file.read_row_group(i, columns=columnas)
+
+
+def construir_dimensiones(rutas):
+    '''
+    Recorre los archivos fuente y arma las dimensiones, ordenadas alfabéticamente como
+    las categorías que arma pandas.
+
+    Parameters:
+    - rutas (list): Archivos (o directorios por lotes) de los datasets.
+
+    Returns:
+    - dict: {columna de texto: pa.Array con sus valores distintos} y 'generos' con los
+      géneros individuales.
+    '''
+    distintos = {columna: set() for columna in CODIGOS}
+    for ruta in rutas:
+        presentes = [c for c in CODIGOS if c in pq.read_schema(lectura.archivos(ruta)[0]).names]
+        if not presentes:
+            continue
+        for tabla in _row_groups(ruta, presentes):
+            for columna in presentes:
+                distintos[columna].update(v for v in pc.unique(_texto(tabla[columna])).to_pylist() if v is not None)
+
+    dimensiones = {columna: pa.array(sorted(valores), pa.string()) for columna, valores in distintos.items()}
+    generos = sorted({g for texto in distintos['genres'] for g in interpretar_generos(texto)})
+    dimensiones['generos'] = pa.array(generos, pa.string())
+    return dimensiones
+
+
+def guardar_dimensiones(dimensiones):
+    '''
+    Escribe las dimensiones. Las listas de géneros llevan, además del texto original,
+    los códigos de sus géneros.
+    '''
+    codigo_genero = {genero: i for i, genero in enumerate(dimensiones['generos'].to_pylist())}
+    listas = [[codigo_genero[g] for g in interpretar_generos(texto)] for texto in dimensiones['genres'].to_pylist()]
+    tablas = {
+        configuracion.ruta_dim_generos: pa.table({'genero': dimensiones['generos']}),
+        configuracion.rutas_dimensiones['genres']: pa.table({'texto': dimensiones['genres'],
+                                                             'generos': pa.array(listas, pa.list_(pa.int16()))}),
+        configuracion.rutas_dimensiones['title']: pa.table({'title': dimensiones['title']}),
+        configuracion.rutas_dimensiones['user_id']: pa.table({'user_id': dimensiones['user_id']}),
+    }
+    for ruta, tabla in tablas.items():
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        pq.write_table(tabla, ruta, compression=COMPRESION)
+
+
+def _numerica(columna, tipo):
+    if pa.types.is_string(columna.type) or pa.types.is_large_string(columna.type):
+        # Años guardados como texto: los inválidos quedan nulos, como en la carga de la API
+        columna = pa.array(pd.to_numeric(columna.to_pandas(), errors='coerce').round().astype('Int64'))
+    try:
+        return columna.cast(tipo)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return columna
+
+
+def codificar(tabla, dimensiones):
+    '''
+    Convierte un row group de un archivo fuente en filas de la tabla de hechos.
+
+    Returns:
+    - pa.Table: Códigos int32 en lugar de textos y enteros chicos en las columnas numéricas.
+    '''
+    columnas = {}
+    for nombre, columna in zip(tabla.column_names, tabla.columns):
+        if nombre in CODIGOS:
+            columnas[CODIGOS[nombre]] = pc.index_in(_texto(columna), value_set=dimensiones[nombre])
+        elif nombre in TIPOS:
+            columnas[nombre] = _numerica(columna, TIPOS[nombre])
+        else:
+            columnas[nombre] = columna
+    return pa.table(columnas)
+
+
+def exportar(rutas_fuente=None, rutas_hechos=None):
+    '''
+    Exporta los datasets al formato columnar.
+
+    Parameters:
+    - rutas_fuente (list): Archivos fuente, por defecto los de configuracion.rutas_datasets.
+    - rutas_hechos (list): Tablas de hechos a escribir, una por archivo fuente.
+
+    Returns:
+    - dict: {archivo fuente: (bytes del original, bytes de la tabla de hechos)}
+    '''
+    if configuracion.formato_datos == 'columnar':
+        raise RuntimeError("La exportación lee los archivos Parquet: ejecutarla sin FORMATO_DATOS=columnar")
+    rutas_fuente = rutas_fuente or configuracion.rutas_datasets
+    rutas_hechos = rutas_hechos or [os.path.join(configuracion.directorio_columnar, f'hechos_{nombre}.parquet')
+                                    for nombre in ('PlayTimeGenre', 'UserForGenre', 'UsersRecommend',
+                                                   'sentiment_analysis', 'RecomendacionJuego')]
+    fuentes = [(f, h) for f, h in zip(rutas_fuente, rutas_hechos) if os.path.exists(f)]
+
+    dimensiones = construir_dimensiones([f for f, _ in fuentes])
+    guardar_dimensiones(dimensiones)
+
+    tamanos = {}
+    for fuente, hechos in fuentes:
+        writer = None
+        try:
+            for tabla in _row_groups(fuente):
+                filas = codificar(tabla, dimensiones)
+                if writer is None:
+                    writer = pq.ParquetWriter(hechos, filas.schema, compression=COMPRESION)
+                # Un row group por row group del original, para conservar la muestra
+                writer.write_table(filas.cast(writer.schema), row_group_size=max(filas.num_rows, 1))
+        finally:
+            if writer is not None:
+                writer.close()
+        original = sum(os.path.getsize(archivo) for archivo in lectura.archivos(fuente))
+        tamanos[fuente] = (original, os.path.getsize(hechos))
+    return tamanos
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    inicio = time.perf_counter()
+    tamanos = exportar()
+    for fuente, (original, hechos) in tamanos.items():
+        logger.info("%s: %.1f MB -> %.1f MB", fuente, original / 2**20, hechos / 2**20)
+    dimensiones = sum(os.path.getsize(r) for r in [configuracion.ruta_dim_generos, *configuracion.rutas_dimensiones.values()])
+    logger.info("Dimensiones: %.1f MB. Exportación en %.1f s", dimensiones / 2**20, time.perf_counter() - inicio)
@@ -0,0 +1,172 @@
+'''
+Configuración compartida por la API y los procesos de construcción de datos.
+
+Los valores que cambian entre deploys se leen de variables de entorno.
+'''
+
+import os
+
+
+parquet_file_path1 = "Jupyter/df_PlayTimeGenre_gzip.parquet"
+parquet_file_path2 = "Jupyter/df_UserForGenre_gzip.parquet"
+parquet_file_path3 = "Jupyter/df_UsersRecommend_gzip.parquet"
+parquet_file_path4 = "Jupyter/df_sentiment_analysis_gzip.parquet"
+parquet_file_path5 = "Jupyter/df_RecomendacionJuego_gzip.parquet"
+
+# Datasets construidos por lotes con `python incremental.py`: un directorio por dataset con
+# un archivo Parquet por lote. Con ORIGEN_DATOS=incremental la API lee esos directorios.
+directorio_incremental = "Jupyter/incremental"
+origen_datos = os.getenv("ORIGEN_DATOS", "archivos")
+if origen_datos == "incremental":
+    parquet_file_path1 = f"{directorio_incremental}/df_PlayTimeGenre"
+    parquet_file_path2 = f"{directorio_incremental}/df_UserForGenre"
+    parquet_file_path3 = f"{directorio_incremental}/df_UsersRecommend"
+    parquet_file_path4 = f"{directorio_incremental}/df_sentiment_analysis"
+    parquet_file_path5 = f"{directorio_incremental}/df_RecomendacionJuego"
+
+# Formato columnar (`python columnar.py`): dimensiones de géneros, títulos y usuarios y tablas
+# de hechos con códigos enteros. Con FORMATO_DATOS=columnar la API lee esas tablas.
+formato_datos = os.getenv("FORMATO_DATOS", "parquet")
+directorio_columnar = "Jupyter/columnar"
+ruta_dim_generos = f"{directorio_columnar}/dim_generos.parquet"
+# columna de texto: archivo con sus valores distintos (el código de cada valor es su posición)
+rutas_dimensiones = {
+    "genres": f"{directorio_columnar}/dim_listas_generos.parquet",
+    "title": f"{directorio_columnar}/dim_titulos.parquet",
+    "user_id": f"{directorio_columnar}/dim_usuarios.parquet",
+}
+if formato_datos == "columnar":
+    parquet_file_path1 = f"{directorio_columnar}/hechos_PlayTimeGenre.parquet"
+    parquet_file_path2 = f"{directorio_columnar}/hechos_UserForGenre.parquet"
+    parquet_file_path3 = f"{directorio_columnar}/hechos_UsersRecommend.parquet"
+    parquet_file_path4 = f"{directorio_columnar}/hechos_sentiment_analysis.parquet"
+    parquet_file_path5 = f"{directorio_columnar}/hechos_RecomendacionJuego.parquet"
+
+# Modo de consulta:
+# - 'muestra': primer row group de cada archivo, recortado al porcentaje de abajo (deploy de Render, poca memoria);
+#   en los datasets por año, ordenados por año, el porcentaje se toma de cada row group
+# - 'exacto': archivos completos, recorridos row group por row group combinando resultados parciales
+modo_consulta = os.getenv("MODO_CONSULTA", "muestra")
+
+# Muestreo usado en el modo 'muestra'
+sample_percent = 5
+porcentaje_muestra_recomendacion = 50
+
+# Filas por row group al reescribir los archivos ordenados por año (`python lectura.py`)
+filas_por_row_group = 50000
+
+rutas_datasets = [parquet_file_path1, parquet_file_path2, parquet_file_path3, parquet_file_path4, parquet_file_path5]
+if formato_datos == "columnar":
+    rutas_datasets += list(rutas_dimensiones.values())
+
+# Carga de los datasets: 'parquet' (cada proceso lee y descomprime los archivos) o 'mmap'
+# (archivos Arrow IPC y .npy sin comprimir generados con `python mapeo.py`, mapeados en memoria
+# de solo lectura; los workers de uvicorn comparten las páginas a través del cache del sistema)
+carga_datos = os.getenv("CARGA_DATOS", "parquet")
+directorio_mmap = "Artefactos/mmap"
+
+# Respuestas precalculadas por género y por año (se generan con `python agregados.py`)
+ruta_agregados = "Artefactos/agregados.json.gz"
+
+# Cubo de agregados por año (ver cubo.py), que responde las consultas de un género o de un
+# año y las de /rango. CUBO_AGREGADOS=0 no lo arma: las consultas se calculan en vivo o con los
+# agregados precalculados y /rango responde 404
+cubo_agregados = os.getenv("CUBO_AGREGADOS", "1") == "1"
+
+# Modelo de recomendación item-item (se genera con `python recomendacion.py`)
+directorio_modelo = "Artefactos/modelo_recomendacion"
+vecinos_por_juego = 10
+# Columnas de texto adicionales del dataset de recomendación (por ejemplo 'tags,specs,developer')
+# que se suman al título y los géneros en el texto del TF-IDF; tienen que existir en el archivo
+columnas_texto_recomendacion = [c for c in os.getenv("COLUMNAS_TEXTO_RECOMENDACION", "").split(",") if c]
+
+# Búsqueda de juegos similares (ver similitud.py): 'exacto', 'lsh' (aproximada, con
+# tablas de hash de `lsh_bits` bits y `lsh_sondeos` claves vecinas revisadas por tabla) o
+# 'particionado' (exacta, repartida en `particiones_similitud` procesos)
+buscador_similitud = os.getenv("BUSCADOR_SIMILITUD", "exacto")
+lsh_tablas = int(os.getenv("LSH_TABLAS", "8"))
+lsh_bits = int(os.getenv("LSH_BITS", "12"))
+lsh_sondeos = int(os.getenv("LSH_SONDEOS", "2"))
+particiones_similitud = int(os.getenv("PARTICIONES_SIMILITUD", str(os.cpu_count() or 1)))
+
+# Modelo de recomendación usuario-juego (se genera con `python recomendacion_usuarios.py`):
+# factorización de la matriz usuario x juego armada con las horas jugadas y las recomendaciones
+# de las reseñas de los archivos que tienen user_id e item_id
+directorio_modelo_usuarios = "Artefactos/modelo_usuarios"
+rutas_interacciones = [parquet_file_path2, parquet_file_path3]
+if origen_datos == "incremental":
+    # Los registros combinados ya tienen horas y recomendación de cada usuario y juego
+    rutas_interacciones = [f"{directorio_incremental}/combinado"]
+factores_usuarios = int(os.getenv("FACTORES_USUARIOS", "64"))
+# Valor que suma (o resta) a la interacción una reseña que recomienda (o no) el juego
+peso_recomendacion = 1.0
+
+# Filas por parte de las respuestas NDJSON y Arrow y de /filas (ver formatos.py)
+filas_por_lote_respuesta = int(os.getenv("FILAS_POR_LOTE_RESPUESTA", "10000"))
+
+# Cantidad máxima de claves (géneros, años o juegos) por consulta de los endpoints /lote
+max_elementos_lote = int(os.getenv("MAX_ELEMENTOS_LOTE", "1000"))
+
+# Instantáneas de los datos servidos (ver instantaneas.py): directorio con un subdirectorio
+# por versión de los artefactos (vacío: se sirven los archivos del directorio actual),
+# segundos entre revisiones del vigilante que recarga al aparecer una versión nueva o al
+# cambiar los archivos (0 lo desactiva) y token de POST /admin/recargar (vacío: deshabilitado)
+directorio_instantaneas = os.getenv("DIRECTORIO_INSTANTANEAS", "")
+vigilancia_segundos = float(os.getenv("VIGILANCIA_SEGUNDOS", "0"))
+token_admin = os.getenv("TOKEN_ADMIN", "")
+
+# Ingesta de reseñas en vivo (ver ingesta.py): directorio de los archivos compactados,
+# títulos seguidos por ranking y año, segundos entre compactaciones, reseñas pendientes que
+# fuerzan una compactación, archivos a partir de los cuales se unen en uno y reseñas máximas
+# por pedido a POST /ingesta/resenas. Con varios workers, cada uno suma las reseñas que
+# compactan los demás en su propia compactación, así que COMPACTACION_SEGUNDOS debe ser mayor que 0
+directorio_ingesta = os.getenv("DIRECTORIO_INGESTA", "Artefactos/ingesta")
+capacidad_resenas_en_vivo = int(os.getenv("CAPACIDAD_RESENAS_EN_VIVO", "1000"))
+compactacion_segundos = float(os.getenv("COMPACTACION_SEGUNDOS", "60"))
+max_pendientes_ingesta = int(os.getenv("MAX_PENDIENTES_INGESTA", "50000"))
+max_archivos_ingesta = int(os.getenv("MAX_ARCHIVOS_INGESTA", "32"))
+max_resenas_ingesta = int(os.getenv("MAX_RESENAS_INGESTA", "1000"))
+
+# Cache de respuestas GET (0 en cualquiera de los dos valores lo desactiva)
+cache_max_entradas = int(os.getenv("CACHE_MAX_ENTRADAS", "1024"))
+cache_ttl_segundos = float(os.getenv("CACHE_TTL_SEGUNDOS", "300"))
+# Rutas cuyas respuestas cambian en cada consulta y no se guardan
+rutas_sin_cache = ["/memoria", "/cache", "/ejecucion", "/metrics", "/health/live", "/health/ready", "/admin/instantanea", "/ingesta"]
+
+# Pools de hilos por clase de endpoint: hilos simultáneos, consultas en espera y timeout en segundos
+grupos_ejecucion = {
+    "consultas": {
+        "hilos": int(os.getenv("CONSULTAS_HILOS", "4")),
+        "cola": int(os.getenv("CONSULTAS_COLA", "64")),
+        "timeout": float(os.getenv("CONSULTAS_TIMEOUT", "15")),
+    },
+    "recomendacion": {
+        "hilos": int(os.getenv("RECOMENDACION_HILOS", "2")),
+        "cola": int(os.getenv("RECOMENDACION_COLA", "16")),
+        "timeout": float(os.getenv("RECOMENDACION_TIMEOUT", "30")),
+    },
+    "ingesta": {
+        "hilos": int(os.getenv("INGESTA_HILOS", "1")),
+        "cola": int(os.getenv("INGESTA_COLA", "16")),
+        "timeout": float(os.getenv("INGESTA_TIMEOUT", "60")),
+    },
+}
+
+# Perfilado por consulta con el encabezado X-Perfil (ver instrumentacion.py): desactivado por
+# defecto; con PERFILADO=1 se atiende la fracción PERFILADO_MUESTREO de los pedidos
+perfilado_habilitado = os.getenv("PERFILADO", "0") == "1"
+perfilado_muestreo = float(os.getenv("PERFILADO_MUESTREO", "1"))
+# Funciones listadas en el reporte de cProfile
+perfilado_funciones = 40
+
+# Arranque (ver arranque.py): la carga de datasets y modelos corre en segundo plano y la API
+# responde 503 hasta terminarla, salvo en las rutas de abajo. ARRANQUE_SEGUNDO_PLANO=0 espera
+# la carga antes de aceptar consultas
+arranque_en_segundo_plano = os.getenv("ARRANQUE_SEGUNDO_PLANO", "1") == "1"
+rutas_sin_espera = ["/health/live", "/health/ready", "/metrics", "/docs", "/docs/oauth2-redirect", "/openapi.json", "/redoc", "/"]
+# Consultas de calentamiento que se ejecutan antes de declarar la API lista, para que la
+# primera consulta real no pague la apertura de archivos ni la primera llamada a cada función
+# de pandas, pyarrow y scikit-learn (CALENTAMIENTO=0 las omite)
+calentamiento = os.getenv("CALENTAMIENTO", "1") == "1"
+genero_calentamiento = "Action"
+anio_calentamiento = 2015
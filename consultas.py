@@ -0,0 +1,428 @@
+'''
+Cálculo de las respuestas de los endpoints a partir de los datasets del almacén.
+
+Cada consulta se divide en un resultado parcial por fragmento del dataset (sumas y
+conteos que se pueden combinar) y un paso final que arma la respuesta. Así la misma
+lógica sirve para la muestra en memoria (un solo fragmento) y para el recorrido
+completo row group por row group del modo 'exacto'.
+
+Las consultas por año no usan pandas hasta el paso final: el almacén entrega tablas
+Arrow ya filtradas y con las columnas necesarias, y el conteo se hace con group_by de
+Arrow.
+
+Las respuestas quedan listas para serializar a JSON, de modo que las usa tanto la API
+como la construcción offline de las tablas de agregados.
+'''
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from indice_generos import dividir_generos
+from instrumentacion import tramo
+
+
+sentiment_mapping = {2: "Positive", 1: "Neutral", 0: "Negative"}
+
+
+def combinar(parciales):
+    '''
+    Suma resultados parciales alineándolos por su índice.
+
+    Parameters:
+    - parciales (iterable): Series con sumas o conteos parciales.
+
+    Returns:
+    - pd.Series or None: La suma de todos los parciales, None si no hubo ninguno.
+    '''
+    total = None
+    for parcial in parciales:
+        total = parcial if total is None else total.add(parcial, fill_value=0)
+    return total
+
+
+def parcial_play_time_genre(df, indice, generos, operador='y'):
+    '''
+    Horas jugadas por año de lanzamiento para los juegos del género en un fragmento.
+    '''
+    with tramo('filtro_generos'):
+        genero_filtrado = df.take(indice.filas(generos, operador))
+    with tramo('groupby'):
+        horas = genero_filtrado['playtime_forever'] / 60
+        return horas.groupby(genero_filtrado['release_date']).sum()
+
+
+def final_play_time_genre(horas):
+    if horas is None or horas.empty:
+        return None
+    return int(horas.idxmax())
+
+
+def play_time_genre(fragmentos, generos, operador='y'):
+    '''
+    Calcula el año de lanzamiento con más horas jugadas para un género.
+
+    Parameters:
+    - fragmentos (iterable): Tuplas (DataFrame, IndiceGeneros) del dataset PlayTimeGenre.
+    - generos (str or list): Género buscado, o varios géneros.
+    - operador (str): Con varios géneros, 'y' exige todos y 'o' alguno.
+
+    Returns:
+    - int or None: El año con más horas jugadas, None si no hay datos para el género.
+    '''
+    return final_play_time_genre(combinar(parcial_play_time_genre(df, indice, generos, operador) for df, indice in fragmentos))
+
+
+def tabla_play_time_genre(fragmentos, generos, operador='y'):
+    '''
+    Horas jugadas por año de lanzamiento para un género: la tabla de la que play_time_genre
+    toma el máximo.
+
+    Returns:
+    - pa.Table: Columnas 'Año' y 'Horas', en orden de año.
+    '''
+    horas = combinar(parcial_play_time_genre(df, indice, generos, operador) for df, indice in fragmentos)
+    horas = pd.Series(dtype='float64') if horas is None else horas.sort_index()
+    return pa.table({'Año': horas.index.to_numpy(dtype='int64'), 'Horas': horas.to_numpy(dtype='float64')})
+
+
+def parcial_user_for_genre(df, indice, generos, operador='y'):
+    '''
+    Horas jugadas por usuario y año para los juegos del género en un fragmento.
+    '''
+    with tramo('filtro_generos'):
+        juegos_genero = df.take(indice.filas(generos, operador))
+    with tramo('groupby'):
+        juegos_genero = pd.DataFrame({
+            'user_id': juegos_genero['user_id'].astype(str),
+            'Año': juegos_genero['release_date'],
+            'playtime_forever': juegos_genero['playtime_forever'] / 60,
+        })
+        return juegos_genero.groupby(['user_id', 'Año'])['playtime_forever'].sum()
+
+
+def final_user_for_genre(horas_por_usuario):
+    if horas_por_usuario is None or horas_por_usuario.empty:
+        return None
+    with tramo('respuesta'):
+        horas_por_usuario = horas_por_usuario.sort_index()
+
+        usuario_max_horas = horas_por_usuario.groupby(level='user_id').sum().idxmax()
+        anio, horas = next(iter(horas_por_usuario.loc[usuario_max_horas].items()))
+
+        acumulacion_horas = horas_por_usuario.groupby(level='Año').sum()
+
+        return {
+            "usuario": {"user_id": str(usuario_max_horas), "Año": int(anio), "playtime_forever": float(horas)},
+            "horas": [{"Año": int(anio), "Horas": float(horas)} for anio, horas in acumulacion_horas.items()],
+        }
+
+
+def user_for_genre(fragmentos, generos, operador='y'):
+    '''
+    Calcula el usuario con más horas jugadas para un género y la acumulación de horas por año.
+
+    Parameters:
+    - fragmentos (iterable): Tuplas (DataFrame, IndiceGeneros) del dataset UserForGenre.
+    - generos (str or list): Género buscado, o varios géneros.
+    - operador (str): Con varios géneros, 'y' exige todos y 'o' alguno.
+
+    Returns:
+    - dict or None: {"usuario": {"user_id", "Año", "playtime_forever"}, "horas": [{"Año", "Horas"}]},
+      None si no hay datos para el género.
+    '''
+    return final_user_for_genre(combinar(parcial_user_for_genre(df, indice, generos, operador) for df, indice in fragmentos))
+
+
+def tabla_user_for_genre(fragmentos, generos, operador='y'):
+    '''
+    Horas jugadas por usuario y año para un género, de mayor a menor: el ranking completo
+    del que user_for_genre toma el primer usuario.
+
+    Returns:
+    - pa.Table: Columnas 'user_id', 'Año' y 'Horas'.
+    '''
+    horas = combinar(parcial_user_for_genre(df, indice, generos, operador) for df, indice in fragmentos)
+    if horas is None:
+        return pa.table({'user_id': pa.array([], pa.string()), 'Año': pa.array([], pa.int64()), 'Horas': pa.array([], pa.float64())})
+    ranking = horas.rename('Horas').reset_index().sort_values(['Horas', 'user_id', 'Año'], ascending=[False, True, True])
+    return pa.table({
+        'user_id': pa.array(ranking['user_id'].to_numpy(dtype=object), pa.string()),
+        'Año': ranking['Año'].to_numpy(dtype='int64'),
+        'Horas': ranking['Horas'].to_numpy(dtype='float64'),
+    })
+
+
+def _lote_generos(fragmentos, generos, operador, parcial, final):
+    '''
+    Resuelve varias consultas de géneros con una sola pasada por el dataset.
+
+    Parameters:
+    - fragmentos (iterable): Tuplas (DataFrame, IndiceGeneros) del dataset.
+    - generos (list): Consultas de géneros; cada una puede tener varios géneros separados por coma.
+    - operador (str): Con varios géneros, 'y' exige todos y 'o' alguno.
+    - parcial (callable): Resultado parcial de una consulta en un fragmento.
+    - final (callable): Arma la respuesta a partir de los parciales combinados.
+
+    Returns:
+    - dict: {consulta: respuesta}
+    '''
+    acumulados = {}
+    for df, indice in fragmentos:
+        for consulta in generos:
+            resultado = parcial(df, indice, dividir_generos(consulta), operador)
+            acumulados[consulta] = combinar([acumulados[consulta], resultado]) if consulta in acumulados else resultado
+    return {consulta: final(acumulados.get(consulta)) for consulta in generos}
+
+
+def play_time_genre_lote(fragmentos, generos, operador='y'):
+    '''
+    Año con más horas jugadas para cada consulta de géneros, con una pasada por el dataset.
+    '''
+    return _lote_generos(fragmentos, generos, operador, parcial_play_time_genre, final_play_time_genre)
+
+
+def user_for_genre_lote(fragmentos, generos, operador='y'):
+    '''
+    Usuario con más horas y horas por año para cada consulta de géneros, con una pasada por el dataset.
+    '''
+    return _lote_generos(fragmentos, generos, operador, parcial_user_for_genre, final_user_for_genre)
+
+
+def filtro_recomendados(anio=None):
+    '''
+    Reseñas recomendadas y con sentimiento neutro o positivo, opcionalmente de un año.
+    '''
+    filtro = (pc.field("reviews_recommend") == True) & (pc.field("sentiment_analysis") >= 1)
+    return filtro if anio is None else filtro & (pc.field("reviews_posted") == anio)
+
+
+def filtro_no_recomendados(anio=None):
+    '''
+    Reseñas no recomendadas y con sentimiento negativo, opcionalmente de un año.
+    '''
+    filtro = (pc.field("reviews_recommend") == False) & (pc.field("sentiment_analysis") == 0)
+    return filtro if anio is None else filtro & (pc.field("reviews_posted") == anio)
+
+
+def filtro_anio(columna, anio):
+    return pc.field(columna) == anio
+
+
+def filtro_anios(columna, anios=None):
+    '''
+    Filas de cualquiera de los años indicados, o todas si anios es None.
+    '''
+    return None if anios is None else pc.field(columna).isin(list(anios))
+
+
+def _y(filtro, otro):
+    return filtro if otro is None else filtro & otro
+
+
+def contar_filas(tablas, claves):
+    '''
+    Cuenta las filas por combinación de claves sobre las partes de un escaneo, sin
+    convertir las tablas a pandas.
+
+    Los grupos quedan en el orden en que aparecen por primera vez, igual que en
+    value_counts, y las filas con alguna clave nula se descartan.
+
+    Parameters:
+    - tablas (iterable): Tablas Arrow con las columnas de las claves.
+    - claves (list): Columnas por las que se agrupa.
+
+    Returns:
+    - pa.Table: Las columnas de las claves y 'count'.
+    '''
+    # Cada parte se agrupa por separado y los conteos parciales se suman al final
+    parciales = []
+    for tabla in tablas:
+        with tramo('groupby_arrow'):
+            parciales.append(tabla.group_by(claves, use_threads=False).aggregate([([], "count_all")]))
+    if not parciales:
+        return pa.table({**{c: pa.array([], pa.int64()) for c in claves}, "count": pa.array([], pa.int64())})
+    with tramo('groupby_arrow'):
+        conteo = pa.concat_tables(parciales).group_by(claves, use_threads=False).aggregate([("count_all", "sum")])
+        for clave in claves:
+            conteo = conteo.filter(pc.is_valid(conteo[clave]))
+    return conteo.rename_columns(claves + ["count"])
+
+
+def conteo_titulos(conteo):
+    '''
+    Convierte un conteo por título en la Series que recibe final_top_3.
+    '''
+    return pd.Series(conteo["count"].to_numpy(), index=[str(t) for t in conteo["title"].to_pylist()], dtype="int64")
+
+
+def por_anio(conteo, columna):
+    '''
+    Separa un conteo agrupado por año en el conteo de cada año, en orden de año.
+    '''
+    anios = conteo[columna]
+    for anio in sorted(set(anios.to_pylist())):
+        yield int(anio), conteo.filter(pc.equal(anios, anio))
+
+
+def conteo_sentimientos(conteo):
+    '''
+    Convierte un conteo por sentimiento en la Series que recibe final_sentiment_analysis.
+    '''
+    return pd.Series(conteo["count"].to_numpy(), index=conteo["sentiment_analysis"].to_pylist(), dtype="int64")
+
+
+def _ordenar_titulos(counts):
+    return counts.sort_index().rename_axis("title").reset_index(name="count").sort_values(by="count", ascending=False)
+
+
+def final_top_3(counts):
+    if counts is None:
+        return {}
+    counts = _ordenar_titulos(counts).head(3)
+    return {f"Puesto {i+1}": juego for i, juego in enumerate(counts['title'])}
+
+
+def users_recommend(almacen, anio):
+    '''
+    Calcula el top 3 de juegos más recomendados para un año.
+
+    Parameters:
+    - almacen (AlmacenDatos): Almacén con el dataset UsersRecommend.
+    - anio (int): Año de publicación de las reseñas.
+
+    Returns:
+    - dict: {"Puesto 1": str, "Puesto 2": str, "Puesto 3": str}
+    '''
+    partes = almacen.escanear('UsersRecommend', ["title"], filtro_recomendados(anio))
+    return final_top_3(conteo_titulos(contar_filas(partes, ["title"])))
+
+
+def users_not_recommend(almacen, anio):
+    '''
+    Calcula el top 3 de juegos menos recomendados para un año.
+
+    Parameters:
+    - almacen (AlmacenDatos): Almacén con el dataset UsersRecommend.
+    - anio (int): Año de publicación de las reseñas.
+
+    Returns:
+    - dict: {"Puesto 1": str, "Puesto 2": str, "Puesto 3": str}
+    '''
+    partes = almacen.escanear('UsersRecommend', ["title"], filtro_no_recomendados(anio))
+    return final_top_3(conteo_titulos(contar_filas(partes, ["title"])))
+
+
+def _ranking_titulos(almacen, filtro):
+    conteo = contar_filas(almacen.escanear('UsersRecommend', ["title"], filtro), ["title"])
+    # Mismo orden que final_top_3, para que los 3 primeros coincidan con la respuesta JSON
+    ranking = _ordenar_titulos(conteo_titulos(conteo))
+    return pa.table({"title": pa.array(ranking["title"].to_numpy(dtype=object), pa.string()), "count": ranking["count"].to_numpy()})
+
+
+def tabla_users_recommend(almacen, anio):
+    '''
+    Cantidad de reseñas recomendadas de cada juego en un año, de mayor a menor: el ranking
+    completo del que users_recommend toma los 3 primeros.
+
+    Returns:
+    - pa.Table: Columnas 'title' y 'count'.
+    '''
+    return _ranking_titulos(almacen, filtro_recomendados(anio))
+
+
+def tabla_users_not_recommend(almacen, anio):
+    '''
+    Cantidad de reseñas no recomendadas de cada juego en un año, de mayor a menor: el
+    ranking completo del que users_not_recommend toma los 3 primeros.
+
+    Returns:
+    - pa.Table: Columnas 'title' y 'count'.
+    '''
+    return _ranking_titulos(almacen, filtro_no_recomendados(anio))
+
+
+def _top_3_por_anio(almacen, filtro, anios):
+    columnas = ["reviews_posted", "title"]
+    conteo = contar_filas(almacen.escanear('UsersRecommend', columnas, _y(filtro, filtro_anios("reviews_posted", anios))), columnas)
+    respuestas = {anio: final_top_3(conteo_titulos(c)) for anio, c in por_anio(conteo, "reviews_posted")}
+    return respuestas if anios is None else {anio: respuestas.get(anio, {}) for anio in anios}
+
+
+def users_recommend_lote(almacen, anios=None):
+    '''
+    Top 3 de juegos más recomendados para varios años, con un solo escaneo del dataset.
+
+    Parameters:
+    - almacen (AlmacenDatos): Almacén con el dataset UsersRecommend.
+    - anios (list): Años de publicación de las reseñas, None para todos los años con datos.
+
+    Returns:
+    - dict: {anio: {"Puesto 1": str, "Puesto 2": str, "Puesto 3": str}}
+    '''
+    return _top_3_por_anio(almacen, filtro_recomendados(), anios)
+
+
+def users_not_recommend_lote(almacen, anios=None):
+    '''
+    Top 3 de juegos menos recomendados para varios años, con un solo escaneo del dataset.
+
+    Parameters:
+    - almacen (AlmacenDatos): Almacén con el dataset UsersRecommend.
+    - anios (list): Años de publicación de las reseñas, None para todos los años con datos.
+
+    Returns:
+    - dict: {anio: {"Puesto 1": str, "Puesto 2": str, "Puesto 3": str}}
+    '''
+    return _top_3_por_anio(almacen, filtro_no_recomendados(), anios)
+
+
+def final_sentiment_analysis(sentiment_counts):
+    if sentiment_counts is None:
+        return {}
+    # Orden estable: ante empates se conserva el orden de primera aparición
+    sentiment_counts = sentiment_counts.sort_values(ascending=False, kind='stable')
+    return {sentiment_mapping[key]: int(value) for key, value in sentiment_counts.items()}
+
+
+def sentiment_analysis(almacen, anio):
+    '''
+    Cuenta las reseñas por categoría de sentimiento para un año de lanzamiento.
+
+    Parameters:
+    - almacen (AlmacenDatos): Almacén con el dataset sentiment_analysis.
+    - anio (int): Año de lanzamiento.
+
+    Returns:
+    - dict: {"Negative": int, "Neutral": int, "Positive": int}, ordenado por cantidad.
+    '''
+    partes = almacen.escanear('sentiment_analysis', ["sentiment_analysis"], filtro_anio("release_date", anio))
+    return final_sentiment_analysis(conteo_sentimientos(contar_filas(partes, ["sentiment_analysis"])))
+
+
+def tabla_sentiment_analysis(almacen, anio):
+    '''
+    Reseñas por categoría de sentimiento para un año de lanzamiento, como tabla.
+
+    Returns:
+    - pa.Table: Columnas 'sentimiento' y 'count', ordenadas por cantidad.
+    '''
+    respuesta = sentiment_analysis(almacen, anio)
+    return pa.table({'sentimiento': pa.array(list(respuesta), pa.string()), 'count': pa.array(list(respuesta.values()), pa.int64())})
+
+
+def sentiment_analysis_lote(almacen, anios=None):
+    '''
+    Reseñas por categoría de sentimiento para varios años, con un solo escaneo del dataset.
+
+    Parameters:
+    - almacen (AlmacenDatos): Almacén con el dataset sentiment_analysis.
+    - anios (list): Años de lanzamiento, None para todos los años con datos.
+
+    Returns:
+    - dict: {anio: {"Negative": int, "Neutral": int, "Positive": int}}
+    '''
+    columnas = ["release_date", "sentiment_analysis"]
+    conteo = contar_filas(almacen.escanear('sentiment_analysis', columnas, filtro_anios("release_date", anios)), columnas)
+    respuestas = {anio: final_sentiment_analysis(conteo_sentimientos(c)) for anio, c in por_anio(conteo, "release_date")}
+    return respuestas if anios is None else {anio: respuestas.get(anio, {}) for anio in anios}
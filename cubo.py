@@ -0,0 +1,344 @@
+'''
+Cubo de agregados por año, con sumas acumuladas a lo largo de los años.
+
+Se arma una sola vez por instantánea (ver instantaneas.py), con una pasada por cada
+dataset servido:
+- PlayTimeGenre: filas y minutos jugados por (año de lanzamiento, género). Un juego con
+  varios géneros suma en cada uno.
+- sentiment_analysis: reseñas por (año de lanzamiento, sentimiento).
+- UsersRecommend: reseñas recomendadas y no recomendadas por (año de publicación, título),
+  con los mismos criterios que UsersRecommend y UsersNotRecommend.
+
+Cada medida es un arreglo denso de NumPy con una fila por año con datos, del que solo se
+guarda la suma acumulada por años con una fila de ceros adelante. El total de cualquier
+intervalo de años es la resta de dos filas (O(1) por celda) y el valor de un año es la
+diferencia entre filas consecutivas, sin volver a recorrer los datos. Los minutos y los
+conteos son enteros, así que las sumas en float64 son exactas.
+
+Las respuestas de un año o un género coinciden con las de consultas.py; solo ante empates
+en sentiment_analysis las categorías quedan en el orden Negative, Neutral, Positive en vez
+del orden de aparición en los datos.
+'''
+
+import bisect
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from consultas import sentiment_mapping
+from indice_generos import dividir_generos
+from instrumentacion import tramo
+
+
+# Posición de cada ranking en el eje de tipo de reseña
+TIPOS_RESENA = {'UsersRecommend': 0, 'UsersNotRecommend': 1}
+
+
+class SumasPorAnio:
+    '''
+    Suma acumulada por años de un arreglo denso cuyo primer eje es el año.
+    '''
+
+    def __init__(self, anios, celdas):
+        '''
+        Parameters:
+        - anios (np.ndarray): Años con datos, ordenados.
+        - celdas (np.ndarray): Valor de cada año (primer eje) y celda (resto de los ejes).
+        '''
+        self.anios = anios
+        ceros = np.zeros((1, *celdas.shape[1:]), dtype=celdas.dtype)
+        self.acumuladas = np.concatenate([ceros, np.cumsum(celdas, axis=0)])
+
+    def _posiciones(self, desde, hasta):
+        inicio = 0 if desde is None else int(np.searchsorted(self.anios, desde, side='left'))
+        fin = len(self.anios) if hasta is None else int(np.searchsorted(self.anios, hasta, side='right'))
+        return inicio, max(inicio, fin)
+
+    def total(self, desde=None, hasta=None, celda=()):
+        '''
+        Suma de los años del intervalo [desde, hasta]; None deja el extremo abierto.
+
+        Parameters:
+        - celda (tuple): Índice de la celda en los ejes que siguen al año, () para todas.
+        '''
+        inicio, fin = self._posiciones(desde, hasta)
+        return self.acumuladas[(fin, *celda)] - self.acumuladas[(inicio, *celda)]
+
+    def por_anio(self, desde=None, hasta=None, celda=()):
+        '''
+        Valor de cada año con datos del intervalo.
+
+        Returns:
+        - tuple: (años, valores), con un valor por año en el primer eje.
+        '''
+        inicio, fin = self._posiciones(desde, hasta)
+        return self.anios[inicio:fin], np.diff(self.acumuladas[(slice(inicio, fin + 1), *celda)], axis=0)
+
+    @property
+    def nbytes(self):
+        return self.anios.nbytes + self.acumuladas.nbytes
+
+
+class _Acumulador:
+    '''
+    Junta sumas por (año, celda) de varios fragmentos y arma el arreglo denso.
+    '''
+
+    def __init__(self):
+        self._claves = []
+        self._sumas = []
+
+    def agregar(self, anios, celdas, valores=None):
+        '''
+        Suma los valores de cada fila (1 si valores es None) en su año y celda.
+        '''
+        if not len(anios):
+            return
+        # Año y celda en una sola clave entera: cada fragmento se reduce a sus combinaciones
+        claves = (np.asarray(anios, dtype=np.int64) << 32) | np.asarray(celdas, dtype=np.int64)
+        unicas, inversa = np.unique(claves, return_inverse=True)
+        self._claves.append(unicas)
+        self._sumas.append(np.bincount(inversa, weights=valores, minlength=len(unicas)))
+
+    def celdas(self, num_celdas):
+        '''
+        Returns:
+        - tuple or None: (años, celdas) con num_celdas celdas por año; None sin filas.
+        '''
+        if not self._claves:
+            return None
+        claves, sumas = np.concatenate(self._claves), np.concatenate(self._sumas)
+        anios, posicion_anio = np.unique(claves >> 32, return_inverse=True)
+        celdas = np.zeros((len(anios), num_celdas))
+        np.add.at(celdas, (posicion_anio, claves & 0xFFFFFFFF), sumas)
+        return anios, celdas
+
+    def sumas(self, num_celdas):
+        celdas = self.celdas(num_celdas)
+        return None if celdas is None else SumasPorAnio(*celdas)
+
+
+def _play_time_genre(fragmentos):
+    generos = {}
+    filas, minutos = _Acumulador(), _Acumulador()
+    for df, indice in fragmentos:
+        anios = df['release_date'].to_numpy()
+        # Como en el groupby de pandas, los minutos nulos suman 0 pero el año cuenta
+        valores = np.nan_to_num(df['playtime_forever'].to_numpy(dtype=np.float64))
+        if not indice.posiciones:
+            continue
+        posiciones = np.concatenate(list(indice.posiciones.values()))
+        columnas = np.repeat([generos.setdefault(g, len(generos)) for g in indice.posiciones],
+                             [len(p) for p in indice.posiciones.values()])
+        filas.agregar(anios[posiciones], columnas)
+        minutos.agregar(anios[posiciones], columnas, valores[posiciones])
+    return generos, filas.sumas(len(generos)), minutos.sumas(len(generos))
+
+
+def _sentiment_analysis(tablas):
+    sentimientos = _Acumulador()
+    for tabla in tablas:
+        anios, valores = tabla['release_date'], tabla['sentiment_analysis']
+        validas = pc.and_(pc.and_(pc.is_valid(anios), pc.is_valid(valores)), pc.is_in(valores, pa.array(list(sentiment_mapping), valores.type)))
+        tabla = tabla.filter(validas)
+        sentimientos.agregar(tabla['release_date'].to_numpy(), tabla['sentiment_analysis'].to_numpy())
+    return sentimientos.sumas(len(sentiment_mapping))
+
+
+def _users_recommend(tablas):
+    titulos = {}
+    resenas = _Acumulador()
+    for tabla in tablas:
+        recomendada = pc.fill_null(pc.and_(pc.equal(tabla['reviews_recommend'], True), pc.greater_equal(tabla['sentiment_analysis'], 1)), False)
+        no_recomendada = pc.fill_null(pc.and_(pc.equal(tabla['reviews_recommend'], False), pc.equal(tabla['sentiment_analysis'], 0)), False)
+        validas = pc.and_(pc.and_(pc.is_valid(tabla['title']), pc.is_valid(tabla['reviews_posted'])), pc.or_(recomendada, no_recomendada))
+        tabla = tabla.append_column('tipo', pc.if_else(recomendada, 0, 1)).filter(validas)
+        if not tabla.num_rows:
+            continue
+        columna = tabla['title']
+        if pa.types.is_dictionary(columna.type):
+            columna = columna.cast(columna.type.value_type)
+        codificada = pc.dictionary_encode(columna.combine_chunks())
+        codigos = np.array([titulos.setdefault(str(t), len(titulos)) for t in codificada.dictionary.to_pylist()], dtype=np.int64)
+        celdas = codigos[codificada.indices.to_numpy()] * len(TIPOS_RESENA) + tabla['tipo'].to_numpy()
+        resenas.agregar(tabla['reviews_posted'].to_numpy(), celdas)
+    celdas = resenas.celdas(len(titulos) * len(TIPOS_RESENA))
+    if celdas is None:
+        return [], None
+    # Títulos en orden alfabético, como los ordena final_top_3 antes de ordenar por cantidad
+    nombres = sorted(titulos)
+    orden = np.array([titulos[t] for t in nombres], dtype=np.int64)
+    anios, celdas = celdas
+    celdas = celdas.reshape(len(anios), len(titulos), len(TIPOS_RESENA))[:, orden, :]
+    return nombres, SumasPorAnio(anios, np.ascontiguousarray(celdas.transpose(0, 2, 1)))
+
+
+class Cubo:
+    '''
+    Sumas acumuladas por año de las medidas de los endpoints por género y por año.
+    '''
+
+    def __init__(self):
+        self.generos = {}
+        self.filas_generos = None
+        self.minutos_generos = None
+        self.sentimientos = None
+        self.titulos = []
+        self.resenas = None
+
+    @classmethod
+    def construir(cls, almacen):
+        '''
+        Arma el cubo con una pasada por cada dataset disponible del almacén (en modo
+        'exacto', una lectura completa de cada archivo).
+
+        Parameters:
+        - almacen (AlmacenDatos): Almacén con los datasets cargados.
+
+        Returns:
+        - Cubo: El cubo; las medidas de los datasets no disponibles quedan en None.
+        '''
+        cubo = cls()
+        disponibles = set(almacen.datasets) | almacen.en_disco
+
+        if 'PlayTimeGenre' in disponibles:
+            with tramo('cubo_PlayTimeGenre'):
+                cubo.generos, cubo.filas_generos, cubo.minutos_generos = _play_time_genre(almacen.fragmentos('PlayTimeGenre'))
+
+        if 'sentiment_analysis' in disponibles:
+            with tramo('cubo_sentiment_analysis'):
+                cubo.sentimientos = _sentiment_analysis(almacen.escanear('sentiment_analysis', ['release_date', 'sentiment_analysis']))
+
+        if 'UsersRecommend' in disponibles:
+            with tramo('cubo_UsersRecommend'):
+                cubo.titulos, cubo.resenas = _users_recommend(almacen.escanear(
+                    'UsersRecommend', ['title', 'reviews_posted', 'reviews_recommend', 'sentiment_analysis']))
+        return cubo
+
+    def disponibles(self):
+        '''
+        Returns:
+        - set: Endpoints que el cubo puede responder.
+        '''
+        disponibles = set()
+        if self.minutos_generos is not None:
+            disponibles.add('PlayTimeGenre')
+        if self.sentimientos is not None:
+            disponibles.add('sentiment_analysis')
+        if self.resenas is not None:
+            disponibles.update(TIPOS_RESENA)
+        return disponibles
+
+    def horas_genero(self, genero, desde=None, hasta=None):
+        '''
+        Horas jugadas de un género entre dos años de lanzamiento, incluidos.
+
+        Parameters:
+        - genero (str): Un género.
+        - desde (int): Primer año, None para no acotar.
+        - hasta (int): Último año, None para no acotar.
+
+        Returns:
+        - dict or None: {"horas": float, "anio_max": int}, con el año con más horas del
+          intervalo; None si no hay juegos del género en el intervalo.
+        '''
+        columna = self.generos.get(genero)
+        if columna is None:
+            return None
+        anios, filas = self.filas_generos.por_anio(desde, hasta, (columna,))
+        presentes = filas > 0
+        if not presentes.any():
+            return None
+        _, minutos = self.minutos_generos.por_anio(desde, hasta, (columna,))
+        # Entre los años con juegos del género; ante empates, el primero (como idxmax)
+        anio_max = int(anios[np.argmax(np.where(presentes, minutos, -np.inf))])
+        return {"horas": float(minutos.sum()) / 60, "anio_max": anio_max}
+
+    def sentiment_analysis(self, desde=None, hasta=None):
+        '''
+        Reseñas por categoría de sentimiento entre dos años de lanzamiento, incluidos.
+
+        Returns:
+        - dict: {"Negative": int, "Neutral": int, "Positive": int}, ordenado por cantidad y
+          sin las categorías sin reseñas.
+        '''
+        conteos = self.sentimientos.total(desde, hasta)
+        presentes = [(codigo, int(conteos[codigo])) for codigo in sorted(sentiment_mapping) if conteos[codigo] > 0]
+        presentes.sort(key=lambda par: -par[1])
+        return {sentiment_mapping[codigo]: cantidad for codigo, cantidad in presentes}
+
+    def top_titulos(self, endpoint, desde=None, hasta=None, n=3):
+        '''
+        Juegos con más reseñas recomendadas (UsersRecommend) o no recomendadas
+        (UsersNotRecommend) entre dos años de publicación, incluidos.
+
+        Returns:
+        - dict: {"Puesto 1": str, ...}, de mayor a menor cantidad, con los empates en el
+          mismo orden que consultas.final_top_3.
+        '''
+        return {f"Puesto {i+1}": titulo for i, (titulo, _) in enumerate(self.mas_resenas(endpoint, desde, hasta, n))}
+
+    def mas_resenas(self, endpoint, desde=None, hasta=None, n=3):
+        '''
+        Returns:
+        - list: (título, cantidad) de los n juegos de top_titulos, en el mismo orden.
+        '''
+        totales = self.resenas.total(desde, hasta, (TIPOS_RESENA[endpoint],))
+        candidatos = np.flatnonzero(totales)
+        cantidades = totales[candidatos].astype(np.int64)
+        # El mismo orden que final_top_3 (sort_values descendente de pandas, que no es
+        # estable): argsort del arreglo invertido y el resultado invertido
+        orden = cantidades[::-1].argsort(kind='quicksort')[::-1][:n]
+        return [(self.titulos[j], int(c)) for j, c in zip(candidatos[::-1][orden], cantidades[::-1][orden])]
+
+    def resenas_titulos(self, endpoint, titulos, desde=None, hasta=None):
+        '''
+        Returns:
+        - list: Cantidad de reseñas de cada título entre dos años de publicación, 0 para
+          los títulos que no están en el cubo.
+        '''
+        totales = self.resenas.total(desde, hasta, (TIPOS_RESENA[endpoint],))
+        cantidades = []
+        for titulo in titulos:
+            # self.titulos está en orden alfabético
+            j = bisect.bisect_left(self.titulos, titulo)
+            cantidades.append(int(totales[j]) if j < len(self.titulos) and self.titulos[j] == titulo else 0)
+        return cantidades
+
+    def buscar(self, endpoint, clave):
+        '''
+        Responde una consulta de un género o de un año, con la misma interfaz que
+        Agregados.buscar.
+
+        Returns:
+        - tuple: (encontrado, respuesta). encontrado es False si el cubo no tiene el
+          endpoint o la clave es una consulta de varios géneros.
+        '''
+        if endpoint not in self.disponibles():
+            return False, None
+        if endpoint == 'PlayTimeGenre':
+            generos = dividir_generos(str(clave))
+            if len(generos) != 1:
+                return False, None
+            resultado = self.horas_genero(generos[0])
+            return True, None if resultado is None else resultado["anio_max"]
+        anio = int(clave)
+        if endpoint == 'sentiment_analysis':
+            return True, self.sentiment_analysis(anio, anio)
+        return True, self.top_titulos(endpoint, anio, anio)
+
+    def resumen(self):
+        '''
+        Returns:
+        - dict: Géneros, títulos y años de cada medida y memoria ocupada en MB.
+        '''
+        medidas = [self.filas_generos, self.minutos_generos, self.sentimientos, self.resenas]
+        return {
+            "generos": len(self.generos),
+            "titulos": len(self.titulos),
+            "anios": {nombre: [int(sumas.anios[0]), int(sumas.anios[-1])] if sumas is not None and len(sumas.anios) else None
+                      for nombre, sumas in [('PlayTimeGenre', self.minutos_generos), ('sentiment_analysis', self.sentimientos),
+                                            ('UsersRecommend', self.resenas)]},
+            "MB": round(sum(m.nbytes for m in medidas if m is not None) / 1024 ** 2, 2),
+        }
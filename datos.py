@@ -0,0 +1,450 @@
+'''
+Almacén de los datasets que consume la API.
+
+Cada archivo Parquet se lee solo con las columnas que necesita su endpoint y con
+tipos compactos (categóricos para géneros, títulos y usuarios, enteros chicos para
+años y sentimientos). Con FORMATO_DATOS=columnar se leen las tablas de hechos de
+columnar.py, cuyos códigos se convierten directamente en esas columnas categóricas. Los datasets con columna 'genres' se acompañan de su índice
+invertido de géneros. Los datasets que se consultan por año se guardan como tablas
+Arrow y se leen con escanear(), que aplica el filtro y la selección de columnas sin
+pasar por pandas (ver lectura.py).
+
+Según configuracion.modo_consulta:
+- 'muestra': la muestra de cada archivo se carga una sola vez en memoria al iniciar.
+- 'exacto': los archivos completos se recorren row group por row group en cada consulta,
+  de modo que la memoria queda acotada por un row group. En los datasets por año, el
+  filtro descarta los row groups que no contienen el año buscado. El dataset de recomendación
+  se reduce a sus filas distintas y sí se mantiene en memoria.
+'''
+
+import logging
+import os
+import resource
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import columnar
+import configuracion
+import lectura
+from ejecucion import verificar_cancelacion
+from indice_generos import IndiceGeneros
+from instrumentacion import tramo
+
+
+logger = logging.getLogger(__name__)
+
+MODOS = ('muestra', 'exacto')
+
+
+def _normalizar_play_time_genre(df):
+    df['genres'] = df['genres'].astype('category')
+    df['release_date'] = df['release_date'].astype('int16')
+    df['playtime_forever'] = pd.to_numeric(df['playtime_forever'], downcast='integer')
+    return df
+
+
+def _normalizar_user_for_genre(df):
+    # Los años inválidos se descartan en la consulta, así que se descartan al cargar
+    df['release_date'] = pd.to_numeric(df['release_date'], errors='coerce')
+    df = df[df['release_date'] >= 100].reset_index(drop=True)
+    df['genres'] = df['genres'].astype('category')
+    df['user_id'] = df['user_id'].astype('category')
+    df['release_date'] = df['release_date'].astype('int16')
+    df['playtime_forever'] = pd.to_numeric(df['playtime_forever'], downcast='integer')
+    return df
+
+
+def _normalizar_users_recommend(tabla):
+    return pa.table({
+        'title': pc.dictionary_encode(tabla['title']),
+        'reviews_posted': tabla['reviews_posted'].cast(pa.int16()),
+        'reviews_recommend': tabla['reviews_recommend'],
+        'sentiment_analysis': tabla['sentiment_analysis'].cast(pa.int8()),
+    })
+
+
+def _normalizar_sentiment_analysis(tabla):
+    return pa.table({
+        'release_date': tabla['release_date'].cast(pa.int16()),
+        'sentiment_analysis': tabla['sentiment_analysis'].cast(pa.int8()),
+    })
+
+
+def _normalizar_recomendacion_juego(df):
+    '''
+    Reduce el dataset a sus filas distintas (item_id, título, texto título + géneros y las
+    columnas de configuracion.columnas_texto_recomendacion) con la cantidad de repeticiones
+    en 'filas', que alcanza para ajustar el TF-IDF.
+    '''
+    # En el formato columnar los textos llegan como categóricos
+    titulos = df['title'].astype(object)
+    texto = titulos.fillna('').astype(str)
+    for columna in ['genres', *configuracion.columnas_texto_recomendacion]:
+        texto = texto + ' ' + df[columna].astype(object).fillna('').astype(str)
+    df = pd.DataFrame({'item_id': df['item_id'], 'title': titulos, 'texto': texto})
+    return df.groupby(['item_id', 'title', 'texto'], dropna=False, sort=False).size().reset_index(name='filas')
+
+
+# nombre: (ruta, columnas, divisor de la muestra, normalización)
+_DATASETS = {
+    'PlayTimeGenre': (configuracion.parquet_file_path1, ['genres', 'release_date', 'playtime_forever'], 80, _normalizar_play_time_genre),
+    'UserForGenre': (configuracion.parquet_file_path2, ['genres', 'user_id', 'release_date', 'playtime_forever'], 80, _normalizar_user_for_genre),
+    'UsersRecommend': (configuracion.parquet_file_path3, ['title', 'reviews_posted', 'reviews_recommend', 'sentiment_analysis'], 1, _normalizar_users_recommend),
+    'sentiment_analysis': (configuracion.parquet_file_path4, ['release_date', 'sentiment_analysis'], 1, _normalizar_sentiment_analysis),
+    'RecomendacionJuego': (configuracion.parquet_file_path5, ['item_id', 'title', 'genres', *configuracion.columnas_texto_recomendacion],
+                           None, _normalizar_recomendacion_juego),
+}
+
+# Datasets que se guardan y se consultan como tablas Arrow
+_TABLAS_ARROW = {'UsersRecommend', 'sentiment_analysis'}
+
+# Columna de año de cada dataset que se puede recorrer con AlmacenDatos.filas()
+COLUMNAS_ANIO = {
+    'PlayTimeGenre': 'release_date',
+    'UserForGenre': 'release_date',
+    'UsersRecommend': 'reviews_posted',
+    'sentiment_analysis': 'release_date',
+}
+
+
+def _columnas_archivo(columnas):
+    if configuracion.formato_datos == 'columnar':
+        return columnar.columnas_hechos(columnas)
+    return columnas
+
+
+def _decodificar(tabla, raiz):
+    if configuracion.formato_datos == 'columnar':
+        return columnar.decodificar(tabla, raiz)
+    return tabla
+
+
+def ruta_dataset(nombre, raiz=''):
+    '''
+    Ruta del archivo (o directorio por lotes) de un dataset dentro de un directorio de
+    artefactos (ver instantaneas.py), por defecto el directorio actual.
+    '''
+    return os.path.join(raiz, _DATASETS[nombre][0])
+
+
+def _muestra_por_row_group(archivos, columnas, fraccion):
+    '''
+    Toma el comienzo de cada row group de los archivos, la misma fracción de filas de
+    cada uno, leyendo un row group a la vez. Los datasets por año se guardan ordenados por
+    año (para filtrar row groups en modo 'exacto'), así que el primer row group solo tiene
+    los primeros años: la muestra tiene que recorrerlos todos.
+    '''
+    partes = []
+    for archivo in archivos:
+        parquet = pq.ParquetFile(archivo)
+        for i in range(parquet.num_row_groups):
+            filas = int(parquet.metadata.row_group(i).num_rows * fraccion)
+            if filas or not partes:
+                partes.append(parquet.read_row_group(i, columns=columnas).slice(0, filas))
+    return pa.concat_tables(partes)
+
+
+def _leer_muestra(nombre, raiz=''):
+    '''
+    Lee la muestra del dataset que usan los endpoints en modo 'muestra': el primer row
+    group, limitado al porcentaje de filas configurado (o la muestra aleatoria del 50%
+    para el dataset de recomendación). En los datasets por año, que se guardan ordenados
+    por año, se toma ese porcentaje del comienzo de cada row group.
+
+    Parameters:
+    - nombre (str): Nombre del dataset.
+    - raiz (str): Directorio de artefactos.
+
+    Returns:
+    - pd.DataFrame or pa.Table: La muestra normalizada.
+    '''
+    _, columnas, divisor, normalizar = _DATASETS[nombre]
+    archivos = lectura.archivos(ruta_dataset(nombre, raiz))
+
+    if nombre in _TABLAS_ARROW:
+        fraccion = configuracion.sample_percent / 100.0 / divisor
+        return normalizar(_decodificar(_muestra_por_row_group(archivos, _columnas_archivo(columnas), fraccion), raiz))
+
+    tabla = _decodificar(pq.ParquetFile(archivos[0]).read_row_groups(row_groups=[0], columns=_columnas_archivo(columnas)), raiz)
+    total_rows = sum(pq.ParquetFile(archivo).metadata.num_rows for archivo in archivos)
+
+    df = tabla.to_pandas()
+
+    if divisor is None:
+        num_registros = int(len(df) * (configuracion.porcentaje_muestra_recomendacion / 100.0))
+        df = df.sample(n=num_registros, random_state=42)
+    else:
+        sample_rows = int(total_rows * (configuracion.sample_percent / 100.0))
+        df = df.head(sample_rows // divisor)
+    df = normalizar(df.reset_index(drop=True))
+    # En el formato columnar las categorías son la dimensión completa: la muestra conserva las que usa
+    for columna in df.columns[df.dtypes == 'category']:
+        df[columna] = df[columna].cat.remove_unused_categories()
+    return df
+
+
+def leer_row_groups(nombre, raiz=''):
+    '''
+    Recorre el archivo completo de un dataset (o todos los archivos de un dataset por
+    lotes), un row group a la vez.
+
+    Parameters:
+    - nombre (str): Nombre del dataset.
+    - raiz (str): Directorio de artefactos, por defecto el actual.
+
+    Yields:
+    - pd.DataFrame or pa.Table: Cada row group normalizado.
+    '''
+    _, columnas, _, normalizar = _DATASETS[nombre]
+    for archivo in lectura.archivos(ruta_dataset(nombre, raiz)):
+        parquet_file = pq.ParquetFile(archivo)
+        for i in range(parquet_file.num_row_groups):
+            with tramo('lectura_parquet'):
+                tabla = _decodificar(parquet_file.read_row_group(i, columns=_columnas_archivo(columnas)), raiz)
+            if nombre not in _TABLAS_ARROW:
+                with tramo('to_pandas'):
+                    tabla = tabla.to_pandas()
+            with tramo('normalizacion'):
+                datos = normalizar(tabla)
+            yield datos
+
+
+def normalizar(nombre, datos):
+    '''
+    Aplica la normalización de carga de un dataset a filas leídas por otra vía (por
+    ejemplo, un lote nuevo en incremental.py).
+
+    Parameters:
+    - nombre (str): Nombre del dataset.
+    - datos (pd.DataFrame or pa.Table): Filas con las columnas del dataset; una tabla Arrow
+      para los datasets por año.
+
+    Returns:
+    - pd.DataFrame or pa.Table: Las filas normalizadas.
+    '''
+    _, columnas, _, normalizacion = _DATASETS[nombre]
+    if nombre in _TABLAS_ARROW:
+        return normalizacion(datos.select(columnas))
+    return normalizacion(datos[columnas].reset_index(drop=True))
+
+
+def _leer_recomendacion_completo(raiz):
+    df = pd.concat(leer_row_groups('RecomendacionJuego', raiz), ignore_index=True)
+    return df.groupby(['item_id', 'title', 'texto'], dropna=False, sort=False)['filas'].sum().reset_index()
+
+
+class AlmacenDatos:
+    '''
+    Contiene los DataFrames de cada endpoint, o en modo 'exacto' la referencia para
+    recorrerlos desde disco.
+
+    Las rutas de configuracion se resuelven contra `raiz`, el directorio de artefactos de
+    la instantánea a la que pertenece el almacén (ver instantaneas.py).
+    '''
+
+    def __init__(self, modo=None, raiz=''):
+        self.modo = modo or configuracion.modo_consulta
+        if self.modo not in MODOS:
+            raise ValueError(f"Modo de consulta inválido: {self.modo}. Usar 'muestra' o 'exacto'")
+        self.raiz = raiz
+        self.datasets = {}
+        self.indices = {}
+        self.en_disco = set()
+
+    def cargar(self, nombres=None):
+        '''
+        Carga los datasets disponibles. Los archivos inexistentes se informan
+        y se omiten, para que el resto de la API siga funcionando.
+
+        Parameters:
+        - nombres (list): Datasets a cargar, por defecto todos.
+        '''
+        if configuracion.carga_datos == 'mmap':
+            # mapeo importa agregados, que a su vez importa este módulo
+            import mapeo
+            if mapeo.cargar(self, nombres):
+                return
+            logger.warning("CARGA_DATOS=mmap sin archivos exportados vigentes: se leen los Parquet (ver mapeo.py)")
+
+        for nombre in _DATASETS:
+            if nombres is not None and nombre not in nombres:
+                continue
+            ruta = ruta_dataset(nombre, self.raiz)
+            if not os.path.exists(ruta) or not lectura.archivos(ruta):
+                logger.warning("No se encontró el archivo %s, se omite el dataset %s", ruta, nombre)
+                continue
+
+            if self.modo == 'exacto':
+                if nombre != 'RecomendacionJuego':
+                    self.en_disco.add(nombre)
+                    logger.info("Dataset %s: se recorre completo desde %s en cada consulta", nombre, ruta)
+                    continue
+                df = _leer_recomendacion_completo(self.raiz)
+            else:
+                df = _leer_muestra(nombre, self.raiz)
+
+            self.datasets[nombre] = df
+            if isinstance(df, pd.DataFrame) and 'genres' in df:
+                self.indices[nombre] = IndiceGeneros(df['genres'])
+            logger.info("Dataset %s cargado: %d filas", nombre, len(df))
+
+    def obtener(self, nombre):
+        '''
+        Devuelve el DataFrame de un dataset cargado en memoria.
+
+        Parameters:
+        - nombre (str): Nombre del dataset (por ejemplo 'RecomendacionJuego').
+
+        Returns:
+        - pd.DataFrame or pa.Table: El dataset cargado.
+
+        Raises:
+        - FileNotFoundError: Si el dataset no está cargado.
+        '''
+        if nombre not in self.datasets:
+            raise FileNotFoundError(f"El dataset {nombre} no está cargado")
+        return self.datasets[nombre]
+
+    def fragmentos(self, nombre):
+        '''
+        Recorre un dataset por partes: una sola parte (la muestra en memoria) en modo
+        'muestra', un row group por parte en modo 'exacto'.
+
+        Parameters:
+        - nombre (str): Nombre del dataset.
+
+        Yields:
+        - tuple: (pd.DataFrame, IndiceGeneros o None) de cada parte.
+
+        Raises:
+        - FileNotFoundError: Si el dataset no está disponible.
+        '''
+        if nombre in self.datasets:
+            yield self.datasets[nombre], self.indices.get(nombre)
+        elif nombre in self.en_disco:
+            for df in leer_row_groups(nombre, self.raiz):
+                verificar_cancelacion()
+                if 'genres' not in df:
+                    yield df, None
+                    continue
+                with tramo('indice_generos'):
+                    indice = IndiceGeneros(df['genres'])
+                yield df, indice
+        else:
+            raise FileNotFoundError(f"El dataset {nombre} no está cargado")
+
+    def escanear(self, nombre, columnas, filtro=None):
+        '''
+        Consulta un dataset guardado como tabla Arrow: solo las columnas indicadas y solo
+        las filas que cumplen el filtro. En modo 'exacto' el filtro se aplica al leer el
+        archivo y saltea los row groups que no pueden contener filas que lo cumplan.
+
+        Parameters:
+        - nombre (str): Nombre del dataset (por ejemplo 'UsersRecommend').
+        - columnas (list): Columnas que necesita la consulta.
+        - filtro (pyarrow.compute.Expression): Condición sobre las filas, o None.
+
+        Yields:
+        - pa.Table: Partes del resultado filtrado.
+
+        Raises:
+        - FileNotFoundError: Si el dataset no está disponible.
+        '''
+        if nombre in self.datasets:
+            with tramo('filtro_arrow'):
+                tabla = lectura.filtrar_tabla(self.datasets[nombre], columnas, filtro)
+            yield tabla
+        elif nombre in self.en_disco:
+            for tabla in lectura.escanear(ruta_dataset(nombre, self.raiz), _columnas_archivo(columnas), filtro):
+                verificar_cancelacion()
+                yield _decodificar(tabla, self.raiz)
+        else:
+            raise FileNotFoundError(f"El dataset {nombre} no está cargado")
+
+    def filas(self, nombre, anio=None, generos=None, operador='y'):
+        '''
+        Recorre las filas de un dataset que cumplen los filtros, sin agregarlas, como tablas
+        Arrow. En modo 'exacto' se lee un row group por vez.
+
+        Parameters:
+        - nombre (str): Nombre del dataset (ver COLUMNAS_ANIO).
+        - anio (int): Año de la columna de año del dataset, o None para todos.
+        - generos (list): Géneros buscados, o None para todos.
+        - operador (str): Con varios géneros, 'y' exige todos y 'o' alguno.
+
+        Returns:
+        - generator: Tablas Arrow con las columnas del dataset.
+
+        Raises:
+        - FileNotFoundError: Si el dataset no está disponible.
+        - ValueError: Si se filtra por géneros un dataset que no los tiene.
+        '''
+        # Se valida antes de devolver el generador, para responder el error antes de empezar a enviar filas
+        columna_anio = COLUMNAS_ANIO.get(nombre)
+        if columna_anio is None or (nombre not in self.datasets and nombre not in self.en_disco):
+            raise FileNotFoundError(f"El dataset {nombre} no está cargado")
+        if nombre in _TABLAS_ARROW:
+            if generos:
+                raise ValueError(f"El dataset {nombre} no tiene géneros")
+            filtro = None if anio is None else pc.field(columna_anio) == anio
+            return self.escanear(nombre, _DATASETS[nombre][1], filtro)
+        return self._filas_generos(nombre, columna_anio, anio, generos, operador)
+
+    def _filas_generos(self, nombre, columna_anio, anio, generos, operador):
+        for df, indice in self.fragmentos(nombre):
+            if generos:
+                df = df.take(indice.filas(generos, operador))
+            if anio is not None:
+                df = df[df[columna_anio] == anio]
+            with tramo('to_arrow'):
+                tabla = pa.Table.from_pandas(df, preserve_index=False)
+            yield tabla
+
+    def descartar(self, nombre):
+        '''
+        Libera un dataset que ya no se necesita (por ejemplo, una vez construido el modelo
+        de recomendación).
+        '''
+        self.datasets.pop(nombre, None)
+        self.indices.pop(nombre, None)
+
+    def reporte_memoria(self):
+        '''
+        Resume la memoria ocupada por cada dataset y por el proceso.
+
+        Returns:
+        - dict: Filas, columnas y MB por dataset, total de los datasets y memoria
+          residente máxima del proceso.
+        '''
+        reporte = {}
+        total = 0
+        for nombre, df in self.datasets.items():
+            if isinstance(df, pa.Table):
+                total += df.nbytes
+                reporte[nombre] = {
+                    "filas": df.num_rows,
+                    "columnas": {campo.name: str(campo.type) for campo in df.schema},
+                    "MB": round(df.nbytes / 2**20, 2),
+                }
+                continue
+            bytes_df = int(df.memory_usage(deep=True).sum())
+            if nombre in self.indices:
+                indice = self.indices[nombre]
+                bytes_df += sum(p.nbytes for p in indice.posiciones.values()) + sum(b.nbytes for b in indice.bitmaps.values())
+            total += bytes_df
+            reporte[nombre] = {
+                "filas": len(df),
+                "columnas": {col: str(tipo) for col, tipo in df.dtypes.items()},
+                "MB": round(bytes_df / 2**20, 2),
+            }
+        return {
+            "modo": self.modo,
+            "datasets": reporte,
+            "en_disco": sorted(self.en_disco),
+            "total_MB": round(total / 2**20, 2),
+            # En Linux ru_maxrss está expresado en KB
+            "proceso_max_rss_MB": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10, 2),
+        }
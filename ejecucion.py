@@ -0,0 +1,184 @@
+'''
+Ejecución del trabajo pesado de los endpoints fuera del event loop.
+
+Las consultas con pandas/pyarrow y las recomendaciones bloquean el hilo que las
+ejecuta. Para que una consulta lenta no frene al resto, cada clase de endpoint tiene
+su propio pool de hilos acotado (configuracion.grupos_ejecucion), con:
+
+- límite de hilos y de consultas en espera: si la cola está llena se responde 503;
+- timeout por consulta: vencido el plazo se responde 504, la consulta se cancela si
+  todavía no empezó y, si ya empezó, se marca como cancelada para que se detenga en
+  el próximo punto de control (verificar_cancelacion(), entre row groups). Lo mismo
+  pasa si se cancela la consulta que espera (el cliente se desconectó o la API se
+  detiene);
+- métricas de cola y de tiempos de espera y ejecución, para distinguir saturación
+  (mucho tiempo en cola) de lentitud (mucho tiempo ejecutando).
+'''
+
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import configuracion
+import instrumentacion
+
+
+_cancelacion = contextvars.ContextVar('cancelacion', default=None)
+
+
+class Saturado(Exception):
+    '''La cola del grupo de ejecución está llena.'''
+
+
+class TiempoAgotado(Exception):
+    '''La consulta superó el timeout de su grupo de ejecución.'''
+
+
+class Cancelado(Exception):
+    '''La consulta se canceló mientras se ejecutaba.'''
+
+
+def verificar_cancelacion():
+    '''
+    Punto de control para los recorridos largos: corta la consulta si se canceló.
+
+    Raises:
+    - Cancelado: Si la consulta en curso superó su timeout.
+    '''
+    evento = _cancelacion.get()
+    if evento is not None and evento.is_set():
+        raise Cancelado()
+
+
+class GrupoEjecucion:
+    '''
+    Pool de hilos acotado para una clase de endpoints, con timeout y métricas.
+    '''
+
+    def __init__(self, nombre, hilos, cola, timeout):
+        '''
+        Parameters:
+        - nombre (str): Nombre del grupo (por ejemplo 'consultas').
+        - hilos (int): Consultas que se ejecutan a la vez.
+        - cola (int): Consultas que pueden esperar un hilo libre.
+        - timeout (float): Segundos que puede tardar una consulta, contando la espera.
+        '''
+        self.nombre = nombre
+        self.hilos = hilos
+        self.max_cola = cola
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix=f'ejecucion-{nombre}')
+        self._lock = threading.Lock()
+        self.en_cola = 0
+        self.en_curso = 0
+        self.completadas = 0
+        self.fallidas = 0
+        self.rechazadas = 0
+        self.vencidas = 0
+        self.canceladas = 0
+        self.espera_total = 0.0
+        self.ejecucion_total = 0.0
+
+    def _correr(self, contexto, encolada, funcion, args, kwargs):
+        inicio = time.perf_counter()
+        with self._lock:
+            self.en_cola -= 1
+            self.en_curso += 1
+            self.espera_total += inicio - encolada
+        try:
+            # Con un perfil pedido por la consulta, el trabajo corre bajo el perfilador
+            resultado = contexto.run(instrumentacion.correr, funcion, *args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self.fallidas += 1
+            raise
+        else:
+            with self._lock:
+                self.completadas += 1
+            return resultado
+        finally:
+            with self._lock:
+                self.en_curso -= 1
+                self.ejecucion_total += time.perf_counter() - inicio
+
+    async def ejecutar(self, funcion, *args, **kwargs):
+        '''
+        Ejecuta la función en el pool y espera el resultado sin bloquear el event loop.
+
+        Returns:
+        - El resultado de la función.
+
+        Raises:
+        - Saturado: Si la cola está llena.
+        - TiempoAgotado: Si la consulta no terminó dentro del timeout.
+        - asyncio.CancelledError: Si se canceló la tarea que espera el resultado.
+        '''
+        with self._lock:
+            if self.en_cola >= self.max_cola:
+                self.rechazadas += 1
+                raise Saturado(f"El grupo {self.nombre} tiene {self.en_cola} consultas en espera")
+            self.en_cola += 1
+
+        # La función corre con una copia del contexto del request y su propia marca de cancelación
+        evento = threading.Event()
+        contexto = contextvars.copy_context()
+        contexto.run(_cancelacion.set, evento)
+        futuro = self._executor.submit(self._correr, contexto, time.perf_counter(), funcion, args, kwargs)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(futuro), self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            evento.set()
+            if futuro.cancel():
+                # No llegó a empezar: se descuenta de la cola
+                with self._lock:
+                    self.en_cola -= 1
+            if isinstance(e, asyncio.CancelledError):
+                with self._lock:
+                    self.canceladas += 1
+                raise
+            with self._lock:
+                self.vencidas += 1
+            raise TiempoAgotado(f"La consulta superó el límite de {self.timeout} s") from None
+
+    def enviar(self, funcion, *args):
+        '''
+        Ejecuta la función en el pool sin esperar el resultado ni pasar por la cola, para
+        liberar recursos desde código que ya no puede esperar (por ejemplo, al cortarse una
+        respuesta).
+        '''
+        self._executor.submit(funcion, *args)
+
+    def metricas(self):
+        with self._lock:
+            iniciadas = self.completadas + self.fallidas
+            return {
+                "hilos": self.hilos,
+                "timeout_segundos": self.timeout,
+                "en_curso": self.en_curso,
+                "en_cola": self.en_cola,
+                "max_cola": self.max_cola,
+                "completadas": self.completadas,
+                "fallidas": self.fallidas,
+                "rechazadas": self.rechazadas,
+                "vencidas": self.vencidas,
+                "canceladas": self.canceladas,
+                "espera_promedio_ms": round(1000 * self.espera_total / iniciadas, 2) if iniciadas else None,
+                "ejecucion_promedio_ms": round(1000 * self.ejecucion_total / iniciadas, 2) if iniciadas else None,
+            }
+
+
+grupos = {nombre: GrupoEjecucion(nombre, **parametros) for nombre, parametros in configuracion.grupos_ejecucion.items()}
+
+
+async def ejecutar(grupo, funcion, *args, **kwargs):
+    '''
+    Ejecuta la función en el pool del grupo indicado ('consultas' o 'recomendacion').
+    '''
+    return await grupos[grupo].ejecutar(funcion, *args, **kwargs)
+
+
+def metricas():
+    return {nombre: grupo.metricas() for nombre, grupo in grupos.items()}
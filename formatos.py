@@ -0,0 +1,191 @@
+'''
+Formatos de respuesta por negociación de contenido (encabezado Accept).
+
+- 'json' (application/json): la respuesta de siempre, un documento JSON.
+- 'ndjson' (application/x-ndjson): una fila por línea.
+- 'arrow' (application/vnd.apache.arrow.stream): formato de streaming de Arrow IPC, un
+  record batch por lote de filas, escrito directamente desde las tablas Arrow.
+
+En 'ndjson' y 'arrow' los endpoints devuelven la tabla completa detrás de la respuesta
+(por ejemplo el ranking de todos los usuarios, no solo el primero), y /filas devuelve las
+filas de un dataset. La respuesta se envía por partes de
+configuracion.filas_por_lote_respuesta filas: la primera parte sale apenas está lista, y el
+servidor solo tiene en memoria la parte que está escribiendo (y, en /filas en modo
+'exacto', el row group que está leyendo). Cada parte se genera en el pool de 'consultas',
+fuera del event loop.
+
+Ninguno de los dos formatos arma un diccionario de Python por fila: Arrow escribe los
+buffers de las columnas y NDJSON usa el serializador de pandas sobre cada lote.
+'''
+
+import io
+import threading
+
+from fastapi.responses import StreamingResponse
+
+import configuracion
+import ejecucion
+
+
+TIPOS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+# Tipos del encabezado Accept que se aceptan para cada formato
+_FORMATOS = {
+    'application/json': 'json',
+    'application/*': 'json',
+    '*/*': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'application/vnd.apache.arrow.stream': 'arrow',
+}
+
+
+def negociar(accept):
+    '''
+    Elige el formato de respuesta según el encabezado Accept.
+
+    Parameters:
+    - accept (str): Valor del encabezado, o None.
+
+    Returns:
+    - str: 'json', 'ndjson' o 'arrow'. Sin encabezado, o si no pide ningún tipo conocido,
+      'json'.
+    '''
+    if not accept:
+        return 'json'
+    mejor, clave_mejor = 'json', (0.0, 0)
+    for parte in accept.split(','):
+        tipo, *parametros = [p.strip() for p in parte.split(';')]
+        tipo = tipo.lower()
+        if tipo not in _FORMATOS:
+            continue
+        calidad = 1.0
+        for parametro in parametros:
+            nombre, _, valor = parametro.partition('=')
+            if nombre.strip() == 'q':
+                try:
+                    calidad = float(valor)
+                except ValueError:
+                    calidad = 0.0
+        # Ante igual calidad gana el tipo concreto sobre application/* y */*
+        clave = (calidad, -tipo.count('*'))
+        if calidad > 0 and clave > clave_mejor:
+            mejor, clave_mejor = _FORMATOS[tipo], clave
+    return mejor
+
+
+class _Salida(io.RawIOBase):
+    '''
+    Archivo de solo escritura que junta lo escrito hasta que se retira con retirar().
+    '''
+
+    def __init__(self):
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def retirar(self):
+        datos = b"".join(self._partes)
+        self._partes.clear()
+        return datos
+
+
+def _lotes(tablas):
+    for tabla in tablas:
+        yield from tabla.replace_schema_metadata(None).to_batches(max_chunksize=configuracion.filas_por_lote_respuesta)
+
+
+def _arrow(tablas):
+    import pyarrow as pa
+
+    salida = _Salida()
+    esquema = escritor = None
+    for lote in _lotes(tablas):
+        if escritor is None:
+            esquema = lote.schema
+            escritor = pa.ipc.new_stream(salida, esquema)
+        elif lote.schema != esquema:
+            # Los archivos de un dataset por lotes pueden diferir en tipos (por ejemplo
+            # texto y texto con diccionario): el stream conserva el esquema del primero
+            lote = pa.Table.from_batches([lote]).cast(esquema).combine_chunks().to_batches()[0]
+        escritor.write_batch(lote)
+        yield salida.retirar()
+    if escritor is None:
+        # Sin filas: un stream con el esquema vacío
+        escritor = pa.ipc.new_stream(salida, pa.schema([]))
+    escritor.close()
+    yield salida.retirar()
+
+
+def _registros(lote):
+    return lote.to_pandas().to_json(orient='records', lines=True, force_ascii=False, date_format='iso')
+
+
+def _ndjson(tablas):
+    for lote in _lotes(tablas):
+        if lote.num_rows:
+            yield (_registros(lote).rstrip('\n') + '\n').encode()
+
+
+def _json(tablas):
+    # Un arreglo JSON escrito por partes: cada lote sin sus corchetes, separados por comas
+    separador = b"["
+    for lote in _lotes(tablas):
+        if lote.num_rows:
+            yield separador + lote.to_pandas().to_json(orient='records', force_ascii=False, date_format='iso')[1:-1].encode()
+            separador = b","
+    yield b"[]" if separador == b"[" else b"]"
+
+
+_CODIFICADORES = {'json': _json, 'ndjson': _ndjson, 'arrow': _arrow}
+
+
+def respuesta(tablas, formato, grupo='consultas'):
+    '''
+    Respuesta que envía tablas Arrow por partes en el formato pedido.
+
+    Parameters:
+    - tablas (iterable): Tablas Arrow (o un generador que las va leyendo).
+    - formato (str): 'json', 'ndjson' o 'arrow'.
+    - grupo (str): Pool de ejecución donde se genera cada parte.
+
+    Returns:
+    - StreamingResponse: La respuesta, con el tipo de contenido del formato.
+    '''
+    partes = _CODIFICADORES[formato](tablas)
+    # Un next() vencido sigue corriendo en el pool: cerrar el generador espera a que termine
+    en_uso = threading.Lock()
+
+    def siguiente():
+        with en_uso:
+            return next(partes, None)
+
+    def cerrar():
+        with en_uso:
+            partes.close()
+
+    async def cuerpo():
+        terminado = False
+        try:
+            while True:
+                parte = await ejecucion.ejecutar(grupo, siguiente)
+                if parte is None:
+                    terminado = True
+                    return
+                yield parte
+        finally:
+            if not terminado:
+                # Timeout, error o cliente desconectado: se cierran los lectores de row groups
+                # en el pool, sin esperar (la tarea puede estar cancelada)
+                ejecucion.grupos[grupo].enviar(cerrar)
+
+    return StreamingResponse(cuerpo(), media_type=TIPOS[formato], headers={"Vary": "Accept"})
@@ -0,0 +1,420 @@
+'''
+Actualización incremental de los datasets servidos y de sus artefactos.
+
+    python incremental.py Data/combinado.parquet
+
+La entrada son los registros combinados de usuario y juego (una fila por user_id e
+item_id con las columnas de los cinco datasets, ver ESQUEMA), como los arma el notebook
+de Feature Engineering a partir de una nueva descarga. En lugar de regenerar los
+archivos y reconstruir agregados y modelo desde cero:
+
+1. cada registro se compara con el estado guardado (user_id, item_id y hash del
+   contenido) y solo se procesan los nuevos o modificados;
+2. los registros nuevos se agregan como un lote más en el directorio de cada dataset
+   (configuracion.directorio_incremental); la versión anterior de un registro
+   modificado se quita del lote donde estaba, reescribiendo solo ese lote;
+3. los agregados se mantienen a partir de sumas y conteos parciales guardados: se suman
+   los del lote nuevo, se restan los de las filas quitadas y se recalculan solo las
+   respuestas de los géneros y años afectados;
+4. el modelo de recomendación se actualiza con ModeloRecomendacion.actualizar().
+
+La API sirve estos directorios con ORIGEN_DATOS=incremental y MODO_CONSULTA=exacto, que
+son los valores que usa este script si no se indican otros. Los registros que dejan de
+aparecer en la entrada no se borran: cada descarga se trata como acumulativa.
+'''
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import time
+
+# Los datos por lotes se consultan completos: la configuración se lee al importar los módulos
+os.environ.setdefault("ORIGEN_DATOS", "incremental")
+os.environ.setdefault("MODO_CONSULTA", "exacto")
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import configuracion
+import consultas
+import datos
+import lectura
+from agregados import guardar_agregados
+from indice_generos import IndiceGeneros
+from recomendacion import ModeloRecomendacion
+
+
+logger = logging.getLogger(__name__)
+
+ESQUEMA = pa.schema([
+    ('user_id', pa.string()), ('item_id', pa.int32()), ('title', pa.string()), ('genres', pa.string()),
+    ('release_date', pa.int32()), ('playtime_forever', pa.int64()), ('reviews_posted', pa.int64()),
+    ('reviews_recommend', pa.bool_()), ('sentiment_analysis', pa.int64()),
+])
+CLAVE = ['user_id', 'item_id']
+
+# dataset: (directorio, columnas del archivo)
+PROYECCIONES = {
+    'PlayTimeGenre': (configuracion.parquet_file_path1, ['genres', 'release_date', 'item_id', 'playtime_forever']),
+    'UserForGenre': (configuracion.parquet_file_path2, ['genres', 'release_date', 'item_id', 'playtime_forever', 'user_id']),
+    'UsersRecommend': (configuracion.parquet_file_path3, ['title', 'item_id', 'reviews_posted', 'reviews_recommend', 'sentiment_analysis']),
+    'sentiment_analysis': (configuracion.parquet_file_path4, ['release_date', 'item_id', 'sentiment_analysis']),
+    'RecomendacionJuego': (configuracion.parquet_file_path5, ['genres', 'title', 'item_id']),
+}
+
+# parcial: claves por las que se acumula 'valor' (suma de horas o conteo) y 'filas'
+CLAVES_PARCIALES = {
+    'PlayTimeGenre': ['genero', 'release_date'],
+    'UserForGenre': ['genero', 'user_id', 'Año'],
+    'UsersRecommend': ['reviews_posted', 'title'],
+    'UsersNotRecommend': ['reviews_posted', 'title'],
+    'sentiment_analysis': ['release_date', 'sentiment_analysis'],
+}
+
+# Posición de la primera aparición de los registros quitados: no cambia el mínimo
+_SIN_POSICION = np.iinfo(np.int64).max
+
+
+def _ruta(*partes):
+    return os.path.join(configuracion.directorio_incremental, *partes)
+
+
+def _nombre_lote(numero):
+    return f'lote-{numero:06d}.parquet'
+
+
+def _escribir(tabla, ruta, columna_orden=None):
+    # Se escribe a un temporal y se reemplaza, para no dejar archivos a medio escribir
+    if columna_orden is not None:
+        tabla = tabla.sort_by(columna_orden)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = ruta + '.tmp'
+    pq.write_table(tabla, temporal, row_group_size=configuracion.filas_por_row_group, compression='gzip')
+    os.replace(temporal, ruta)
+
+
+def escribir_lote(tabla, numero):
+    '''
+    Escribe los registros de un lote en el directorio de registros combinados y su
+    proyección en el directorio de cada dataset (ordenada por año en los datasets que
+    se filtran por año). Un lote sin filas se elimina.
+
+    Parameters:
+    - tabla (pa.Table): Registros del lote con el ESQUEMA.
+    - numero (int): Número de lote.
+    '''
+    nombre = _nombre_lote(numero)
+    rutas = [(_ruta('combinado', nombre), None, None)]
+    rutas += [(os.path.join(directorio, nombre), columnas, lectura.COLUMNAS_ORDEN.get(directorio))
+              for directorio, columnas in PROYECCIONES.values()]
+    for ruta, columnas, columna_orden in rutas:
+        if tabla.num_rows == 0:
+            if os.path.exists(ruta):
+                os.remove(ruta)
+            continue
+        _escribir(tabla if columnas is None else tabla.select(columnas), ruta, columna_orden)
+
+
+def leer_entrada(ruta):
+    '''
+    Lee los registros combinados, con un registro por user_id e item_id (ante
+    repetidos queda el último).
+
+    Returns:
+    - pd.DataFrame: Registros con las columnas del ESQUEMA y su 'hash' de contenido.
+    '''
+    df = pq.read_table(ruta, columns=ESQUEMA.names).cast(ESQUEMA).to_pandas()
+    df = df.drop_duplicates(CLAVE, keep='last').reset_index(drop=True)
+    df['hash'] = pd.util.hash_pandas_object(df[ESQUEMA.names], index=False).to_numpy()
+    return df
+
+
+def leer_estado():
+    '''
+    Estado de los registros ya procesados: clave, hash del contenido y ubicación (lote y fila).
+    '''
+    ruta = _ruta('estado.parquet')
+    if os.path.exists(ruta):
+        return pd.read_parquet(ruta)
+    return pd.DataFrame({'user_id': pd.Series(dtype=object), 'item_id': pd.Series(dtype='int32'),
+                         'hash': pd.Series(dtype='uint64'), 'lote': pd.Series(dtype='int32'),
+                         'fila': pd.Series(dtype='int64')})
+
+
+def detectar_cambios(entrada, estado):
+    '''
+    Separa los registros de la entrada que hay que procesar.
+
+    Returns:
+    - tuple: (máscara de registros nuevos o modificados, filas del estado con la versión
+      anterior de los modificados)
+    '''
+    posiciones = pd.MultiIndex.from_frame(estado[CLAVE]).get_indexer(pd.MultiIndex.from_frame(entrada[CLAVE]))
+    existe = posiciones >= 0
+    cambiado = existe.copy()
+    cambiado[existe] = estado['hash'].to_numpy()[posiciones[existe]] != entrada['hash'].to_numpy()[existe]
+    return ~existe | cambiado, estado.iloc[posiciones[cambiado]]
+
+
+def quitar_registros(anteriores, estado):
+    '''
+    Quita la versión anterior de los registros modificados de los lotes donde estaban,
+    reescribiendo solo esos lotes.
+
+    Parameters:
+    - anteriores (pd.DataFrame): Filas del estado de los registros a quitar.
+    - estado (pd.DataFrame): Estado completo; se devuelve actualizado.
+
+    Returns:
+    - tuple: (pa.Table con los registros quitados y su 'orden', estado sin esos registros
+      y con las filas de los lotes reescritos renumeradas)
+    '''
+    quitadas = []
+    estado = estado.copy()
+    for lote, grupo in anteriores.groupby('lote'):
+        tabla = pq.read_table(_ruta('combinado', _nombre_lote(lote))).cast(ESQUEMA)
+        conservar = np.ones(tabla.num_rows, dtype=bool)
+        conservar[grupo['fila'].to_numpy()] = False
+        quitadas.append(tabla.filter(~conservar))
+        escribir_lote(tabla.filter(conservar), lote)
+
+        del_lote = (estado['lote'] == lote).to_numpy()
+        nueva_fila = np.cumsum(conservar) - 1
+        estado.loc[del_lote, 'fila'] = nueva_fila[estado.loc[del_lote, 'fila'].to_numpy()]
+    estado = estado.drop(anteriores.index)
+    if not quitadas:
+        return pa.table({**{c.name: pa.array([], c.type) for c in ESQUEMA}, 'orden': pa.array([], pa.int64())}), estado
+    tabla = pa.concat_tables(quitadas)
+    return tabla.append_column('orden', pa.array(np.full(tabla.num_rows, _SIN_POSICION))), estado
+
+
+def ultimo_lote():
+    directorio = _ruta('combinado')
+    if not os.path.isdir(directorio):
+        return 0
+    numeros = [int(nombre[5:11]) for nombre in os.listdir(directorio) if nombre.startswith('lote-') and nombre.endswith('.parquet')]
+    return max(numeros, default=0)
+
+
+def _parciales_generos(df, parcial, claves):
+    indice = IndiceGeneros(df['genres'])
+    # Con una hora por fila, el mismo parcial cuenta las filas de cada grupo
+    unos = df.assign(playtime_forever=60)
+    partes = []
+    for genero in indice.generos:
+        parte = pd.DataFrame({'valor': parcial(df, indice, genero), 'filas': parcial(unos, indice, genero)})
+        partes.append(parte.reset_index().assign(genero=genero))
+    if not partes:
+        return pd.DataFrame(columns=claves + ['valor', 'filas'])
+    return pd.concat(partes, ignore_index=True)[claves + ['valor', 'filas']].astype({'filas': 'int64'})
+
+
+def calcular_parciales(tabla):
+    '''
+    Sumas y conteos parciales de los registros de un lote, con las mismas reglas de carga
+    y de consulta que la API.
+
+    Parameters:
+    - tabla (pa.Table): Registros con el ESQUEMA y su posición 'orden' (lote y fila).
+
+    Returns:
+    - dict: {parcial: pd.DataFrame con las CLAVES_PARCIALES, 'valor' y 'filas'}. El de
+      sentiment_analysis incluye la 'primera' posición de cada grupo, que desempata como
+      el orden de primera aparición del cálculo completo.
+    '''
+    df = tabla.to_pandas()
+    parciales = {
+        'PlayTimeGenre': _parciales_generos(datos.normalizar('PlayTimeGenre', df), consultas.parcial_play_time_genre,
+                                            CLAVES_PARCIALES['PlayTimeGenre']),
+        'UserForGenre': _parciales_generos(datos.normalizar('UserForGenre', df), consultas.parcial_user_for_genre,
+                                           CLAVES_PARCIALES['UserForGenre']),
+    }
+
+    resenas = datos.normalizar('UsersRecommend', tabla)
+    for nombre, filtro in (('UsersRecommend', consultas.filtro_recomendados()),
+                           ('UsersNotRecommend', consultas.filtro_no_recomendados())):
+        conteo = consultas.contar_filas([resenas.filter(filtro)], CLAVES_PARCIALES[nombre]).to_pandas()
+        conteo['title'] = conteo['title'].astype(str)
+        parciales[nombre] = conteo.rename(columns={'count': 'valor'}).assign(filas=lambda d: d['valor'])
+
+    sentimientos = datos.normalizar('sentiment_analysis', tabla).append_column('orden', tabla['orden']).to_pandas()
+    conteo = sentimientos.groupby(CLAVES_PARCIALES['sentiment_analysis']).agg(valor=('orden', 'size'), primera=('orden', 'min'))
+    parciales['sentiment_analysis'] = conteo.reset_index().assign(filas=lambda d: d['valor'])
+    return parciales
+
+
+def combinar_parciales(guardados, agregados, quitados):
+    '''
+    Suma a los parciales guardados los de los registros agregados y les resta los de los
+    registros quitados. Los grupos que se quedan sin filas se descartan.
+
+    Returns:
+    - dict: Los parciales actualizados.
+    '''
+    combinados = {}
+    for nombre, claves in CLAVES_PARCIALES.items():
+        restados = quitados[nombre].assign(valor=-quitados[nombre]['valor'], filas=-quitados[nombre]['filas'])
+        partes = [p for p in (guardados.get(nombre), agregados[nombre], restados) if p is not None and len(p)]
+        if not partes:
+            combinados[nombre] = agregados[nombre]
+            continue
+        funciones = {'valor': 'sum', 'filas': 'sum'}
+        if 'primera' in agregados[nombre]:
+            funciones['primera'] = 'min'
+        total = pd.concat(partes, ignore_index=True).groupby(claves).agg(funciones).reset_index()
+        combinados[nombre] = total[total['filas'] > 0].reset_index(drop=True)
+    return combinados
+
+
+# tabla: (columna de la clave de la respuesta, paso final a partir de los grupos de esa clave)
+FINALES = {
+    'PlayTimeGenre': ('genero', lambda g: consultas.final_play_time_genre(g.set_index('release_date')['valor'].sort_index())),
+    'UserForGenre': ('genero', lambda g: consultas.final_user_for_genre(g.set_index(['user_id', 'Año'])['valor'])),
+    'UsersRecommend': ('reviews_posted', lambda g: consultas.final_top_3(g.set_index('title')['valor'])),
+    'UsersNotRecommend': ('reviews_posted', lambda g: consultas.final_top_3(g.set_index('title')['valor'])),
+    'sentiment_analysis': ('release_date', lambda g: consultas.final_sentiment_analysis(
+        g.sort_values('primera', kind='stable').set_index('sentiment_analysis')['valor'])),
+}
+
+
+def actualizar_tablas(tablas, parciales, afectados):
+    '''
+    Recalcula las respuestas de los géneros y años afectados a partir de los parciales.
+
+    Parameters:
+    - tablas (dict): Tablas de agregados a actualizar (se modifican).
+    - parciales (dict): Parciales completos, ya combinados.
+    - afectados (dict): {tabla: claves afectadas (géneros o años)}
+
+    Returns:
+    - int: Cantidad de respuestas recalculadas.
+    '''
+    recalculadas = 0
+    for nombre, (columna, final) in FINALES.items():
+        tabla = tablas.setdefault(nombre, {})
+        parcial = parciales[nombre]
+        grupos = dict(tuple(parcial[parcial[columna].isin(afectados[nombre])].groupby(columna)))
+        for clave in afectados[nombre]:
+            texto = str(clave) if columna == 'genero' else str(int(clave))
+            if clave in grupos:
+                tabla[texto] = final(grupos[clave])
+                recalculadas += 1
+            else:
+                tabla.pop(texto, None)
+        tablas[nombre] = dict(sorted(tabla.items(), key=lambda item: item[0] if columna == 'genero' else int(item[0])))
+    return recalculadas
+
+
+def actualizar_agregados(agregadas, quitadas, desde_cero):
+    '''
+    Actualiza los parciales guardados y las respuestas afectadas del archivo de agregados.
+
+    Returns:
+    - int: Cantidad de respuestas recalculadas.
+    '''
+    directorio = _ruta('parciales')
+    guardados, tablas = {}, {}
+    if not desde_cero:
+        for nombre in CLAVES_PARCIALES:
+            ruta = os.path.join(directorio, f'{nombre}.parquet')
+            if os.path.exists(ruta):
+                guardados[nombre] = pd.read_parquet(ruta)
+        if os.path.exists(configuracion.ruta_agregados):
+            with gzip.open(configuracion.ruta_agregados, 'rt', encoding='utf-8') as f:
+                tablas = json.load(f)["tablas"]
+
+    nuevos, viejos = calcular_parciales(agregadas), calcular_parciales(quitadas)
+    parciales = combinar_parciales(guardados, nuevos, viejos)
+    afectados = {nombre: sorted(set(nuevos[nombre][columna]) | set(viejos[nombre][columna]))
+                 for nombre, (columna, _) in FINALES.items()}
+    recalculadas = actualizar_tablas(tablas, parciales, afectados)
+
+    os.makedirs(directorio, exist_ok=True)
+    for nombre, parcial in parciales.items():
+        parcial.to_parquet(os.path.join(directorio, f'{nombre}.parquet'), index=False)
+    guardar_agregados(tablas)
+    return recalculadas
+
+
+def actualizar_modelo(agregadas, quitadas, desde_cero):
+    '''
+    Actualiza el modelo de recomendación guardado con los registros agregados y quitados,
+    o lo entrena sobre el dataset completo si todavía no existe.
+    '''
+    modelo = None if desde_cero else ModeloRecomendacion.cargar(verificar=False)
+    if modelo is None:
+        almacen = datos.AlmacenDatos('exacto')
+        almacen.cargar(['RecomendacionJuego'])
+        modelo = ModeloRecomendacion.entrenar(almacen.obtener('RecomendacionJuego'))
+    else:
+        def filas(tabla):
+            return datos.normalizar('RecomendacionJuego', tabla.to_pandas()) if tabla.num_rows else None
+        modelo = modelo.actualizar(filas(agregadas), filas(quitadas))
+    modelo.guardar()
+    return modelo
+
+
+def actualizar(ruta_entrada, modelo=True):
+    '''
+    Procesa los registros nuevos o modificados de una entrada.
+
+    Parameters:
+    - ruta_entrada (str): Parquet con los registros combinados.
+    - modelo (bool): Si es False no se actualiza el modelo de recomendación.
+
+    Returns:
+    - dict: Registros leídos, nuevos, modificados, lote escrito, respuestas recalculadas y segundos.
+    '''
+    if (configuracion.origen_datos != 'incremental' or configuracion.modo_consulta != 'exacto'
+            or configuracion.formato_datos != 'parquet'):
+        raise RuntimeError("La actualización incremental requiere ORIGEN_DATOS=incremental, MODO_CONSULTA=exacto "
+                           "y el formato de datos 'parquet'")
+    inicio = time.perf_counter()
+    desde_cero = not os.path.exists(_ruta('estado.parquet'))
+
+    entrada = leer_entrada(ruta_entrada)
+    estado = leer_estado()
+    procesar, anteriores = detectar_cambios(entrada, estado)
+    resumen = {"registros": len(entrada), "nuevos": int(procesar.sum()) - len(anteriores),
+               "modificados": len(anteriores), "lote": None, "respuestas_recalculadas": 0}
+    if not procesar.any():
+        resumen["segundos"] = round(time.perf_counter() - inicio, 2)
+        return resumen
+
+    quitadas, estado = quitar_registros(anteriores, estado)
+    numero = ultimo_lote() + 1
+    nuevos = entrada[procesar].reset_index(drop=True)
+    tabla = pa.Table.from_pandas(nuevos[ESQUEMA.names], schema=ESQUEMA, preserve_index=False)
+    escribir_lote(tabla, numero)
+    orden = (np.int64(numero) << 32) + np.arange(tabla.num_rows, dtype=np.int64)
+    agregadas = tabla.append_column('orden', pa.array(orden))
+    ubicacion = nuevos[CLAVE + ['hash']].assign(lote=np.int32(numero), fila=np.arange(len(nuevos), dtype=np.int64))
+    estado = pd.concat([estado, ubicacion], ignore_index=True)
+
+    resumen["lote"] = numero
+    resumen["respuestas_recalculadas"] = actualizar_agregados(agregadas, quitadas, desde_cero)
+    if modelo:
+        actualizar_modelo(agregadas, quitadas, desde_cero)
+    estado.to_parquet(_ruta('estado.parquet'), index=False)
+    resumen["segundos"] = round(time.perf_counter() - inicio, 2)
+    return resumen
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Agrega los registros nuevos o modificados a los datasets y artefactos")
+    parser.add_argument('entrada', help="Parquet con los registros combinados de usuario y juego")
+    parser.add_argument('--sin-modelo', action='store_true', help="No actualiza el modelo de recomendación")
+    args = parser.parse_args()
+
+    resumen = actualizar(args.entrada, modelo=not args.sin_modelo)
+    if resumen["lote"] is None:
+        logger.info("%s: %d registros, ninguno nuevo o modificado", args.entrada, resumen["registros"])
+    else:
+        logger.info("%s: %d registros, %d nuevos y %d modificados en el lote %d; %d respuestas recalculadas (%.1f s)",
+                    args.entrada, resumen["registros"], resumen["nuevos"], resumen["modificados"], resumen["lote"],
+                    resumen["respuestas_recalculadas"], resumen["segundos"])
@@ -0,0 +1,137 @@
+'''
+Índice invertido de géneros.
+
+La columna 'genres' guarda listas como texto ("['Action', 'Indie']"). El índice las
+interpreta una sola vez por valor distinto y guarda, para cada género, las posiciones
+de las filas que lo contienen (ordenadas) y un bitmap empaquetado para combinar
+varios géneros.
+'''
+
+import ast
+
+import numpy as np
+
+
+OPERADORES = ('y', 'o')
+
+
+def interpretar_generos(valor):
+    '''
+    Convierte el texto de la columna 'genres' en la lista de géneros.
+
+    Parameters:
+    - valor (str): Texto con la lista de géneros.
+
+    Returns:
+    - list: Géneros del valor, lista vacía si no es una lista válida.
+    '''
+    try:
+        lista = ast.literal_eval(valor)
+    except (ValueError, SyntaxError, TypeError):
+        return []
+    if isinstance(lista, (list, tuple)):
+        return [str(g) for g in lista]
+    return []
+
+
+def dividir_generos(texto):
+    '''
+    Separa una consulta de varios géneros escrita como "Action,Indie".
+
+    Parameters:
+    - texto (str): Géneros separados por coma.
+
+    Returns:
+    - list: Géneros sin espacios sobrantes.
+    '''
+    return [g.strip() for g in texto.split(',') if g.strip()]
+
+
+class IndiceGeneros:
+    '''
+    Posiciones de fila y bitmaps por género de una columna categórica 'genres'.
+    '''
+
+    def __init__(self, columna):
+        '''
+        Parameters:
+        - columna (pd.Series): Columna categórica con las listas de géneros como texto.
+        '''
+        self.num_filas = len(columna)
+        codigos = columna.cat.codes.to_numpy()
+
+        # Con las filas ordenadas por código, cada categoría es un tramo contiguo
+        orden = np.argsort(codigos, kind='stable').astype(np.int32)
+        limites = np.searchsorted(codigos[orden], np.arange(len(columna.cat.categories) + 1))
+
+        tramos = {}
+        for codigo, valor in enumerate(columna.cat.categories):
+            # Las categorías sin filas (por ejemplo, las de una dimensión compartida) se omiten
+            if limites[codigo] == limites[codigo + 1]:
+                continue
+            for genero in interpretar_generos(valor):
+                tramos.setdefault(genero, []).append(orden[limites[codigo]:limites[codigo + 1]])
+
+        self.posiciones = {}
+        self.bitmaps = {}
+        for genero, partes in tramos.items():
+            posiciones = np.sort(np.concatenate(partes))
+            self.posiciones[genero] = posiciones
+            mascara = np.zeros(self.num_filas, dtype=bool)
+            mascara[posiciones] = True
+            self.bitmaps[genero] = np.packbits(mascara)
+
+    @classmethod
+    def desde_arreglos(cls, num_filas, generos, offsets, posiciones, bitmaps):
+        '''
+        Arma el índice a partir de arreglos ya calculados (por ejemplo, mapeados en memoria
+        con mapeo.py), sin recorrer la columna.
+
+        Parameters:
+        - num_filas (int): Filas del dataset.
+        - generos (list): Géneros, en el orden de los arreglos.
+        - offsets (np.ndarray): Inicio de las posiciones de cada género (len(generos) + 1 valores).
+        - posiciones (np.ndarray): Posiciones de todos los géneros, concatenadas.
+        - bitmaps (np.ndarray): Un bitmap empaquetado por género (una fila por género).
+        '''
+        indice = cls.__new__(cls)
+        indice.num_filas = num_filas
+        indice.posiciones = {g: posiciones[offsets[i]:offsets[i + 1]] for i, g in enumerate(generos)}
+        indice.bitmaps = {g: bitmaps[i] for i, g in enumerate(generos)}
+        return indice
+
+    @property
+    def generos(self):
+        return sorted(self.posiciones)
+
+    def filas(self, generos, operador='y'):
+        '''
+        Devuelve las posiciones de las filas que cumplen la consulta de géneros.
+
+        Parameters:
+        - generos (str or list): Un género o una lista de géneros.
+        - operador (str): 'y' para filas con todos los géneros, 'o' para filas con alguno.
+
+        Returns:
+        - np.ndarray: Posiciones ordenadas de las filas.
+        '''
+        if isinstance(generos, str):
+            generos = [generos]
+        if operador not in OPERADORES:
+            raise ValueError(f"Operador inválido: {operador}. Usar 'y' u 'o'")
+
+        vacio = np.empty(0, dtype=np.int32)
+        if len(generos) == 1:
+            return self.posiciones.get(generos[0], vacio)
+
+        bitmaps = [self.bitmaps.get(g) for g in generos]
+        if operador == 'y':
+            if any(b is None for b in bitmaps):
+                return vacio
+            resultado = np.bitwise_and.reduce(bitmaps)
+        else:
+            bitmaps = [b for b in bitmaps if b is not None]
+            if not bitmaps:
+                return vacio
+            resultado = np.bitwise_or.reduce(bitmaps)
+        return np.flatnonzero(np.unpackbits(resultado, count=self.num_filas)).astype(np.int32)
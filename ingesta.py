@@ -0,0 +1,464 @@
+'''
+Ingesta de reseñas en vivo para los rankings de UsersRecommend y UsersNotRecommend.
+
+POST /ingesta/resenas recibe lotes de reseñas nuevas (título, año de publicación,
+recomendación y texto). Cada reseña se etiqueta con el mismo análisis de sentimiento que
+el ETL (Jupyter/sentimiento.py) y se clasifica con el mismo criterio que
+consultas.filtro_recomendados: recomendada si recomienda el juego con sentimiento neutro o
+positivo, no recomendada si no lo recomienda con sentimiento negativo.
+
+Por cada tipo de ranking y año se lleva un resumen Space-Saving de tamaño fijo
+(configuracion.capacidad_resenas_en_vivo títulos), así que la memoria no crece con la
+cantidad de títulos distintos. El resumen cuenta exacto mientras tiene lugar; cuando se
+llena, un título nuevo reemplaza al de menor cuenta y hereda esa cuenta como error, de
+modo que la cuenta de un título nunca es menor que la real y los títulos frecuentes no se
+pierden. El top 3 se responde sumando estas cuentas a los conteos exactos del cubo de la
+instantánea vigente (ver cubo.py), sin volver a recorrer los datasets. Sin el cubo
+(CUBO_AGREGADOS=0) se suman a los conteos por título que calcula consultas.py.
+
+Las reseñas ingeridas se guardan en memoria y se compactan periódicamente en archivos
+Parquet de configuracion.directorio_ingesta, con el esquema de df_UsersRecommend; al
+arrancar se vuelven a leer para reconstruir los resúmenes. Cuando se acumulan muchos
+archivos se unen en uno: el nombre de cada archivo lleva el intervalo de compactaciones
+que contiene, y los archivos contenidos en el intervalo de otro (un resto de una unión
+interrumpida) se ignoran. Las reseñas de la última compactación todavía no escritas se
+pierden si el proceso termina sin apagarse.
+
+Con varios workers de uvicorn cada uno recibe solo algunos de los POST, y todos comparten
+el directorio de ingesta. Cada worker vuelve a armar sus resúmenes cuando cambian los
+archivos compactados (en su hilo de compactación, cada COMPACTACION_SEGUNDOS): los archivos
+más sus propias reseñas todavía no compactadas. Así, una reseña llega a los rankings de los
+demás workers a lo sumo dos intervalos después de ingerida. La generación, que forma parte
+de la clave del cache y del ETag, se calcula con los archivos leídos, así que los workers
+sin reseñas pendientes responden lo mismo con el mismo ETag. La unión de archivos se hace
+con un lock de archivo, para que dos workers no unan los mismos archivos a la vez.
+
+Cuando el ETL incorpora estos archivos a df_UsersRecommend hay que sacarlos del directorio
+de ingesta, o las reseñas se contarían dos veces.
+'''
+
+import fcntl
+import glob
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from contextlib import suppress
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import configuracion
+from cubo import TIPOS_RESENA
+from instrumentacion import tramo
+
+logger = logging.getLogger(__name__)
+
+ESQUEMA = pa.schema([
+    ('item_id', pa.int32()),
+    ('title', pa.string()),
+    ('reviews_posted', pa.int64()),
+    ('reviews_recommend', pa.bool_()),
+    ('sentiment_analysis', pa.int64()),
+])
+
+PATRON_ARCHIVO = re.compile(r'resenas_(\d+)_(\d+)\.parquet$')
+
+
+def clasificar(recomienda, sentimiento):
+    '''
+    Tipo de ranking de una reseña, con el criterio de consultas.filtro_recomendados.
+
+    Returns:
+    - str or None: 'UsersRecommend', 'UsersNotRecommend' o None si no cuenta en ninguno.
+    '''
+    if recomienda and sentimiento >= 1:
+        return 'UsersRecommend'
+    if not recomienda and sentimiento == 0:
+        return 'UsersNotRecommend'
+    return None
+
+
+class ResumenFrecuentes:
+    '''
+    Resumen Space-Saving con pesos: cuentas aproximadas de los elementos más frecuentes
+    de un flujo, con a lo sumo `capacidad` elementos guardados.
+    '''
+
+    def __init__(self, capacidad):
+        self.capacidad = capacidad
+        # elemento: [cuenta, error]; la cuenta real está entre cuenta - error y cuenta
+        self.conteos = {}
+        # (cuenta, elemento) de cada elemento guardado; las entradas con una cuenta vieja
+        # se descartan al sacarlas
+        self._monticulo = []
+        self.total = 0
+
+    def sumar(self, elemento, cantidad=1):
+        self.total += cantidad
+        conteo = self.conteos.get(elemento)
+        if conteo is None:
+            if len(self.conteos) < self.capacidad:
+                conteo = self.conteos[elemento] = [0, 0]
+            else:
+                minimo, piso = self._sacar_minimo()
+                del self.conteos[minimo]
+                conteo = self.conteos[elemento] = [piso, piso]
+        conteo[0] += cantidad
+        heapq.heappush(self._monticulo, (conteo[0], elemento))
+        if len(self._monticulo) > 4 * self.capacidad:
+            self._monticulo = [(c, e) for e, (c, _) in self.conteos.items()]
+            heapq.heapify(self._monticulo)
+
+    def _sacar_minimo(self):
+        while True:
+            cuenta, elemento = heapq.heappop(self._monticulo)
+            conteo = self.conteos.get(elemento)
+            if conteo is not None and conteo[0] == cuenta:
+                return elemento, cuenta
+
+    def mas_frecuentes(self, n=None):
+        '''
+        Returns:
+        - list: (elemento, cuenta, error) de mayor a menor cuenta, con los empates por elemento.
+        '''
+        ordenados = sorted(self.conteos.items(), key=lambda par: (-par[1][0], par[0]))
+        return [(elemento, cuenta, error) for elemento, (cuenta, error) in ordenados[:n]]
+
+
+class ResenasEnVivo:
+    '''
+    Resúmenes por tipo de ranking y año de las reseñas ingeridas, con su compactación a Parquet.
+    '''
+
+    def __init__(self, directorio=None, capacidad=None):
+        '''
+        Parameters:
+        - directorio (str): Directorio de los archivos compactados, por defecto configuracion.directorio_ingesta.
+        - capacidad (int): Títulos por resumen, por defecto configuracion.capacidad_resenas_en_vivo.
+        '''
+        self.directorio = directorio or configuracion.directorio_ingesta
+        self.capacidad = capacidad or configuracion.capacidad_resenas_en_vivo
+        self._lock = threading.Lock()
+        # Serializa las compactaciones (del vigilante, de una ingesta grande y del apagado)
+        self._compactando = threading.Lock()
+        self._detener = threading.Event()
+        # {endpoint: {anio: ResumenFrecuentes}}
+        self._resumenes = {endpoint: {} for endpoint in TIPOS_RESENA}
+        self._pendientes = []
+        self._filas_pendientes = 0
+        # Archivos compactados contados en los resúmenes y su huella
+        self._leidos = ()
+        self._huella = ''
+        # Lotes ingeridos por este proceso, con el que se distinguen sus reseñas sin compactar
+        self._lotes = 0
+        self._proceso = f"{os.getpid()}.{id(self):x}"
+        self.ingeridas = 0
+        self.descartadas = 0
+        self.compactaciones = 0
+        self.errores_compactacion = 0
+
+    @property
+    def generacion(self):
+        '''
+        Versión de las reseñas contadas; forma parte de la clave del cache de respuestas.
+        Vacía sin reseñas ingeridas. Depende solo de los archivos compactados leídos,
+        salvo que este proceso tenga reseñas sin compactar.
+        '''
+        if self._pendientes:
+            return f"{self._huella}+{self._proceso}.{self._lotes}"
+        return self._huella
+
+    def cargar(self):
+        '''
+        Arma los resúmenes con los archivos compactados del directorio de ingesta.
+        '''
+        self.sincronizar()
+        if self._leidos:
+            logger.info("Ingesta: %d reseñas en vivo cargadas de %d archivos", self.ingeridas, len(self._leidos))
+
+    def sincronizar(self):
+        '''
+        Vuelve a armar los resúmenes si cambiaron los archivos compactados (por ejemplo,
+        porque otro worker compactó sus reseñas): los archivos más las reseñas de este
+        proceso todavía no compactadas.
+
+        Returns:
+        - bool: True si se volvieron a armar.
+        '''
+        with self._compactando:
+            return self._releer()
+
+    def _releer(self):
+        # Se llama con self._compactando tomado: las reseñas pendientes no pasan a un archivo mientras tanto
+        rutas = tuple(ruta for _, _, ruta in self._archivos())
+        if rutas == self._leidos:
+            return False
+        try:
+            with tramo('ingesta_carga'):
+                tablas = [pq.read_table(ruta, columns=['title', 'reviews_posted', 'reviews_recommend', 'sentiment_analysis'])
+                          for ruta in rutas]
+        except OSError:
+            # Otro worker unió los archivos mientras se leían: se reintenta en la próxima vuelta
+            logger.warning("Ingesta: no se pudieron leer los archivos compactados; se reintenta más tarde")
+            return False
+        resumenes = {endpoint: {} for endpoint in TIPOS_RESENA}
+        totales = Counter()
+        for tabla in tablas:
+            self._sumar(tabla, resumenes, totales)
+        with self._lock:
+            for tabla in self._pendientes:
+                self._sumar(tabla, resumenes, totales)
+            self._resumenes = resumenes
+            self.ingeridas, self.descartadas = totales['ingeridas'], totales['descartadas']
+            self._leidos = rutas
+            self._huella = f"{zlib.crc32(' '.join(os.path.basename(ruta) for ruta in rutas).encode()):08x}" if rutas else ''
+        return True
+
+    def ingerir(self, resenas):
+        '''
+        Etiqueta el sentimiento de un lote de reseñas y las suma a los resúmenes.
+
+        Parameters:
+        - resenas (list): dicts con title, reviews_posted, reviews_recommend y, opcionales,
+          reviews_review e item_id.
+
+        Returns:
+        - dict: Reseñas recibidas, contadas en cada ranking y por sentimiento, y generación.
+        '''
+        # Jupyter/sentimiento.py importa TextBlob: se importa con la primera ingesta para no
+        # sumarlo al arranque de la API
+        from Jupyter.sentimiento import analisis_de_sentimiento_lote
+
+        with tramo('ingesta_sentimiento'):
+            # Un solo proceso: los lotes de la API son chicos y corren en el pool de ingesta
+            sentimientos = analisis_de_sentimiento_lote([r.get('reviews_review') for r in resenas], procesos=1)
+        tabla = pa.table({
+            'item_id': [r.get('item_id') for r in resenas],
+            'title': [r['title'] for r in resenas],
+            'reviews_posted': [r['reviews_posted'] for r in resenas],
+            'reviews_recommend': [r['reviews_recommend'] for r in resenas],
+            'sentiment_analysis': sentimientos,
+        }, schema=ESQUEMA)
+
+        with tramo('ingesta_resumenes'), self._lock:
+            totales = Counter()
+            contadas = self._sumar(tabla, self._resumenes, totales)
+            self.ingeridas += totales['ingeridas']
+            self.descartadas += totales['descartadas']
+            self._pendientes.append(tabla)
+            self._filas_pendientes += tabla.num_rows
+            self._lotes += 1
+            generacion = self.generacion
+            compactar = self._filas_pendientes >= configuracion.max_pendientes_ingesta
+        if compactar:
+            self.compactar()
+        return {
+            "recibidas": len(resenas),
+            **{endpoint: contadas[endpoint] for endpoint in TIPOS_RESENA},
+            "sentimientos": {nombre: sentimientos.count(codigo) for codigo, nombre in enumerate(["Negative", "Neutral", "Positive"])},
+            "generacion": generacion,
+        }
+
+    def _sumar(self, tabla, resumenes, totales):
+        # Con self._resumenes se llama con el lock tomado
+        pares = Counter()
+        for titulo, anio, recomienda, sentimiento in zip(*(tabla[c].to_pylist() for c in
+                                                           ['title', 'reviews_posted', 'reviews_recommend', 'sentiment_analysis'])):
+            endpoint = None if titulo is None or anio is None else clasificar(recomienda, sentimiento)
+            if endpoint is not None:
+                pares[endpoint, anio, titulo] += 1
+        contadas = Counter()
+        for (endpoint, anio, titulo), cantidad in pares.items():
+            resumen = resumenes[endpoint].get(anio)
+            if resumen is None:
+                resumen = resumenes[endpoint][anio] = ResumenFrecuentes(self.capacidad)
+            resumen.sumar(titulo, cantidad)
+            contadas[endpoint] += cantidad
+        totales['ingeridas'] += tabla.num_rows
+        totales['descartadas'] += tabla.num_rows - sum(contadas.values())
+        return contadas
+
+    def conteos(self, endpoint, desde=None, hasta=None):
+        '''
+        Cuentas de las reseñas ingeridas de un ranking entre dos años, incluidos.
+
+        Returns:
+        - dict: {título: cuenta}, vacío si no hay reseñas ingeridas en el intervalo.
+        '''
+        totales = Counter()
+        with self._lock:
+            for anio, resumen in self._resumenes[endpoint].items():
+                if (desde is None or anio >= desde) and (hasta is None or anio <= hasta):
+                    for titulo, (cuenta, _) in resumen.conteos.items():
+                        totales[titulo] += cuenta
+        return totales
+
+    def top(self, cubo, endpoint, desde=None, hasta=None, n=3, ranking=None):
+        '''
+        Top n de un ranking entre dos años sumando las reseñas ingeridas a los conteos del
+        cubo o, si el cubo no tiene el ranking, a los de `ranking`.
+
+        Con el cubo, los candidatos son los títulos ingeridos y el top n del cubo: un título
+        que no está en ninguno de los dos tiene a lo sumo la cuenta del n-ésimo del cubo.
+
+        Parameters:
+        - ranking (pa.Table): Cantidad de reseñas de cada título del intervalo en la
+          instantánea, en el orden de consultas.final_top_3 (consultas.tabla_users_recommend
+          o tabla_users_not_recommend). Solo se usa si el cubo no tiene el ranking.
+
+        Returns:
+        - dict or None: {"Puesto 1": str, ...}; None si no hay reseñas ingeridas en el
+          intervalo, o si no hay conteos de la instantánea con los que sumarlas, y se
+          responde solo con la instantánea.
+        '''
+        vivos = self.conteos(endpoint, desde, hasta)
+        if not vivos:
+            return None
+        if endpoint in cubo.disponibles():
+            base = dict(cubo.mas_resenas(endpoint, desde, hasta, n))
+            faltantes = [titulo for titulo in vivos if titulo not in base]
+            base.update(zip(faltantes, cubo.resenas_titulos(endpoint, faltantes, desde, hasta)))
+        elif ranking is not None:
+            base = dict(zip(ranking['title'].to_pylist(), ranking['count'].to_pylist()))
+            faltantes = [titulo for titulo in vivos if titulo not in base]
+        else:
+            # Contar solo las reseñas ingeridas reemplazaría el ranking de la instantánea
+            return None
+        # Los títulos del cubo primero y en su orden, así los empates quedan como en la
+        # instantánea; el orden es estable
+        totales = {titulo: base.get(titulo, 0) + vivos.get(titulo, 0) for titulo in [*base, *sorted(faltantes)]}
+        elegidos = sorted(totales, key=lambda titulo: -totales[titulo])[:n]
+        return {f"Puesto {i+1}": titulo for i, titulo in enumerate(elegidos)}
+
+    def _archivos(self):
+        '''
+        Returns:
+        - list: (desde, hasta, ruta) de los archivos compactados, sin los contenidos en el
+          intervalo de otro archivo.
+        '''
+        archivos = []
+        for ruta in glob.glob(os.path.join(self.directorio, 'resenas_*.parquet')):
+            coincidencia = PATRON_ARCHIVO.search(os.path.basename(ruta))
+            if coincidencia:
+                archivos.append((int(coincidencia.group(1)), int(coincidencia.group(2)), ruta))
+        archivos.sort(key=lambda archivo: (archivo[0], -archivo[1]))
+        vigentes = []
+        for desde, hasta, ruta in archivos:
+            if vigentes and hasta <= vigentes[-1][1]:
+                continue
+            vigentes.append((desde, hasta, ruta))
+        return vigentes
+
+    def _escribir(self, tabla, desde, hasta):
+        # Se escribe con otro nombre y se renombra, para no leer nunca un archivo a medio escribir
+        ruta = os.path.join(self.directorio, f'resenas_{desde:020d}_{hasta:020d}.parquet')
+        pq.write_table(tabla, ruta + '.tmp', compression='zstd')
+        os.replace(ruta + '.tmp', ruta)
+        return ruta
+
+    def compactar(self):
+        '''
+        Escribe las reseñas pendientes en un archivo Parquet y, si el directorio supera
+        configuracion.max_archivos_ingesta archivos, los une en uno. Después vuelve a armar
+        los resúmenes con los archivos, que incluyen los de los demás workers.
+
+        Returns:
+        - int: Reseñas escritas.
+        '''
+        with self._compactando:
+            with self._lock:
+                pendientes, self._pendientes = self._pendientes, []
+                self._filas_pendientes = 0
+            if not pendientes:
+                return 0
+            tabla = pa.concat_tables(pendientes)
+            try:
+                with tramo('ingesta_compactacion'):
+                    os.makedirs(self.directorio, exist_ok=True)
+                    marca = time.time_ns()
+                    self._escribir(tabla, marca, marca)
+            except OSError:
+                logger.exception("Ingesta: no se pudieron escribir %d reseñas; se reintenta en la próxima compactación", tabla.num_rows)
+                with self._lock:
+                    self._pendientes.insert(0, tabla)
+                    self._filas_pendientes += tabla.num_rows
+                    self.errores_compactacion += 1
+                return 0
+            self.compactaciones += 1
+            if len(self._archivos()) > configuracion.max_archivos_ingesta:
+                try:
+                    with tramo('ingesta_compactacion'):
+                        self._unir()
+                except OSError:
+                    # Las reseñas ya están escritas: la unión se reintenta en la próxima compactación
+                    logger.exception("Ingesta: no se pudieron unir los archivos compactados")
+            self._releer()
+            return tabla.num_rows
+
+    def _unir(self):
+        # El lock de archivo excluye a los demás workers; los archivos se listan con el lock tomado
+        with open(os.path.join(self.directorio, '.union.lock'), 'w') as cerrojo:
+            fcntl.flock(cerrojo, fcntl.LOCK_EX)
+            archivos = self._archivos()
+            if len(archivos) <= configuracion.max_archivos_ingesta:
+                return
+            tabla = pa.concat_tables([pq.read_table(ruta, schema=ESQUEMA) for _, _, ruta in archivos])
+            self._escribir(tabla, archivos[0][0], archivos[-1][1])
+            # Si el proceso termina antes de borrarlos, quedan contenidos en el archivo unido y se ignoran
+            for _, _, ruta in archivos:
+                with suppress(FileNotFoundError):
+                    os.remove(ruta)
+
+    def vigilar(self, intervalo=None):
+        '''
+        Inicia el hilo que compacta las reseñas pendientes cada `intervalo` segundos y
+        suma las que compactaron los demás workers.
+
+        Parameters:
+        - intervalo (float): Por defecto configuracion.compactacion_segundos.
+        '''
+        intervalo = intervalo or configuracion.compactacion_segundos
+        threading.Thread(target=self._vigilar, args=(intervalo,), name="compactacion", daemon=True).start()
+
+    def _vigilar(self, intervalo):
+        while not self._detener.wait(intervalo):
+            if not self.compactar():
+                self.sincronizar()
+
+    def detener(self):
+        '''
+        Detiene el hilo de compactación y escribe las reseñas pendientes.
+        '''
+        self._detener.set()
+        self.compactar()
+
+    def estado(self):
+        '''
+        Returns:
+        - dict: Reseñas ingeridas, descartadas (no cuentan en ningún ranking) y pendientes
+          de compactar, generación, compactaciones, archivos y, por ranking, años y títulos
+          seguidos.
+        '''
+        with self._lock:
+            resumenes = {endpoint: {"anios": len(por_anio), "titulos": sum(len(r.conteos) for r in por_anio.values()),
+                                    "resenas": sum(r.total for r in por_anio.values())}
+                         for endpoint, por_anio in self._resumenes.items()}
+            estado = {
+                "ingeridas": self.ingeridas,
+                "descartadas": self.descartadas,
+                "pendientes": self._filas_pendientes,
+                "generacion": self.generacion,
+            }
+        return {
+            **estado,
+            "compactaciones": self.compactaciones,
+            "errores_compactacion": self.errores_compactacion,
+            "archivos": len(self._archivos()),
+            "capacidad": self.capacidad,
+            "rankings": resumenes,
+        }
@@ -0,0 +1,350 @@
+'''
+Instantáneas de los datos servidos y recarga sin cortar el servicio.
+
+Una instantánea reúne todo lo que consultan los endpoints (el almacén de datasets, las
+respuestas precalculadas y los dos modelos de recomendación) cargado junto desde un
+directorio de artefactos: un directorio con la misma estructura que el del proyecto
+(Jupyter/df_*.parquet, Artefactos/...), contra el que se resuelven las rutas de
+configuracion. Cada instantánea publicada tiene un número correlativo y una versión, el
+hash de la huella de sus archivos, que es también la versión de las claves del cache de
+respuestas.
+
+Con configuracion.directorio_instantaneas, cada subdirectorio es una versión de los
+artefactos y se sirve la última en orden de nombre (por ejemplo 2024-06-01_1200). Una
+versión se copia con un nombre que empieza con punto y se renombra al terminar, para que
+nunca se lea a medio copiar. Sin ese directorio se sirven los archivos del directorio
+actual.
+
+La instantánea vigente se reemplaza sin detener la API:
+
+- POST /admin/recargar, o el vigilante (cada configuracion.vigilancia_segundos revisa si
+  apareció una versión nueva o si cambió la huella de los archivos servidos), carga la
+  nueva instantánea en un hilo aparte mientras la vigente sigue atendiendo. Una recarga
+  pedida con una versión la fija (por ejemplo para volver atrás): el vigilante no pasa a
+  versiones nuevas hasta una recarga sin versión;
+- antes de publicarla se valida (ver main._validar): si falla, se registra el error y la
+  vigente sigue en servicio;
+- se publica con una sola asignación. Cada consulta toma la instantánea vigente al
+  empezar y la usa hasta terminar, así que las consultas en curso terminan con la
+  anterior y ninguna mezcla datos de dos versiones;
+- la anterior se libera cuando termina la última consulta que la usa. El gestor la sigue
+  con una referencia débil: /admin/instantanea informa las retiradas que siguen en
+  memoria y el log registra cuándo se liberan.
+
+Mientras se carga la nueva conviven las dos en memoria, así que el contenedor tiene que
+tener lugar para ambas. Los archivos de una versión retirada no se deben borrar hasta que
+se libere: en modo 'exacto' sus consultas en curso los siguen leyendo.
+'''
+
+import gc
+import logging
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import configuracion
+from cache_respuestas import version_datos
+
+
+logger = logging.getLogger(__name__)
+
+# Segundos entre los intentos de recolectar una instantánea retirada que sigue en memoria
+# (por ciclos de referencias) sin consultas que la usen
+ESPERAS_LIBERACION = (1, 2, 4, 8, 16, 32)
+
+
+def rutas_artefactos():
+    '''
+    Archivos cuya huella identifica una versión de los artefactos: los datasets y el
+    último archivo que escribe cada construcción offline (agregados, modelos y mmap).
+    '''
+    return [
+        *configuracion.rutas_datasets,
+        configuracion.ruta_agregados,
+        os.path.join(configuracion.directorio_modelo, 'fuentes.json'),
+        os.path.join(configuracion.directorio_modelo_usuarios, 'fuentes.json'),
+        os.path.join(configuracion.directorio_mmap, configuracion.modo_consulta, 'datasets.json'),
+    ]
+
+
+def versiones(directorio=None):
+    '''
+    Versiones publicadas en el directorio de instantáneas.
+
+    Parameters:
+    - directorio (str): Por defecto configuracion.directorio_instantaneas.
+
+    Returns:
+    - list: Nombres de los subdirectorios en orden, sin los que empiezan con punto
+      (copias en curso). Vacía si el directorio no está configurado o no existe.
+    '''
+    directorio = directorio or configuracion.directorio_instantaneas
+    if not directorio or not os.path.isdir(directorio):
+        return []
+    return sorted(nombre for nombre in os.listdir(directorio)
+                  if not nombre.startswith('.') and os.path.isdir(os.path.join(directorio, nombre)))
+
+
+def ultima_version():
+    '''
+    Returns:
+    - str or None: Ruta de la última versión del directorio de instantáneas, o None.
+    '''
+    nombres = versiones()
+    return os.path.join(configuracion.directorio_instantaneas, nombres[-1]) if nombres else None
+
+
+class Instantanea:
+    '''
+    Datasets, respuestas precalculadas, cubo de agregados por año (ver cubo.py) y modelos
+    cargados desde un directorio de artefactos. No se modifica una vez publicada.
+    '''
+
+    def __init__(self, raiz, almacen, agregados, cubo, modelo_recomendacion, modelo_usuarios):
+        self.raiz = raiz
+        self.almacen = almacen
+        self.agregados = agregados
+        self.cubo = cubo
+        self.modelo_recomendacion = modelo_recomendacion
+        self.modelo_usuarios = modelo_usuarios
+        # Los asigna el gestor
+        self.version = None
+        self.numero = None
+        self.publicada = None
+
+    def disponibles(self):
+        '''
+        Returns:
+        - set: Datasets que se pueden consultar y modelos cargados.
+        '''
+        disponibles = set(self.almacen.datasets) | self.almacen.en_disco
+        if self.modelo_recomendacion is not None:
+            disponibles.add('modelo_recomendacion')
+        if self.modelo_usuarios is not None:
+            disponibles.add('modelo_usuarios')
+        return disponibles
+
+    def buscar(self, endpoint, clave):
+        '''
+        Respuesta de una consulta de un género o de un año desde el cubo o, si el cubo no
+        la cubre, desde los agregados precalculados (ver Agregados.buscar).
+        '''
+        encontrado, respuesta = self.cubo.buscar(endpoint, clave)
+        return (encontrado, respuesta) if encontrado else self.agregados.buscar(endpoint, clave)
+
+    def resumen(self):
+        return {
+            "numero": self.numero,
+            "version": self.version,
+            "raiz": self.raiz or '.',
+            "publicada": None if self.publicada is None
+            else datetime.fromtimestamp(self.publicada, timezone.utc).isoformat(timespec='seconds'),
+            "disponibles": sorted(self.disponibles()),
+            "agregados": bool(self.agregados.tablas),
+            "cubo": self.cubo.resumen(),
+        }
+
+
+class GestorInstantaneas:
+    '''
+    Publica la instantánea vigente y carga las nuevas en segundo plano.
+
+    - construir(raiz, medir) carga una Instantanea desde un directorio de artefactos.
+    - validar(nueva, anterior, medir) la prueba antes de publicarla y lanza una excepción
+      si no sirve; en la carga inicial anterior es None.
+
+    medir(nombre) es el administrador de contexto con el que se mide cada etapa de la carga.
+    '''
+
+    def __init__(self, construir, validar):
+        self._construir = construir
+        self._validar = validar
+        # Se lee sin lock: publicar es una sola asignación
+        self.actual = None
+        self._lock = threading.Lock()
+        self._recargando = threading.Lock()
+        self._publicadas = 0
+        self._retiradas = {}
+        self._recarga = None
+        self.recargas = {"exito": 0, "error": 0}
+        self._intentada = None
+        self._fijada = None
+        self._detener = threading.Event()
+
+    def objetivo(self):
+        '''
+        Returns:
+        - str: Directorio a cargar por defecto: la versión fijada, la última versión del
+          directorio de instantáneas o el de la instantánea vigente.
+        '''
+        if self._fijada is not None:
+            return self._fijada
+        ultima = ultima_version()
+        if ultima is not None:
+            return ultima
+        return self.actual.raiz if self.actual is not None else ''
+
+    def cargar(self, raiz, medir):
+        '''
+        Carga, valida y publica una instantánea en el hilo actual. Si algo falla, la
+        instantánea vigente no cambia.
+
+        Parameters:
+        - raiz (str): Directorio de artefactos.
+        - medir (callable): Medición de las etapas de la carga.
+
+        Returns:
+        - Instantanea: La instantánea publicada.
+        '''
+        # La versión se calcula antes de leer: si los archivos cambian durante la carga, el
+        # vigilante ve una huella distinta de la publicada y vuelve a cargar
+        version = version_datos(rutas_artefactos(), raiz)
+        nueva = self._construir(raiz, medir)
+        nueva.version = version
+        self._validar(nueva, self.actual, medir)
+        return self._publicar(nueva)
+
+    def _publicar(self, nueva):
+        with self._lock:
+            self._publicadas += 1
+            nueva.numero = self._publicadas
+            nueva.publicada = time.time()
+            anterior = self.actual
+            self.actual = nueva
+        logger.info("Instantánea %d publicada (versión %s, %s)", nueva.numero, nueva.version, nueva.raiz or '.')
+        if anterior is not None:
+            numero = anterior.numero
+            # El callback corre al liberarse, en cualquier hilo: solo hace operaciones atómicas del diccionario
+            self._retiradas[numero] = weakref.ref(anterior, lambda _, numero=numero: self._liberada(numero))
+        return nueva
+
+    def _liberada(self, numero):
+        self._retiradas.pop(numero, None)
+        logger.info("Instantánea %d liberada", numero)
+
+    def retiradas(self):
+        '''
+        Returns:
+        - list: Números de las instantáneas reemplazadas que siguen en memoria.
+        '''
+        return sorted(numero for numero, referencia in list(self._retiradas.items()) if referencia() is not None)
+
+    def _medir_recarga(self, nombre):
+        @contextmanager
+        def medir():
+            with self._lock:
+                self._recarga["etapa"] = nombre
+            inicio = time.perf_counter()
+            yield
+            with self._lock:
+                self._recarga["etapas_segundos"][nombre] = round(time.perf_counter() - inicio, 3)
+                self._recarga["etapa"] = None
+        return medir()
+
+    def recargar(self, raiz=None):
+        '''
+        Lanza en un hilo aparte la carga de una instantánea nueva.
+
+        Parameters:
+        - raiz (str): Directorio de artefactos, que queda fijado; None deja de fijar y
+          carga objetivo().
+
+        Returns:
+        - bool: False si ya hay una recarga en curso.
+        '''
+        if not self._recargando.acquire(blocking=False):
+            return False
+        self._fijada = raiz
+        self._lanzar(self.objetivo())
+        return True
+
+    def _lanzar(self, raiz):
+        # Se llama con self._recargando tomado; lo suelta el hilo de la recarga
+        with self._lock:
+            self._recarga = {"raiz": raiz or '.', "en_curso": True, "etapa": None, "etapas_segundos": {},
+                             "error": None, "inicio": time.time(), "segundos": None, "numero": None}
+        threading.Thread(target=self._recargar, args=(raiz,), name="recarga", daemon=True).start()
+
+    def _recargar(self, raiz):
+        inicio = time.perf_counter()
+        try:
+            resultado, numero, error = "exito", self.cargar(raiz, self._medir_recarga).numero, None
+        except Exception as e:
+            logger.exception("Falló la recarga desde %s en la etapa %s; sigue la instantánea %s",
+                             raiz or '.', self._recarga["etapa"], getattr(self.actual, 'numero', None))
+            resultado, numero, error = "error", None, f"{type(e).__name__}: {e}"
+        with self._lock:
+            self._recarga.update(en_curso=False, numero=numero, error=error, segundos=round(time.perf_counter() - inicio, 3))
+            self.recargas[resultado] += 1
+        self._recargando.release()
+        if resultado == "exito":
+            self._esperar_liberacion()
+
+    def _esperar_liberacion(self):
+        # Sin ciclos de referencias, cada retirada se libera sola al terminar su última
+        # consulta. Si sigue en memoria se recolecta a intervalos crecientes: gc.collect()
+        # detiene al proceso unos milisegundos, así que no se llama en cada consulta
+        for espera in ESPERAS_LIBERACION:
+            if not self.retiradas() or self._detener.wait(espera):
+                return
+            gc.collect()
+        if self.retiradas():
+            logger.warning("Las instantáneas %s siguen en memoria: alguna consulta o referencia las retiene", self.retiradas())
+
+    def vigilar(self, intervalo=None):
+        '''
+        Inicia el hilo que recarga cuando aparece una versión nueva o cambian los archivos
+        servidos. Un cambio se carga cuando la huella se repite en dos revisiones seguidas,
+        para no leer archivos a medio escribir, y una versión que falló no se reintenta.
+
+        Parameters:
+        - intervalo (float): Segundos entre revisiones, por defecto configuracion.vigilancia_segundos.
+        '''
+        intervalo = intervalo or configuracion.vigilancia_segundos
+        threading.Thread(target=self._vigilar, args=(intervalo,), name="vigilancia", daemon=True).start()
+
+    def _vigilar(self, intervalo):
+        vista = None
+        while not self._detener.wait(intervalo):
+            actual = self.actual
+            try:
+                raiz = self.objetivo()
+                candidata = (raiz, version_datos(rutas_artefactos(), raiz))
+            except OSError:
+                # Un archivo se reemplazó mientras se revisaba: se vuelve a mirar en la próxima vuelta
+                continue
+            if actual is None or candidata == (actual.raiz, actual.version):
+                vista = None
+                continue
+            if candidata == vista and candidata != self._intentada and self._recargando.acquire(blocking=False):
+                logger.info("Cambiaron los artefactos de %s: se carga una instantánea nueva", raiz or '.')
+                self._intentada = candidata
+                self._lanzar(raiz)
+            vista = candidata
+
+    def detener(self):
+        self._detener.set()
+
+    def estado(self):
+        '''
+        Returns:
+        - dict: Resumen de la instantánea vigente, números de las retiradas que siguen en
+          memoria, última recarga (en curso o terminada, con su error si lo hubo),
+          contadores de recargas, versiones disponibles en el directorio de instantáneas y
+          versión fijada, si la hay.
+        '''
+        actual = self.actual
+        with self._lock:
+            recarga = None if self._recarga is None else {**self._recarga, "etapas_segundos": dict(self._recarga["etapas_segundos"])}
+            recargas = dict(self.recargas)
+        return {
+            "vigente": None if actual is None else actual.resumen(),
+            "retiradas_en_memoria": self.retiradas(),
+            "recarga": recarga,
+            "recargas": recargas,
+            "versiones": versiones(),
+            "fijada": self._fijada,
+        }
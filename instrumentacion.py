@@ -0,0 +1,365 @@
+'''
+Medición de las etapas de los endpoints y perfilado por consulta.
+
+Las etapas costosas (lectura de Parquet, to_pandas, filtro por géneros, groupby,
+vectorización TF-IDF, búsqueda de similares, serialización JSON) se envuelven en
+tramos con nombre:
+
+    with tramo('groupby'):
+        ...
+
+Cada tramo suma su duración al histograma de su nombre; /metrics los expone en formato
+de texto de Prometheus junto con la duración de cada ruta y los contadores de los pools
+de ejecución y del cache. Un tramo cuesta dos lecturas del reloj y una actualización del
+histograma bajo un lock.
+
+Con configuracion.perfilado_habilitado, una consulta con el encabezado
+`X-Perfil: tramos`, `cprofile` o `pyinstrument` (este último, si está instalado)
+devuelve, en lugar de la respuesta, la lista de tramos de esa consulta y el perfil del
+trabajo que corrió en el pool de ejecución. Solo se atiende la fracción
+configuracion.perfilado_muestreo de esos pedidos; sin el encabezado no se registra nada
+por consulta.
+'''
+
+import bisect
+import contextvars
+import cProfile
+import io
+import logging
+import pstats
+import random
+import threading
+import time
+
+from starlette.routing import Match
+
+import configuracion
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+
+logger = logging.getLogger(__name__)
+
+# Límites superiores (en segundos) de los buckets de los histogramas
+LIMITES = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+MODOS_PERFIL = ('tramos', 'cprofile', 'pyinstrument')
+
+# Perfil de la consulta en curso, solo cuando se pidió con el encabezado
+_perfil = contextvars.ContextVar('perfil', default=None)
+
+
+class Histograma:
+    '''
+    Cantidad de observaciones por bucket, suma y total, como un histograma de Prometheus.
+    '''
+
+    def __init__(self):
+        self.buckets = [0] * (len(LIMITES) + 1)
+        self.suma = 0.0
+        self.cantidad = 0
+
+    def observar(self, valor):
+        self.buckets[bisect.bisect_left(LIMITES, valor)] += 1
+        self.suma += valor
+        self.cantidad += 1
+
+
+class Registro:
+    '''
+    Histogramas por nombre de métrica y valor de etiqueta.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histogramas = {}
+
+    def observar(self, metrica, etiqueta, valor):
+        with self._lock:
+            histograma = self._histogramas.get((metrica, etiqueta))
+            if histograma is None:
+                histograma = self._histogramas[(metrica, etiqueta)] = Histograma()
+            histograma.observar(valor)
+
+    def copia(self):
+        with self._lock:
+            return {clave: (list(h.buckets), h.suma, h.cantidad) for clave, h in self._histogramas.items()}
+
+
+registro = Registro()
+
+
+class Perfil:
+    '''
+    Tramos y perfil de una consulta.
+    '''
+
+    def __init__(self, modo):
+        self.modo = modo
+        self.tramos = []
+        self.reportes = []
+
+
+class tramo:
+    '''
+    Mide la duración de un bloque y la suma al histograma de su nombre.
+    '''
+
+    __slots__ = ('nombre', 'inicio')
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *excepcion):
+        duracion = time.perf_counter() - self.inicio
+        registro.observar('tramo', self.nombre, duracion)
+        perfil = _perfil.get()
+        if perfil is not None:
+            perfil.tramos.append((self.nombre, duracion))
+        return False
+
+
+def modo_pedido(encabezado):
+    '''
+    Modo de perfilado que corresponde a un pedido, o None si no se perfila.
+
+    Parameters:
+    - encabezado (str): Valor del encabezado X-Perfil, o None.
+    '''
+    if encabezado is None or not configuracion.perfilado_habilitado:
+        return None
+    modo = encabezado.strip().lower()
+    if modo not in MODOS_PERFIL or random.random() >= configuracion.perfilado_muestreo:
+        return None
+    return modo
+
+
+def iniciar(modo):
+    '''
+    Activa el perfil de la consulta en el contexto actual.
+
+    Returns:
+    - Perfil: El perfil, que se completa mientras corre la consulta.
+    '''
+    perfil = Perfil(modo)
+    _perfil.set(perfil)
+    return perfil
+
+
+def perfilando():
+    return _perfil.get() is not None
+
+
+def _perfil_cprofile(funcion, args, kwargs):
+    perfilador = cProfile.Profile()
+    try:
+        return perfilador.runcall(funcion, *args, **kwargs)
+    finally:
+        salida = io.StringIO()
+        pstats.Stats(perfilador, stream=salida).sort_stats('cumulative').print_stats(configuracion.perfilado_funciones)
+        _perfil.get().reportes.append(salida.getvalue())
+
+
+def _perfil_pyinstrument(funcion, args, kwargs):
+    perfilador = Profiler(async_mode='disabled')
+    perfilador.start()
+    try:
+        return funcion(*args, **kwargs)
+    finally:
+        perfilador.stop()
+        _perfil.get().reportes.append(perfilador.output_text())
+
+
+def correr(funcion, *args, **kwargs):
+    '''
+    Ejecuta el trabajo de una consulta; si la consulta pidió un perfil de funciones, lo
+    ejecuta bajo el perfilador. La usan los pools de ejecución.
+    '''
+    perfil = _perfil.get()
+    if perfil is None or perfil.modo == 'tramos':
+        return funcion(*args, **kwargs)
+    if perfil.modo == 'pyinstrument':
+        if Profiler is not None:
+            return _perfil_pyinstrument(funcion, args, kwargs)
+        logger.warning("pyinstrument no está instalado: se usa cProfile")
+        perfil.modo = 'cprofile'
+    return _perfil_cprofile(funcion, args, kwargs)
+
+
+def _totales(perfil):
+    # Veces y duración total de cada tramo, en el orden en que aparecieron por primera vez
+    totales = {}
+    for nombre, segundos in perfil.tramos:
+        veces, total = totales.get(nombre, (0, 0.0))
+        totales[nombre] = (veces + 1, total + segundos)
+    return totales
+
+
+def reporte(perfil, ruta, estado, duracion):
+    '''
+    Texto con los tramos de una consulta (y los perfiles, si se pidieron).
+    '''
+    lineas = [f"{ruta} -> {estado} en {duracion * 1000:.2f} ms (perfil: {perfil.modo})", "",
+              f"  {'tramo':<24} {'veces':>6} {'total ms':>12}"]
+    lineas += [f"  {nombre:<24} {veces:>6} {segundos * 1000:>12.3f}" for nombre, (veces, segundos) in _totales(perfil).items()]
+    for texto in perfil.reportes:
+        lineas += ["", texto]
+    return "\n".join(lineas) + "\n"
+
+
+def server_timing(perfil):
+    '''
+    Valor del encabezado Server-Timing con la duración total de cada tramo de la consulta.
+    '''
+    return ", ".join(f"{nombre};dur={segundos * 1000:.3f}" for nombre, (_, segundos) in _totales(perfil).items())
+
+
+def _plantilla_ruta(scope):
+    # Plantilla de la ruta (por ejemplo /UserForGenre/{genero}), para no abrir una serie por
+    # valor; las respuestas del cache no pasan por el router y se buscan entre las rutas
+    ruta = scope.get("route")
+    if ruta is None:
+        ruta = next((r for r in scope["app"].router.routes if r.matches(scope)[0] == Match.FULL), None)
+    return ruta.path if ruta is not None else "sin_ruta"
+
+
+class MedicionConsultas:
+    '''
+    Middleware ASGI que mide la duración de cada consulta por ruta y, si el pedido trae el
+    encabezado X-Perfil y el perfilado está habilitado, responde con el reporte de la
+    consulta (mismo código de estado, texto plano y encabezado Server-Timing) en lugar de
+    la respuesta.
+
+    Es ASGI puro y no un middleware "http" de FastAPI: esos agregan una tarea y un
+    stream por consulta, que en una respuesta del cache cuestan más que la consulta misma.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        modo = None
+        if configuracion.perfilado_habilitado:
+            encabezado = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"x-perfil"), None)
+            modo = modo_pedido(encabezado)
+        inicio = time.perf_counter()
+        if modo is None:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                registro.observar('ruta', _plantilla_ruta(scope), time.perf_counter() - inicio)
+            return
+
+        perfil = iniciar(modo)
+        estado = {"status": 500}
+
+        async def descartar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado["status"] = mensaje["status"]
+
+        try:
+            await self.app(scope, receive, descartar)
+        finally:
+            duracion = time.perf_counter() - inicio
+            registro.observar('ruta', _plantilla_ruta(scope), duracion)
+        cuerpo = reporte(perfil, scope["path"], estado["status"], duracion).encode()
+        await send({"type": "http.response.start", "status": estado["status"], "headers": [
+            (b"content-type", b"text/plain; charset=utf-8"),
+            (b"content-length", str(len(cuerpo)).encode()),
+            (b"server-timing", server_timing(perfil).encode()),
+            (b"x-perfil", perfil.modo.encode()),
+        ]})
+        await send({"type": "http.response.body", "body": cuerpo})
+
+
+def _etiqueta(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatear_limite(limite):
+    return repr(float(limite)) if limite != float('inf') else '+Inf'
+
+
+def texto_prometheus(ejecucion=None, cache=None, arranque=None, instantaneas=None, ingesta=None):
+    '''
+    Métricas en formato de texto de Prometheus.
+
+    Parameters:
+    - ejecucion (dict): Métricas de los pools (ejecucion.metricas()).
+    - cache (dict): Estadísticas del cache de respuestas.
+    - arranque (dict): Estado del arranque (Arranque.estado()).
+    - instantaneas (dict): Estado de las instantáneas (GestorInstantaneas.estado()).
+    - ingesta (dict): Estado de las reseñas en vivo (ResenasEnVivo.estado()).
+
+    Returns:
+    - str: Histogramas de tramos y rutas, contadores de los pools y del cache, duración
+      de las etapas del arranque, estado de las instantáneas de datos y de la ingesta de reseñas.
+    '''
+    descripciones = {
+        'tramo': ('steam_api_tramo_segundos', 'tramo', "Duración de cada etapa de los endpoints"),
+        'ruta': ('steam_api_ruta_segundos', 'ruta', "Duración de las consultas por ruta"),
+    }
+    histogramas = registro.copia()
+    lineas = []
+    for metrica, (nombre, etiqueta, ayuda) in descripciones.items():
+        lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} histogram"]
+        for (clave, valor), (buckets, suma, cantidad) in sorted(histogramas.items()):
+            if clave != metrica:
+                continue
+            acumulado = 0
+            for limite, observaciones in zip((*LIMITES, float('inf')), buckets):
+                acumulado += observaciones
+                lineas.append(f'{nombre}_bucket{{{etiqueta}="{_etiqueta(valor)}",le="{_formatear_limite(limite)}"}} {acumulado}')
+            lineas.append(f'{nombre}_sum{{{etiqueta}="{_etiqueta(valor)}"}} {suma}')
+            lineas.append(f'{nombre}_count{{{etiqueta}="{_etiqueta(valor)}"}} {cantidad}')
+
+    if ejecucion:
+        for campo, tipo in (('en_curso', 'gauge'), ('en_cola', 'gauge'), ('completadas', 'counter'),
+                            ('fallidas', 'counter'), ('rechazadas', 'counter'), ('vencidas', 'counter'),
+                            ('canceladas', 'counter')):
+            nombre = f"steam_api_ejecucion_{campo}" + ("_total" if tipo == 'counter' else "")
+            lineas += [f"# HELP {nombre} Consultas {campo.replace('_', ' ')} por grupo de ejecución", f"# TYPE {nombre} {tipo}"]
+            lineas += [f'{nombre}{{grupo="{_etiqueta(grupo)}"}} {valores[campo]}' for grupo, valores in ejecucion.items()]
+    if cache:
+        for campo in ('aciertos', 'fallos', 'descartes'):
+            nombre = f"steam_api_cache_{campo}_total"
+            lineas += [f"# HELP {nombre} Consultas del cache de respuestas: {campo}", f"# TYPE {nombre} counter",
+                       f"{nombre} {cache[campo]}"]
+        lineas += ["# HELP steam_api_cache_entradas Respuestas guardadas en el cache", "# TYPE steam_api_cache_entradas gauge",
+                   f"steam_api_cache_entradas {cache['entradas']}"]
+    if arranque:
+        lineas += ["# HELP steam_api_lista La API terminó de cargar y calentar (1) o no (0)", "# TYPE steam_api_lista gauge",
+                   f"steam_api_lista {int(arranque['listo'])}",
+                   "# HELP steam_api_arranque_segundos Duración de cada etapa del arranque", "# TYPE steam_api_arranque_segundos gauge"]
+        lineas += [f'steam_api_arranque_segundos{{etapa="{_etiqueta(etapa)}"}} {segundos}'
+                   for etapa, segundos in arranque['etapas_segundos'].items()]
+    if instantaneas:
+        vigente = instantaneas['vigente']
+        if vigente is not None:
+            lineas += ["# HELP steam_api_instantanea Número de la instantánea de datos vigente", "# TYPE steam_api_instantanea gauge",
+                       f'steam_api_instantanea{{version="{_etiqueta(vigente["version"])}"}} {vigente["numero"]}']
+        lineas += ["# HELP steam_api_instantaneas_retiradas Instantáneas reemplazadas que siguen en memoria",
+                   "# TYPE steam_api_instantaneas_retiradas gauge",
+                   f"steam_api_instantaneas_retiradas {len(instantaneas['retiradas_en_memoria'])}",
+                   "# HELP steam_api_recargas_total Recargas de instantáneas por resultado", "# TYPE steam_api_recargas_total counter"]
+        lineas += [f'steam_api_recargas_total{{resultado="{resultado}"}} {cantidad}'
+                   for resultado, cantidad in instantaneas['recargas'].items()]
+    if ingesta:
+        for campo, tipo, ayuda in (('ingeridas', 'counter', "Reseñas ingeridas en vivo"),
+                                   ('descartadas', 'counter', "Reseñas ingeridas que no cuentan en ningún ranking"),
+                                   ('compactaciones', 'counter', "Compactaciones de reseñas escritas en Parquet"),
+                                   ('errores_compactacion', 'counter', "Compactaciones de reseñas fallidas"),
+                                   ('pendientes', 'gauge', "Reseñas ingeridas todavía sin compactar")):
+            nombre = f"steam_api_resenas_{campo}" + ("_total" if tipo == 'counter' else "")
+            lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} {tipo}", f"{nombre} {ingesta[campo]}"]
+    return "\n".join(lineas) + "\n"
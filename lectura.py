@@ -0,0 +1,117 @@
+'''
+Capa de lectura de los archivos Parquet sobre pyarrow.dataset.
+
+Las consultas indican solo las columnas que usan y un filtro (por ejemplo, el año),
+que se empuja hasta las estadísticas de cada row group: los row groups cuyo rango
+de valores no incluye el año buscado no se leen ni se descomprimen. El resultado se
+entrega como tablas Arrow, sin pasar por pandas.
+
+Para que el filtro descarte datos, los archivos tienen que estar ordenados por la
+columna filtrada y divididos en row groups de tamaño moderado. Los archivos servidos
+se pueden reescribir así con:
+
+    python lectura.py
+
+Esa disposición está pensada para el modo 'exacto': en modo 'muestra' la API lee el
+primer row group, que en un archivo ordenado solo contiene los primeros años.
+'''
+
+import logging
+import os
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import configuracion
+from instrumentacion import tramo
+
+
+logger = logging.getLogger(__name__)
+
+# Columna por la que se ordena cada archivo filtrado por año
+COLUMNAS_ORDEN = {
+    configuracion.parquet_file_path3: 'reviews_posted',
+    configuracion.parquet_file_path4: 'release_date',
+}
+
+
+def archivos(ruta):
+    '''
+    Archivos Parquet de un dataset: el archivo mismo, o los archivos de un directorio
+    (un dataset construido por lotes con incremental.py) en orden de nombre.
+    '''
+    if not os.path.isdir(ruta):
+        return [ruta]
+    return sorted(os.path.join(ruta, nombre) for nombre in os.listdir(ruta) if nombre.endswith('.parquet'))
+
+
+def escanear(ruta, columnas, filtro=None):
+    '''
+    Lee un archivo Parquet aplicando el filtro sobre las estadísticas de los row groups.
+
+    Parameters:
+    - ruta (str): Ruta del archivo Parquet, o directorio con un archivo por lote.
+    - columnas (list): Columnas a leer.
+    - filtro (pyarrow.compute.Expression): Condición sobre las filas, o None.
+
+    Yields:
+    - pa.Table: Lotes de filas que cumplen el filtro, solo con las columnas pedidas.
+    '''
+    dataset = ds.dataset(archivos(ruta), format='parquet')
+    lotes = iter(dataset.to_batches(columns=columnas, filter=filtro))
+    while True:
+        # Lectura y descompresión del próximo lote, sin contar el trabajo del consumidor
+        with tramo('lectura_parquet'):
+            lote = next(lotes, None)
+        if lote is None:
+            return
+        if lote.num_rows:
+            yield pa.Table.from_batches([lote])
+
+
+def filtrar_tabla(tabla, columnas, filtro=None):
+    '''
+    Aplica la misma consulta que escanear() sobre una tabla que ya está en memoria.
+
+    Returns:
+    - pa.Table: Las filas que cumplen el filtro, solo con las columnas pedidas.
+    '''
+    if filtro is not None:
+        tabla = tabla.filter(filtro)
+    return tabla.select(columnas)
+
+
+def reescribir_ordenado(ruta, columna, filas_por_row_group=None, compression='gzip'):
+    '''
+    Reescribe un archivo Parquet ordenado por una columna y con row groups acotados,
+    para que el filtro por esa columna pueda saltear row groups.
+
+    Parameters:
+    - ruta (str): Archivo a reescribir (se reemplaza al terminar).
+    - columna (str): Columna de orden, por ejemplo el año.
+    - filas_por_row_group (int): Filas por row group, por defecto configuracion.filas_por_row_group.
+    - compression (str): Compresión del archivo.
+
+    Returns:
+    - int: Cantidad de row groups escritos.
+    '''
+    filas_por_row_group = filas_por_row_group or configuracion.filas_por_row_group
+    tabla = pq.read_table(ruta).sort_by(columna)
+    temporal = ruta + '.tmp'
+    pq.write_table(tabla, temporal, row_group_size=filas_por_row_group, compression=compression, write_statistics=True)
+    os.replace(temporal, ruta)
+    return pq.ParquetFile(ruta).num_row_groups
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    for ruta, columna in COLUMNAS_ORDEN.items():
+        if not os.path.exists(ruta):
+            logger.warning("No se encontró el archivo %s", ruta)
+            continue
+        if os.path.isdir(ruta):
+            logger.info("%s es un dataset por lotes, no se reescribe", ruta)
+            continue
+        row_groups = reescribir_ordenado(ruta, columna)
+        logger.info("%s ordenado por %s en %d row groups", ruta, columna, row_groups)
@@ -1,401 +1,940 @@
-from fastapi import Depends, FastAPI, HTTPException, Path
-from fastapi.responses import HTMLResponse
-import pandas as pd
-from typing import List, Dict
-import os
-import pyarrow.parquet as pq
-import asyncio
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
-import gzip
-
-
-parquet_file_path1 = "Jupyter/df_PlayTimeGenre_gzip.parquet"
-parquet_file_path2 = "Jupyter/df_UserForGenre_gzip.parquet"
-parquet_file_path3 = "Jupyter/df_UsersRecommend_gzip.parquet"
-parquet_file_path4 = "Jupyter/df_sentiment_analysis_gzip.parquet"
-parquet_file_path5 = "Jupyter/df_RecomendacionJuego_gzip.parquet"
-
-
-app = FastAPI()
-
-@app.get("/", response_class=HTMLResponse, include_in_schema=False)
-def read_root():
-    message = """
-        <head>
-        <link href="https://fonts.googleapis.com/css2?family=Roboto:wght@400;700&display=swap" rel="stylesheet">
-    </head>
-    <style>
-        .custom-text {
-            color: #333333;  /* Gris oscuro */
-            font-family: 'Roboto', sans-serif;  /* Utiliza la fuente Roboto o la que hayas elegido */
-        }
-    </style>
-    <div style="text-align: center; font-size: 24px; margin-bottom: 20px;" class="custom-text">
-        "Hola": "¡Bienvenido a mi Proyecto de MLOPS en Henry!"
-    </div>
-    <div style="text-align: center; font-size: 18px; margin-bottom: 40px;" class="custom-text">
-         "Te invito a": "Proyecto FastAPI - Sistema de Recomendaciones STEAM GAMES."(MVP)
-    </div>
-    <div style="text-align: center; font-size: 18px; margin-bottom: 20px;" class="custom-text">
-        "DataScientist": "Tania Follonier",
-    </div>
-    <div style="text-align: center; font-size: 18px; margin-bottom: 20px;" class="custom-text">
-        "Mensaje": "Proyecto Individual N° 1"
-    </div>    
-    <div style="text-align: center;">
-        <form action='/redirect' style="display: inline-block;">
-            <input type='submit' value='Ingrese a la API' style="font-size: 16px; background-color: orange; color: white; padding: 10px 20px; border: none; border-radius: 5px; cursor: pointer;">
-        </form>
-    </div>
-    """
-    return HTMLResponse(content=message)
-
-@app.get("/redirect", include_in_schema=False)
-def redirect_to_docs():
-    link = "https://pi1-mlops-steam-games-tania-follonier.onrender.com/docs"
-    raise HTTPException(status_code=302, detail="Redirecting", headers={"Location": link})
-
-
-
-@app.get('/PlayTimeGenre/{genero}')
-async def PlayTimeGenre(genero: str):
-    '''
-    Datos:
-    - genero (str): Género para el cual se busca el año con más horas jugadas.
-
-    Funcionalidad:
-    - Devuelve el año con más horas jugadas para el género especificado.
-
-    Return:
-    - Dict: {"Año de lanzamiento con más horas jugadas para Género X": int}
-    '''
-    try:
-        sample_percent = 5
-
-        # Lee una muestra del archivo Parquet con pyarrow
-        parquet_file1 = pq.ParquetFile(parquet_file_path1)
-        total_rows1 = parquet_file1.metadata.num_rows
-        sample_rows1 = int(total_rows1 * (sample_percent / 100.0))
-        df_PlayTimeGenre_muestra = parquet_file1.read_row_groups(row_groups=[0]).to_pandas().head(sample_rows1//80)
-        genero_filtrado = df_PlayTimeGenre_muestra[df_PlayTimeGenre_muestra['genres'].apply(lambda x: genero in x)]
-
-        if genero_filtrado.empty:
-            raise HTTPException(status_code=404, detail=f"No hay datos para el género {genero}")
-
-        genero_filtrado['playtime_forever'] = genero_filtrado['playtime_forever'] / 60
-
-        max_hours_year = genero_filtrado.groupby('release_date')['playtime_forever'].sum().idxmax()
-
-        return {"Año de lanzamiento con más horas jugadas para el Género " + genero: int(max_hours_year)}
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@app.get('/UserForGenre/{genero}')
-async def UserForGenre(genero:str):
-    '''
-    Datos:
-    - genero (str): Género para el cual se busca el usuario con más horas jugadas y la acumulación de horas por año.
-
-    Funcionalidad:
-    - Devuelve el usuario con más horas jugadas y una lista de la acumulación de horas jugadas por año para el género especificado.
-
-    Return:
-    - Dict: {"Usuario con más horas jugadas para Género X": List, "Horas jugadas": List}
-    '''
-    try:
-        sample_percent = 5
-
-        # Lee una muestra del archivo Parquet con pyarrow
-        parquet_file2 = pq.ParquetFile(parquet_file_path2)
-        total_rows2 = parquet_file2.metadata.num_rows
-        sample_rows2 = int(total_rows2 * (sample_percent / 100.0))
-        df_UserForGenre_muestra = parquet_file2.read_row_groups(row_groups=[0]).to_pandas().head(sample_rows2//80)
-          
-        condition = df_UserForGenre_muestra['genres'].apply(lambda x: genero in x)
-        juegos_genero = df_UserForGenre_muestra[condition]
-
-       
-        juegos_genero['playtime_forever'] = juegos_genero['playtime_forever'] / 60
-        juegos_genero['release_date'] = pd.to_numeric(juegos_genero['release_date'], errors='coerce')
-        juegos_genero = juegos_genero[juegos_genero['release_date'] >= 100]
-        juegos_genero['Año'] = juegos_genero['release_date']
-
-        horas_por_usuario = juegos_genero.groupby(['user_id', 'Año'])['playtime_forever'].sum().reset_index()
-        if not horas_por_usuario.empty:
-            usuario_max_horas = horas_por_usuario.groupby('user_id')['playtime_forever'].sum().idxmax()
-            usuario_max_horas = horas_por_usuario[horas_por_usuario['user_id'] == usuario_max_horas]
-        else:
-            usuario_max_horas = None
-
-        acumulacion_horas = horas_por_usuario.groupby(['Año'])['playtime_forever'].sum().reset_index()
-        acumulacion_horas = acumulacion_horas.rename(columns={'Año': 'Año', 'playtime_forever': 'Horas'})
-
-        resultado = {
-            "Usuario con más horas jugadas para " + genero: {"user_id": usuario_max_horas.iloc[0]['user_id'], "Año": int(usuario_max_horas.iloc[0]['Año']), "playtime_forever": usuario_max_horas.iloc[0]['playtime_forever']},
-            "Horas jugadas": [{"Año": int(row['Año']), "Horas": row['Horas']} for _, row in acumulacion_horas.iterrows()]
-        }
-
-        return resultado
-        
-
-    except FileNotFoundError:
-        raise HTTPException(status_code=500, detail="Error al cargar los archivos de datos")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.get('/UsersRecommend/{anio}')
-async def UsersRecommend(anio: int):
-    '''
-    Datos:
-    - anio (int): Año para el cual se busca el top 3 de juegos más recomendados.
-
-    Funcionalidad:
-    - Devuelve el top 3 de juegos más recomendados por usuarios para el año dado.
-
-    Return:
-    - List: [{"Puesto 1": str}, {"Puesto 2": str}, {"Puesto 3": str}]
-    '''
-    try:
-        sample_percent = 5
-
-        # Lee una muestra del archivo Parquet con pyarrow
-        parquet_file3 = pq.ParquetFile(parquet_file_path3)
-        total_rows3 = parquet_file3.metadata.num_rows
-        sample_rows3 = int(total_rows3 * (sample_percent / 100.0))
-        df_UsersRecommend_muestra = parquet_file3.read_row_groups(row_groups=[0]).to_pandas().head(sample_rows3)
-
-        filtered_df = df_UsersRecommend_muestra[
-        (df_UsersRecommend_muestra["reviews_posted"] == anio) &
-        (df_UsersRecommend_muestra["reviews_recommend"] == True) &
-        (df_UsersRecommend_muestra["sentiment_analysis"]>=1)
-        ]
-        recommend_counts = filtered_df.groupby("title")["title"].count().reset_index(name="count").sort_values(by="count", ascending=False).head(3)
-        top_3_dict = {f"Puesto {i+1}": juego for i, juego in enumerate(recommend_counts['title'])}
-        return top_3_dict
-    except Exception as e:
-        raise HTTPException(status_code=500, detail="Error al obtener los juegos mas recomendados.")
-
-@app.get('/UsersNotRecommend/{anio}')
-async def UsersNotRecommend(anio: int):
-    '''
-    Datos:
-    - anio (int): Año para el cual se busca el top 3 de juegos menos recomendados.
-
-    Funcionalidad:
-    - Devuelve el top 3 de juegos menos recomendados por usuarios para el año dado.
-
-    Return:
-    - List: [{"Puesto 1": str}, {"Puesto 2": str}, {"Puesto 3": str}]
-    '''
-    try:
-        sample_percent = 5
-
-        # Lee una muestra del archivo Parquet con pyarrow
-        parquet_file4 = pq.ParquetFile(parquet_file_path3)
-        total_rows3 = parquet_file4.metadata.num_rows
-        sample_rows3 = int(total_rows3 * (sample_percent / 100.0))
-        df_UsersRecommend_muestra = parquet_file4.read_row_groups(row_groups=[0]).to_pandas().head(sample_rows3)
-
-        filtered_df = df_UsersRecommend_muestra[
-        (df_UsersRecommend_muestra["reviews_posted"] == anio) &
-        (df_UsersRecommend_muestra["reviews_recommend"] == False) &
-        (df_UsersRecommend_muestra["sentiment_analysis"]==0)
-        ]
-        not_recommend_counts = filtered_df.groupby("title")["title"].count().reset_index(name="count").sort_values(by="count", ascending=False).head(3)
-        top_3_dict = {f"Puesto {i+1}": juego for i, juego in enumerate(not_recommend_counts['title'])}
-        return top_3_dict
-    except Exception as e:
-        raise HTTPException(status_code=500, detail="Error al obtener los juegos menos recomendados.")
-    
-@app.get('/sentiment_analysis/{anio}')
-async def sentiment_analysis(anio: int):
-
-    '''
-    Según el año de lanzamiento, se devuelve una lista con la cantidad de registros de reseñas de usuarios que se encuentren categorizados con un análisis de sentimiento.
-
-    Args:
-        año (int): Año para el cual se busca el análisis de sentimiento.
-
-    Returns:
-        dict: Diccionario con la cantidad de reseñas por sentimiento.
-    '''
-  
-    try:
-        sample_percent = 5
-
-        # Lee una muestra del archivo Parquet con pyarrow
-        parquet_file5 = pq.ParquetFile(parquet_file_path4)
-        total_rows5 = parquet_file5.metadata.num_rows
-        sample_rows5 = int(total_rows5 * (sample_percent / 100.0))
-        df_sentiment_analysis_muestra = parquet_file5.read_row_groups(row_groups=[0]).to_pandas().head(sample_rows5)
-        
-        filtered_df = df_sentiment_analysis_muestra[df_sentiment_analysis_muestra["release_date"] == anio]
-
-        
-        sentiment_counts = filtered_df["sentiment_analysis"].value_counts()
-
-        
-        sentiment_mapping = {2: "Positive", 1: "Neutral", 0: "Negative"}
-        sentiment_counts_mapped = {sentiment_mapping[key]: value for key, value in sentiment_counts.items()}
-
-        return sentiment_counts_mapped
-    except pd.errors.EmptyDataError:
-        raise HTTPException(status_code=404, detail=f"No hay datos para el año {anio}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-
-
-@app.get('/Recomendacion_Juego/{id_producto}')
-async def recomendacion_juego(id_producto: int = Path(..., description="ID del juego para obtener recomendaciones")):
-    '''
-    Endpoint para obtener una lista de juegos recomendados similares a un juego dado.
-
-    Parámetros:
-    - id_juego (int): ID del juego para el cual se desean obtener recomendaciones.
-
-    Respuestas:
-    - 200 OK: Retorna una lista con 5 juegos recomendados similares al juego ingresado.
-    - 404 Not Found: Si no se encuentra el juego con el ID especificado.
-    - 500 Internal Server Error: En caso de cualquier otro error, proporciona detalles de la excepción.
-
-    Ejemplo de Uso:
-    - /RecomendarJuego/123
-
-    Ejemplo de Respuesta Exitosa:
-    [
-        {"id": 456, "nombre": "Juego A"},
-        {"id": 789, "nombre": "Juego B"},
-        {"id": 101, "nombre": "Juego C"},
-        {"id": 202, "nombre": "Juego D"},
-        {"id": 303, "nombre": "Juego E"}
-    ]
-    '''
-    try:
-        sample_percent = 5
-
-        # Lee una muestra del archivo Parquet con pyarrow
-        parquet_file6 = pq.ParquetFile(parquet_file_path5)
-        total_rows6 = parquet_file6.metadata.num_rows
-        sample_rows6 = int(total_rows6 * (sample_percent / 100.0))
-        df_RecomendacionJuego_muestra = parquet_file6.read_row_groups(row_groups=[0]).to_pandas()
-
-        porcentaje_muestra = 50
-        total_registros = len(df_RecomendacionJuego_muestra)
-        num_registros = int(total_registros * (porcentaje_muestra / 100.0))
-        df_subset = df_RecomendacionJuego_muestra.sample(n=num_registros, random_state=42).reset_index(drop=True)
-        
-        num_recommendations = 5
-
-        juego_seleccionado = df_subset[df_subset['item_id'] == id_producto]
-
-        if juego_seleccionado.empty:
-            raise HTTPException(status_code=404, detail=f"No se encontró el juego con ID {id_producto}")
-
-        title_game_and_genres = ' '.join(juego_seleccionado['title'].fillna('').astype(str) + ' ' + juego_seleccionado['genres'].fillna('').astype(str))
-        tfidf_vectorizer = TfidfVectorizer()
-        tfidf_matrix = tfidf_vectorizer.fit_transform(df_subset['title'].fillna('').astype(str) + ' ' + df_subset['genres'].fillna('').astype(str))
-
-        juego_tfidf = tfidf_vectorizer.transform([title_game_and_genres])
-        similarity_scores = cosine_similarity(juego_tfidf, tfidf_matrix)
-
-        if similarity_scores is not None:
-            similar_games_indices = similarity_scores[0].argsort()[::-1]
-
-            
-            recommended_games = df_subset.loc[similar_games_indices[1:]]
-            recommended_games = recommended_games[~recommended_games['item_id'].isin([id_producto])].drop_duplicates(subset='title')
-
-            recommendations_list = recommended_games.head(num_recommendations)['title'].tolist()
-
-            if len(recommendations_list) < num_recommendations:
-                message = f"Se encontraron {len(recommendations_list)} recomendaciones para este ID."
-                recommendations_list += [None] * (num_recommendations - len(recommendations_list))
-            else:
-                message = None
-
-            return {"recomendaciones": recommendations_list, "message": message}
-        else:
-            return {"message": "No se encontraron juegos similares."}
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}") from e
-
-
-
-
-
-# Inicio
-    
-@app.get("/", response_class=HTMLResponse, tags=["Home"])
-async def presentacion():
-    return '''
-        <html>
-            <head>
-                <title>API Steam</title>
-                <style>
-                    body {
-                        color: black; 
-                        background-color: white; 
-                        font-family: Arial, sans-serif;
-                        padding: 20px;
-                    }
-                    h1 {
-                        color: #333;
-                        text-align: center;
-                    }
-                    p {
-                        color: #666;
-                        text-align: center;
-                        font-size: 18px;
-                        margin-top: 20px;
-                    }
-                    footer {
-                        text-align: center;
-                    }
-                </style>
-            </head>
-            <body>
-                <h1>Proyecto Individual N° 1: MLOps Steam</h1>
-                <p>Esta es una API para consultas de la plataforma Steam.</p>
-                <p>Escriba <span style="background-color: lightgray;">/docs</span> a continuación de la URL actual para ingresar.</p>
-                
-            </body>
-        </html>
-    '''
-
-
-# Funciones
-
-@app.get(path='/PlayTimeGenre/{genero}', tags=["Funciones Generales"])
-def play_time_genre(genero: str = Path(..., description="Devuelve el año con más horas jugadas para el género especificado (Ingresar la primer letra en Mayúscula)")):
-    return PlayTimeGenre(genero)
-
-@app.get(path='/UserForGenre/{genero}', tags=["Funciones Generales"])
-def user_for_genre(genero: str = Path(..., description="Devuelve el usuario que acumula más horas jugadas para el género especificado (Ingresar la primer letra en Mayúscula)")):
-    return UserForGenre(genero)
-
-
-@app.get("/UsersRecommend/{anio}", tags=["Funciones Generales"])
-def users_recommend(anio: int = Path(..., description="Devuelve el top 3 de juegos más recomendados para el año especificado")):
-        try:
-            result = UsersRecommend(anio)
-            return result
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
-
-@app.get(path='/UsersNotRecommend/{anio}', tags=["Funciones Generales"])
-def users_not_recommend(anio: int = Path(..., description="Devuelve el top 3 de juegos menos recomendados para el año especificado")):
-    return UsersNotRecommend(anio)
-
-@app.get(path='/sentiment_analysis/{anio}', tags=["Funciones Generales"])
-def sentiment_analysis(anio: int = Path(..., description="Devuelve una lista con la cantidad de registros de reseñas de usuarios que se encuentran categorizados con un análisis de sentimiento en el año especificado")):
-    return sentiment_analysis(anio)
-
-@app.get(path='/Recomendacion_Juego/{id_producto}', tags=["Sistema de Recomendación: Item-Item"])
-async def recomendacion_juego(id_producto: int = Path(..., description= "Devuelve una lista con 5 juegos recomendados similares al ingresado")):
-    return recomendacion_juego(id_producto)
+from fastapi import Depends, FastAPI, HTTPException, Path, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response
+from typing import List, Dict, Optional
+from pydantic import BaseModel, Field
+from contextlib import asynccontextmanager
+import os
+import asyncio
+import gzip
+import hmac
+import logging
+
+import configuracion
+import ejecucion
+import formatos
+import instrumentacion
+from arranque import Arranque, EsperaArranque
+from cache_respuestas import CacheRespuestas, coincide_etag, etag_debil
+from indice_generos import OPERADORES, dividir_generos
+from instantaneas import GestorInstantaneas, Instantanea, ultima_version, versiones
+from instrumentacion import tramo
+
+
+logger = logging.getLogger(__name__)
+
+# pandas, consultas y los módulos que importan pandas, pyarrow y scikit-learn se importan al
+# cargar los datos, en segundo plano al iniciar la API (ver arranque.py), no al importar este módulo
+pd = None
+consultas = None
+cache = CacheRespuestas()
+arranque = Arranque()
+
+
+def _construir(raiz, medir):
+    '''
+    Carga los datasets, las respuestas precalculadas y los modelos de un directorio de
+    artefactos (ver instantaneas.py) y arma el cubo de agregados por año.
+    '''
+    from agregados import Agregados
+    from cubo import Cubo
+    from datos import AlmacenDatos
+    from recomendacion import ModeloRecomendacion
+    from recomendacion_usuarios import ModeloUsuarios
+
+    with medir('datasets'):
+        almacen = AlmacenDatos(raiz=raiz)
+        almacen.cargar()
+    with medir('agregados'):
+        agregados = Agregados()
+        agregados.cargar(raiz=raiz)
+    with medir('cubo'):
+        cubo = Cubo.construir(almacen) if configuracion.cubo_agregados else Cubo()
+
+    with medir('modelo_recomendacion'):
+        modelo = ModeloRecomendacion.cargar(raiz=raiz)
+        if modelo is None and 'RecomendacionJuego' in almacen.datasets:
+            # Sin modelo guardado se ajusta en memoria y las consultas calculan el top-K en vivo
+            modelo = ModeloRecomendacion.entrenar(almacen.obtener('RecomendacionJuego'), calcular_vecinos=False)
+        almacen.descartar('RecomendacionJuego')
+    with medir('modelo_usuarios'):
+        # El modelo usuario-juego solo se usa si se entrenó offline (`python recomendacion_usuarios.py`)
+        modelo_usuarios = ModeloUsuarios.cargar(raiz=raiz)
+
+    return Instantanea(raiz, almacen, agregados, cubo, modelo, modelo_usuarios)
+
+
+def _pruebas(instantanea):
+    '''
+    Una consulta en vivo de cada endpoint con datos en la instantánea.
+    '''
+    almacen = instantanea.almacen
+    modelo_recomendacion, modelo_usuarios = instantanea.modelo_recomendacion, instantanea.modelo_usuarios
+    genero, anio = [configuracion.genero_calentamiento], configuracion.anio_calentamiento
+    # endpoint: (dataset que consulta, consulta)
+    por_dataset = {
+        'PlayTimeGenre': ('PlayTimeGenre', lambda: consultas.play_time_genre(almacen.fragmentos('PlayTimeGenre'), genero)),
+        'UserForGenre': ('UserForGenre', lambda: consultas.user_for_genre(almacen.fragmentos('UserForGenre'), genero)),
+        'UsersRecommend': ('UsersRecommend', lambda: consultas.users_recommend(almacen, anio)),
+        'UsersNotRecommend': ('UsersRecommend', lambda: consultas.users_not_recommend(almacen, anio)),
+        'sentiment_analysis': ('sentiment_analysis', lambda: consultas.sentiment_analysis(almacen, anio)),
+    }
+    disponibles = instantanea.disponibles()
+    pruebas = {nombre: consulta for nombre, (dataset, consulta) in por_dataset.items() if dataset in disponibles}
+    if modelo_recomendacion is not None:
+        pruebas['Recomendacion_Juego'] = lambda: modelo_recomendacion.recomendar(modelo_recomendacion.juegos['item_id'].iloc[0])
+    if modelo_usuarios is not None and len(modelo_usuarios.usuarios):
+        pruebas['Recomendacion_Usuario'] = lambda: modelo_usuarios.recomendar(modelo_usuarios.usuarios[0])
+    return pruebas
+
+
+def _validar(nueva, anterior, medir):
+    '''
+    Al iniciar, calienta las consultas de la instantánea para que la primera consulta real
+    no pague la apertura de los archivos, las páginas de los archivos mapeados, la
+    construcción del buscador de similares ni la primera llamada a cada función; un endpoint
+    sin datos no impide el arranque. En una recarga la instantánea nueva tiene que ofrecer
+    los mismos datasets y modelos que la vigente y responder una consulta de cada endpoint,
+    o no se publica (de paso, queda caliente).
+    '''
+    if anterior is None:
+        if not configuracion.calentamiento:
+            return
+        for nombre, consulta in _pruebas(nueva).items():
+            with medir(f'calentamiento_{nombre}'):
+                try:
+                    consulta()
+                except Exception as e:
+                    logger.warning("No se pudo calentar %s: %s", nombre, e)
+        return
+
+    faltantes = anterior.disponibles() - nueva.disponibles()
+    if faltantes:
+        raise ValueError(f"La instantánea nueva no tiene {', '.join(sorted(faltantes))}")
+    for nombre, consulta in _pruebas(nueva).items():
+        with medir(f'validacion_{nombre}'):
+            consulta()
+
+
+gestor = GestorInstantaneas(_construir, _validar)
+
+
+# Reseñas ingeridas en vivo (ver ingesta.py), se crea al cargar los datos
+resenas = None
+
+
+def _cargar():
+    global pd, consultas, resenas
+    with arranque.medir('importacion'):
+        import pandas as pd
+        import consultas
+        # Módulos de carga de la instantánea: se importan acá para medir la importación aparte
+        import agregados, cubo, datos, ingesta, recomendacion, recomendacion_usuarios
+
+    gestor.cargar(ultima_version() or '', arranque.medir)
+    if configuracion.vigilancia_segundos > 0:
+        gestor.vigilar()
+
+    with arranque.medir('ingesta'):
+        en_vivo = ingesta.ResenasEnVivo()
+        en_vivo.cargar()
+    resenas = en_vivo
+    if configuracion.compactacion_segundos > 0:
+        resenas.vigilar()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if configuracion.arranque_en_segundo_plano:
+        # El servidor empieza a escuchar enseguida; /health/ready indica cuándo está lista
+        arranque.iniciar(_cargar)
+    else:
+        await asyncio.to_thread(arranque.correr, _cargar)
+    yield
+    gestor.detener()
+    if resenas is not None:
+        # Escribe las reseñas ingeridas que todavía no se compactaron
+        await asyncio.to_thread(resenas.detener)
+
+
+class RespuestaJSON(JSONResponse):
+    '''
+    JSONResponse que mide la serialización del cuerpo como un tramo más de la consulta.
+    '''
+
+    def render(self, content):
+        with tramo('serializacion_json'):
+            return super().render(content)
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=RespuestaJSON)
+
+
+@app.exception_handler(ejecucion.Saturado)
+async def consulta_rechazada(request: Request, exc: ejecucion.Saturado):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+
+@app.exception_handler(ejecucion.TiempoAgotado)
+async def consulta_vencida(request: Request, exc: ejecucion.TiempoAgotado):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
+# Endpoints cuyas respuestas suman las reseñas ingeridas en vivo
+RANKINGS_EN_VIVO = ('UsersRecommend', 'UsersNotRecommend')
+
+
+@app.middleware("http")
+async def cache_de_respuestas(request: Request, call_next):
+    '''
+    Responde los GET repetidos desde el cache y revalida con If-None-Match.
+
+    La clave incluye la versión de la instantánea vigente, así que al publicarse datos
+    nuevos las respuestas anteriores dejan de usarse. Solo se guardan las respuestas 200 en
+    JSON de tamaño conocido: las respuestas NDJSON y Arrow y las de /filas se envían por
+    partes y no se guardan (ver formatos.py).
+    '''
+    instantanea = gestor.actual
+    if (request.method != "GET" or not cache.habilitado or instantanea is None or request.url.path in configuracion.rutas_sin_cache
+            or instrumentacion.perfilando() or formatos.negociar(request.headers.get("accept")) != 'json'):
+        return await call_next(request)
+
+    version = instantanea.version
+    if resenas is not None and resenas.generacion and any(ranking in request.url.path for ranking in RANKINGS_EN_VIVO):
+        # Los rankings con reseñas en vivo cambian con cada lote ingerido
+        version = f"{version}.{resenas.generacion}"
+    clave = (request.url.path, tuple(sorted(request.query_params.multi_items())), version)
+    if_none_match = request.headers.get("if-none-match")
+
+    guardada = cache.obtener(clave)
+    if guardada is None:
+        response = await call_next(request)
+        if response.status_code != 200 or "content-length" not in response.headers:
+            return response
+        cuerpo = b"".join([parte async for parte in response.body_iterator])
+        guardada = (cuerpo, response.headers.get("content-type"), etag_debil(version, cuerpo))
+        cache.guardar(clave, guardada)
+        estado_cache = "MISS"
+    else:
+        estado_cache = "HIT"
+
+    cuerpo, tipo, etag = guardada
+    encabezados = {"ETag": etag, "Cache-Control": f"max-age={int(cache.ttl)}", "X-Cache": estado_cache, "Vary": "Accept"}
+    if coincide_etag(if_none_match, etag):
+        return Response(status_code=304, headers=encabezados)
+    return Response(content=cuerpo, status_code=200, headers=encabezados, media_type=tipo)
+
+
+# Se agrega después del cache para envolverlo: mide también las respuestas del cache, y las
+# consultas perfiladas no pasan por él
+app.add_middleware(instrumentacion.MedicionConsultas)
+# Va por fuera de todo: mientras la API arranca responde 503 sin pasar por el resto
+app.add_middleware(EsperaArranque, arranque=arranque)
+
+
+@app.get("/", response_class=HTMLResponse, include_in_schema=False)
+def read_root():
+    message = """
+        <head>
+        <link href="https://fonts.googleapis.com/css2?family=Roboto:wght@400;700&display=swap" rel="stylesheet">
+    </head>
+    <style>
+        .custom-text {
+            color: #333333;  /* Gris oscuro */
+            font-family: 'Roboto', sans-serif;  /* Utiliza la fuente Roboto o la que hayas elegido */
+        }
+    </style>
+    <div style="text-align: center; font-size: 24px; margin-bottom: 20px;" class="custom-text">
+        "Hola": "¡Bienvenido a mi Proyecto de MLOPS en Henry!"
+    </div>
+    <div style="text-align: center; font-size: 18px; margin-bottom: 40px;" class="custom-text">
+         "Te invito a": "Proyecto FastAPI - Sistema de Recomendaciones STEAM GAMES."(MVP)
+    </div>
+    <div style="text-align: center; font-size: 18px; margin-bottom: 20px;" class="custom-text">
+        "DataScientist": "Tania Follonier",
+    </div>
+    <div style="text-align: center; font-size: 18px; margin-bottom: 20px;" class="custom-text">
+        "Mensaje": "Proyecto Individual N° 1"
+    </div>    
+    <div style="text-align: center;">
+        <form action='/redirect' style="display: inline-block;">
+            <input type='submit' value='Ingrese a la API' style="font-size: 16px; background-color: orange; color: white; padding: 10px 20px; border: none; border-radius: 5px; cursor: pointer;">
+        </form>
+    </div>
+    """
+    return HTMLResponse(content=message)
+
+@app.get("/redirect", include_in_schema=False)
+def redirect_to_docs():
+    link = "https://pi1-mlops-steam-games-tania-follonier.onrender.com/docs"
+    raise HTTPException(status_code=302, detail="Redirecting", headers={"Location": link})
+
+
+@app.get("/memoria", tags=["Operación"])
+def memoria():
+    '''
+    Devuelve la memoria ocupada por cada dataset cargado y la memoria residente máxima del proceso,
+    para dimensionar los contenedores.
+    '''
+    return gestor.actual.almacen.reporte_memoria()
+
+
+@app.get("/cache", tags=["Operación"])
+def estado_cache():
+    '''
+    Devuelve el tamaño del cache de respuestas y sus contadores de aciertos, fallos y descartes.
+    '''
+    return cache.estadisticas()
+
+
+@app.get("/ejecucion", tags=["Operación"])
+def estado_ejecucion():
+    '''
+    Devuelve, por grupo de endpoints, las consultas en curso y en espera, las rechazadas,
+    vencidas y canceladas, y los tiempos promedio de espera y de ejecución.
+    '''
+    return ejecucion.metricas()
+
+
+@app.get("/health/live", tags=["Operación"])
+def health_live():
+    '''
+    Indica que el proceso responde. Devuelve 500 si la carga inicial falló, para que la
+    plataforma reinicie la instancia.
+    '''
+    estado = arranque.estado()
+    if estado["error"] is not None:
+        return JSONResponse(status_code=500, content={"vivo": False, "error": estado["error"]})
+    return {"vivo": True}
+
+
+@app.get("/health/ready", tags=["Operación"])
+def health_ready():
+    '''
+    Indica si la API terminó de cargar los datasets y los modelos y de calentar las
+    consultas (200) o todavía no (503), con la etapa en curso y la duración de cada etapa.
+    '''
+    estado = arranque.estado()
+    return JSONResponse(status_code=200 if estado["listo"] else 503, content=estado)
+
+
+@app.get("/metrics", tags=["Operación"], response_class=Response)
+def metricas_prometheus():
+    '''
+    Devuelve en formato de texto de Prometheus los histogramas de duración por tramo y por
+    ruta, y los contadores de los pools de ejecución, del cache de respuestas y de la
+    ingesta de reseñas.
+    '''
+    texto = instrumentacion.texto_prometheus(ejecucion.metricas(), cache.estadisticas(), arranque.estado(), gestor.estado(),
+                                             resenas.estado() if resenas is not None else None)
+    return Response(content=texto, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class PedidoRecarga(BaseModel):
+    version: Optional[str] = None
+
+
+def _autorizar_admin(request, accion):
+    '''
+    Exige el encabezado `Authorization: Bearer <TOKEN_ADMIN>`; responde 403 sin TOKEN_ADMIN
+    configurado o con un token incorrecto.
+    '''
+    token = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    if not configuracion.token_admin or not hmac.compare_digest(token.encode(), configuracion.token_admin.encode()):
+        raise HTTPException(status_code=403, detail=f"{accion} no autorizada")
+
+
+@app.get("/admin/instantanea", tags=["Operación"])
+def estado_instantanea():
+    '''
+    Devuelve la instantánea de datos vigente (número, versión, directorio y datasets y
+    modelos disponibles), las reemplazadas que siguen en memoria, el estado de la última
+    recarga y las versiones del directorio de instantáneas.
+    '''
+    return gestor.estado()
+
+
+@app.post("/admin/recargar", tags=["Operación"], status_code=202)
+def recargar_instantanea(request: Request, pedido: PedidoRecarga = None):
+    '''
+    Carga en segundo plano una instantánea nueva de los datos y los modelos y la publica si
+    pasa la validación, sin cortar las consultas en curso (ver instantaneas.py). Requiere
+    el encabezado `Authorization: Bearer <TOKEN_ADMIN>`.
+
+    Datos:
+    - version (str): Versión del directorio de instantáneas a cargar, que queda fijada (el
+      vigilante no pasa a versiones nuevas). Sin versión se deja de fijar y se carga la
+      última (o, sin directorio de instantáneas, los archivos actuales).
+
+    Respuestas:
+    - 202 Accepted: La recarga empezó; su avance se consulta en /admin/instantanea.
+    - 403 Forbidden: Sin TOKEN_ADMIN configurado o con un token incorrecto.
+    - 404 Not Found: La versión no existe.
+    - 409 Conflict: Ya hay una recarga en curso.
+    '''
+    _autorizar_admin(request, "Recarga")
+
+    raiz = None
+    if pedido is not None and pedido.version is not None:
+        # Solo se aceptan nombres de versiones publicadas, no rutas arbitrarias
+        if pedido.version not in versiones():
+            raise HTTPException(status_code=404, detail=f"No existe la versión {pedido.version}")
+        raiz = os.path.join(configuracion.directorio_instantaneas, pedido.version)
+    if not gestor.recargar(raiz):
+        raise HTTPException(status_code=409, detail="Ya hay una recarga en curso")
+    return gestor.estado()
+
+
+
+async def _respuesta_tabular(request, calcular, *args):
+    '''
+    Si el pedido acepta NDJSON o Arrow (ver formatos.py), calcula en el pool de consultas la
+    tabla completa detrás de la respuesta del endpoint y la devuelve en ese formato. Las
+    tablas no se precalculan, así que no se usan los agregados.
+
+    Returns:
+    - StreamingResponse or None: La respuesta, o None si el pedido es JSON.
+    '''
+    formato = formatos.negociar(request.headers.get("accept"))
+    if formato == 'json':
+        return None
+    tabla = await ejecucion.ejecutar('consultas', calcular, *args)
+    return formatos.respuesta([tabla], formato)
+
+
+@app.get('/PlayTimeGenre/{genero}')
+async def PlayTimeGenre(request: Request, genero: str, operador: str = Query('y', pattern='^[yo]$')):
+    '''
+    Datos:
+    - genero (str): Género para el cual se busca el año con más horas jugadas. Se pueden indicar varios separados por coma.
+    - operador (str): Con varios géneros, 'y' busca los juegos con todos ellos y 'o' los juegos con alguno.
+
+    Funcionalidad:
+    - Devuelve el año con más horas jugadas para el género especificado.
+
+    Return:
+    - Dict: {"Año de lanzamiento con más horas jugadas para Género X": int}
+    - Con Accept NDJSON o Arrow: las horas jugadas de cada año (Año, Horas).
+    '''
+    instantanea = gestor.actual
+    try:
+        generos = dividir_generos(genero)
+        tabular = await _respuesta_tabular(request, consultas.tabla_play_time_genre, instantanea.almacen.fragmentos('PlayTimeGenre'), generos, operador)
+        if tabular is not None:
+            return tabular
+        encontrado, max_hours_year = instantanea.buscar('PlayTimeGenre', genero) if len(generos) == 1 else (False, None)
+        if not encontrado:
+            max_hours_year = await ejecucion.ejecutar('consultas', consultas.play_time_genre, instantanea.almacen.fragmentos('PlayTimeGenre'), generos, operador)
+
+        if max_hours_year is None:
+            raise HTTPException(status_code=404, detail=f"No hay datos para el género {genero}")
+
+        return {"Año de lanzamiento con más horas jugadas para el Género " + genero: max_hours_year}
+
+    except (ejecucion.Saturado, ejecucion.TiempoAgotado, HTTPException):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get('/UserForGenre/{genero}')
+async def UserForGenre(request: Request, genero:str, operador: str = Query('y', pattern='^[yo]$')):
+    '''
+    Datos:
+    - genero (str): Género para el cual se busca el usuario con más horas jugadas y la acumulación de horas por año. Se pueden indicar varios separados por coma.
+    - operador (str): Con varios géneros, 'y' busca los juegos con todos ellos y 'o' los juegos con alguno.
+
+    Funcionalidad:
+    - Devuelve el usuario con más horas jugadas y una lista de la acumulación de horas jugadas por año para el género especificado.
+
+    Return:
+    - Dict: {"Usuario con más horas jugadas para Género X": List, "Horas jugadas": List}
+    - Con Accept NDJSON o Arrow: las horas de cada usuario y año, de mayor a menor (user_id, Año, Horas).
+    '''
+    instantanea = gestor.actual
+    try:
+        generos = dividir_generos(genero)
+        tabular = await _respuesta_tabular(request, consultas.tabla_user_for_genre, instantanea.almacen.fragmentos('UserForGenre'), generos, operador)
+        if tabular is not None:
+            return tabular
+        encontrado, respuesta = instantanea.buscar('UserForGenre', genero) if len(generos) == 1 else (False, None)
+        if not encontrado:
+            respuesta = await ejecucion.ejecutar('consultas', consultas.user_for_genre, instantanea.almacen.fragmentos('UserForGenre'), generos, operador)
+
+        if respuesta is None:
+            raise HTTPException(status_code=404, detail=f"No hay datos para el género {genero}")
+
+        resultado = {
+            "Usuario con más horas jugadas para " + genero: respuesta["usuario"],
+            "Horas jugadas": respuesta["horas"]
+        }
+
+        return resultado
+        
+
+    except (ejecucion.Saturado, ejecucion.TiempoAgotado, HTTPException):
+        raise
+    except FileNotFoundError:
+        raise HTTPException(status_code=500, detail="Error al cargar los archivos de datos")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def _top_en_vivo(instantanea, endpoint, anio):
+    '''
+    Top 3 de un año sumando las reseñas ingeridas (ver ingesta.py), o None si no hay
+    reseñas ingeridas de ese año. Sin el cubo, el ranking de la instantánea con el que se
+    suman se calcula en el pool de consultas.
+    '''
+    if endpoint in instantanea.cubo.disponibles() or not resenas.conteos(endpoint, anio, anio):
+        return resenas.top(instantanea.cubo, endpoint, anio, anio)
+    calcular = {'UsersRecommend': consultas.tabla_users_recommend, 'UsersNotRecommend': consultas.tabla_users_not_recommend}[endpoint]
+    ranking = await ejecucion.ejecutar('consultas', calcular, instantanea.almacen, anio)
+    return resenas.top(instantanea.cubo, endpoint, anio, anio, ranking=ranking)
+
+
+@app.get('/UsersRecommend/{anio}')
+async def UsersRecommend(request: Request, anio: int):
+    '''
+    Datos:
+    - anio (int): Año para el cual se busca el top 3 de juegos más recomendados.
+
+    Funcionalidad:
+    - Devuelve el top 3 de juegos más recomendados por usuarios para el año dado.
+
+    Return:
+    - List: [{"Puesto 1": str}, {"Puesto 2": str}, {"Puesto 3": str}]
+    - Con Accept NDJSON o Arrow: todos los juegos con su cantidad de reseñas, de mayor a menor (title, count).
+    '''
+    instantanea = gestor.actual
+    try:
+        tabular = await _respuesta_tabular(request, consultas.tabla_users_recommend, instantanea.almacen, anio)
+        if tabular is not None:
+            return tabular
+        en_vivo = await _top_en_vivo(instantanea, 'UsersRecommend', anio)
+        if en_vivo is not None:
+            return en_vivo
+        encontrado, top_3_dict = instantanea.buscar('UsersRecommend', anio)
+        if not encontrado:
+            top_3_dict = await ejecucion.ejecutar('consultas', consultas.users_recommend, instantanea.almacen, anio)
+        return top_3_dict
+    except (ejecucion.Saturado, ejecucion.TiempoAgotado, HTTPException):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Error al obtener los juegos mas recomendados.")
+
+@app.get('/UsersNotRecommend/{anio}')
+async def UsersNotRecommend(request: Request, anio: int):
+    '''
+    Datos:
+    - anio (int): Año para el cual se busca el top 3 de juegos menos recomendados.
+
+    Funcionalidad:
+    - Devuelve el top 3 de juegos menos recomendados por usuarios para el año dado.
+
+    Return:
+    - List: [{"Puesto 1": str}, {"Puesto 2": str}, {"Puesto 3": str}]
+    - Con Accept NDJSON o Arrow: todos los juegos con su cantidad de reseñas, de mayor a menor (title, count).
+    '''
+    instantanea = gestor.actual
+    try:
+        tabular = await _respuesta_tabular(request, consultas.tabla_users_not_recommend, instantanea.almacen, anio)
+        if tabular is not None:
+            return tabular
+        en_vivo = await _top_en_vivo(instantanea, 'UsersNotRecommend', anio)
+        if en_vivo is not None:
+            return en_vivo
+        encontrado, top_3_dict = instantanea.buscar('UsersNotRecommend', anio)
+        if not encontrado:
+            top_3_dict = await ejecucion.ejecutar('consultas', consultas.users_not_recommend, instantanea.almacen, anio)
+        return top_3_dict
+    except (ejecucion.Saturado, ejecucion.TiempoAgotado, HTTPException):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Error al obtener los juegos menos recomendados.")
+    
+@app.get('/sentiment_analysis/{anio}')
+async def sentiment_analysis(request: Request, anio: int):
+
+    '''
+    Según el año de lanzamiento, se devuelve una lista con la cantidad de registros de reseñas de usuarios que se encuentren categorizados con un análisis de sentimiento.
+
+    Args:
+        año (int): Año para el cual se busca el análisis de sentimiento.
+
+    Returns:
+        dict: Diccionario con la cantidad de reseñas por sentimiento.
+        Con Accept NDJSON o Arrow: una fila por sentimiento (sentimiento, count).
+    '''
+  
+    instantanea = gestor.actual
+    try:
+        tabular = await _respuesta_tabular(request, consultas.tabla_sentiment_analysis, instantanea.almacen, anio)
+        if tabular is not None:
+            return tabular
+        encontrado, sentiment_counts_mapped = instantanea.buscar('sentiment_analysis', anio)
+        if not encontrado:
+            sentiment_counts_mapped = await ejecucion.ejecutar('consultas', consultas.sentiment_analysis, instantanea.almacen, anio)
+
+        return sentiment_counts_mapped
+    except (ejecucion.Saturado, ejecucion.TiempoAgotado, HTTPException):
+        raise
+    except pd.errors.EmptyDataError:
+        raise HTTPException(status_code=404, detail=f"No hay datos para el año {anio}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+
+
+def _respuesta_recomendacion(recommendations_list, num_recommendations):
+    recommendations_list = list(recommendations_list)
+    if len(recommendations_list) < num_recommendations:
+        message = f"Se encontraron {len(recommendations_list)} recomendaciones para este ID."
+        recommendations_list += [None] * (num_recommendations - len(recommendations_list))
+    else:
+        message = None
+
+    return {"recomendaciones": recommendations_list, "message": message}
+
+
+@app.get('/Recomendacion_Juego/{id_producto}')
+async def recomendacion_juego(id_producto: int = Path(..., description="ID del juego para obtener recomendaciones")):
+    '''
+    Endpoint para obtener una lista de juegos recomendados similares a un juego dado.
+
+    Parámetros:
+    - id_juego (int): ID del juego para el cual se desean obtener recomendaciones.
+
+    Respuestas:
+    - 200 OK: Retorna una lista con 5 juegos recomendados similares al juego ingresado.
+    - 404 Not Found: Si no se encuentra el juego con el ID especificado.
+    - 500 Internal Server Error: En caso de cualquier otro error, proporciona detalles de la excepción.
+
+    Ejemplo de Uso:
+    - /RecomendarJuego/123
+
+    Ejemplo de Respuesta Exitosa:
+    [
+        {"id": 456, "nombre": "Juego A"},
+        {"id": 789, "nombre": "Juego B"},
+        {"id": 101, "nombre": "Juego C"},
+        {"id": 202, "nombre": "Juego D"},
+        {"id": 303, "nombre": "Juego E"}
+    ]
+    '''
+    modelo_recomendacion = gestor.actual.modelo_recomendacion
+    try:
+        if modelo_recomendacion is None:
+            raise FileNotFoundError("El modelo de recomendación no está disponible")
+
+        num_recommendations = 5
+
+        recommendations_list = await ejecucion.ejecutar('recomendacion', modelo_recomendacion.recomendar, id_producto, num_recommendations)
+
+        if recommendations_list is None:
+            raise HTTPException(status_code=404, detail=f"No se encontró el juego con ID {id_producto}")
+
+        return _respuesta_recomendacion(recommendations_list, num_recommendations)
+
+    except (ejecucion.Saturado, ejecucion.TiempoAgotado, HTTPException):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}") from e
+
+@app.get('/Recomendacion_Usuario/{id_usuario}')
+async def recomendacion_usuario(id_usuario: str = Path(..., description="ID del usuario para obtener recomendaciones")):
+    '''
+    Endpoint para obtener juegos recomendados para un usuario, según las horas jugadas y
+    las reseñas de los usuarios con gustos parecidos.
+
+    Parámetros:
+    - id_usuario (str): ID del usuario.
+
+    Respuestas:
+    - 200 OK: Retorna una lista con 5 juegos que el usuario todavía no tiene.
+    - 404 Not Found: Si el usuario no está en el modelo.
+    - 500 Internal Server Error: Si el modelo no está disponible o en caso de cualquier otro error.
+
+    Ejemplo de Uso:
+    - /Recomendacion_Usuario/76561197970982479
+    '''
+    modelo_usuarios = gestor.actual.modelo_usuarios
+    try:
+        if modelo_usuarios is None:
+            raise FileNotFoundError("El modelo de recomendación por usuario no está disponible")
+
+        num_recommendations = 5
+
+        recommendations_list = await ejecucion.ejecutar('recomendacion', modelo_usuarios.recomendar, id_usuario, num_recommendations)
+
+        if recommendations_list is None:
+            raise HTTPException(status_code=404, detail=f"No se encontró el usuario {id_usuario}")
+
+        return _respuesta_recomendacion(recommendations_list, num_recommendations)
+
+    except (ejecucion.Saturado, ejecucion.TiempoAgotado, HTTPException):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}") from e
+
+@app.get('/filas/{dataset}', tags=["Datos"])
+async def filas(request: Request, dataset: str, anio: int = None, genero: str = None,
+                operador: str = Query('y', pattern='^[yo]$')):
+    '''
+    Devuelve las filas de un dataset sin agregar (PlayTimeGenre, UserForGenre, UsersRecommend
+    o sentiment_analysis), opcionalmente de un año y de uno o varios géneros.
+
+    Según el encabezado Accept responde un arreglo JSON, NDJSON (application/x-ndjson) o
+    Arrow IPC (application/vnd.apache.arrow.stream), enviado por partes a medida que se leen
+    los datos.
+    '''
+    try:
+        tablas = gestor.actual.almacen.filas(dataset, anio, dividir_generos(genero) if genero else None, operador)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return formatos.respuesta(tablas, formatos.negociar(request.headers.get("accept")))
+
+
+# Consultas por lote: una sola pasada por los datos para todas las claves pedidas
+
+class LoteGeneros(BaseModel):
+    generos: List[str]
+    operador: str = 'y'
+
+
+class LoteAnios(BaseModel):
+    anios: List[int]
+
+
+class LoteJuegos(BaseModel):
+    item_ids: List[int]
+
+
+def _validar_lote(claves):
+    if not claves:
+        raise HTTPException(status_code=422, detail="El lote está vacío")
+    if len(claves) > configuracion.max_elementos_lote:
+        raise HTTPException(status_code=422, detail=f"El lote supera el máximo de {configuracion.max_elementos_lote} elementos")
+    # Se conserva el orden de las claves y se descartan las repetidas
+    return list(dict.fromkeys(claves))
+
+
+async def _resolver_lote(instantanea, endpoint, claves, calcular, precalculada=lambda clave: True):
+    '''
+    Responde desde el cubo o los agregados de la instantánea las claves que cubren y
+    calcula el resto en una sola llamada de calcular(pendientes), en el pool de consultas.
+    '''
+    respuestas = {}
+    pendientes = []
+    for clave in claves:
+        encontrado, respuesta = instantanea.buscar(endpoint, clave) if precalculada(clave) else (False, None)
+        if encontrado:
+            respuestas[clave] = respuesta
+        else:
+            pendientes.append(clave)
+    if pendientes:
+        respuestas.update(await ejecucion.ejecutar('consultas', calcular, pendientes))
+    return {clave: respuestas[clave] for clave in claves}
+
+
+async def _con_resenas_en_vivo(instantanea, endpoint, respuestas):
+    '''
+    Reemplaza el top 3 de los años con reseñas ingeridas por el que las suma (ver ingesta.py).
+    '''
+    for anio in respuestas:
+        en_vivo = await _top_en_vivo(instantanea, endpoint, anio)
+        if en_vivo is not None:
+            respuestas[anio] = en_vivo
+    return respuestas
+
+
+async def _lote_generos(endpoint, lote, calcular):
+    generos = _validar_lote(lote.generos)
+    if lote.operador not in OPERADORES:
+        raise HTTPException(status_code=422, detail="El operador debe ser 'y' u 'o'")
+    instantanea = gestor.actual
+    # El cubo y los agregados solo tienen las consultas de un género
+    return await _resolver_lote(instantanea, endpoint, generos,
+                                lambda pendientes: calcular(instantanea.almacen.fragmentos(endpoint), pendientes, lote.operador),
+                                lambda genero: len(dividir_generos(genero)) == 1)
+
+
+@app.post('/lote/PlayTimeGenre', tags=["Consultas por lote"])
+async def lote_play_time_genre(lote: LoteGeneros):
+    '''
+    Devuelve el año con más horas jugadas para cada género de la lista (None si no hay datos).
+    '''
+    return await _lote_generos('PlayTimeGenre', lote, consultas.play_time_genre_lote)
+
+
+@app.post('/lote/UserForGenre', tags=["Consultas por lote"])
+async def lote_user_for_genre(lote: LoteGeneros):
+    '''
+    Devuelve, para cada género de la lista, el usuario con más horas jugadas y la acumulación
+    de horas por año (None si no hay datos).
+    '''
+    return await _lote_generos('UserForGenre', lote, consultas.user_for_genre_lote)
+
+
+@app.post('/lote/UsersRecommend', tags=["Consultas por lote"])
+async def lote_users_recommend(lote: LoteAnios):
+    '''
+    Devuelve el top 3 de juegos más recomendados para cada año de la lista.
+    '''
+    instantanea = gestor.actual
+    respuestas = await _resolver_lote(instantanea, 'UsersRecommend', _validar_lote(lote.anios),
+                                      lambda anios: consultas.users_recommend_lote(instantanea.almacen, anios))
+    return await _con_resenas_en_vivo(instantanea, 'UsersRecommend', respuestas)
+
+
+@app.post('/lote/UsersNotRecommend', tags=["Consultas por lote"])
+async def lote_users_not_recommend(lote: LoteAnios):
+    '''
+    Devuelve el top 3 de juegos menos recomendados para cada año de la lista.
+    '''
+    instantanea = gestor.actual
+    respuestas = await _resolver_lote(instantanea, 'UsersNotRecommend', _validar_lote(lote.anios),
+                                      lambda anios: consultas.users_not_recommend_lote(instantanea.almacen, anios))
+    return await _con_resenas_en_vivo(instantanea, 'UsersNotRecommend', respuestas)
+
+
+@app.post('/lote/sentiment_analysis', tags=["Consultas por lote"])
+async def lote_sentiment_analysis(lote: LoteAnios):
+    '''
+    Devuelve la cantidad de reseñas por sentimiento para cada año de lanzamiento de la lista.
+    '''
+    instantanea = gestor.actual
+    return await _resolver_lote(instantanea, 'sentiment_analysis', _validar_lote(lote.anios),
+                                lambda anios: consultas.sentiment_analysis_lote(instantanea.almacen, anios))
+
+
+@app.post('/lote/Recomendacion_Juego', tags=["Consultas por lote"])
+async def lote_recomendacion_juego(lote: LoteJuegos):
+    '''
+    Devuelve 5 juegos recomendados para cada ID de la lista, calculados con un único producto
+    de matrices dispersas. Los IDs que no están en el modelo devuelven None.
+    '''
+    item_ids = _validar_lote(lote.item_ids)
+    modelo_recomendacion = gestor.actual.modelo_recomendacion
+    if modelo_recomendacion is None:
+        raise HTTPException(status_code=500, detail="El modelo de recomendación no está disponible")
+    num_recommendations = 5
+    recomendaciones = await ejecucion.ejecutar('recomendacion', modelo_recomendacion.recomendar_lote, item_ids, num_recommendations)
+    return {item_id: None if lista is None else _respuesta_recomendacion(lista, num_recommendations)
+            for item_id, lista in recomendaciones.items()}
+
+
+
+
+# Consultas por intervalo de años: se responden con las sumas acumuladas del cubo (ver cubo.py)
+
+def _cubo_intervalo(endpoint, desde, hasta):
+    if desde is not None and hasta is not None and desde > hasta:
+        raise HTTPException(status_code=422, detail="'desde' no puede ser mayor que 'hasta'")
+    cubo = gestor.actual.cubo
+    if endpoint not in cubo.disponibles():
+        raise HTTPException(status_code=404, detail=f"No hay datos de {endpoint}")
+    return cubo
+
+
+@app.get('/rango/PlayTimeGenre/{genero}', tags=["Consultas por intervalo de años"])
+async def rango_play_time_genre(genero: str, desde: Optional[int] = None, hasta: Optional[int] = None):
+    '''
+    Devuelve las horas jugadas de un género entre dos años de lanzamiento (incluidos; sin
+    'desde' o 'hasta' el intervalo queda abierto) y el año con más horas del intervalo.
+    '''
+    cubo = _cubo_intervalo('PlayTimeGenre', desde, hasta)
+    generos = dividir_generos(genero)
+    if len(generos) != 1:
+        raise HTTPException(status_code=422, detail="El intervalo de años admite un solo género")
+    resultado = cubo.horas_genero(generos[0], desde, hasta)
+    if resultado is None:
+        raise HTTPException(status_code=404, detail=f"No hay datos para el género {genero} en el intervalo")
+    return {
+        "Género": genero,
+        "Desde": desde,
+        "Hasta": hasta,
+        "Horas jugadas": resultado["horas"],
+        "Año de lanzamiento con más horas jugadas": resultado["anio_max"],
+    }
+
+
+@app.get('/rango/UsersRecommend', tags=["Consultas por intervalo de años"])
+async def rango_users_recommend(desde: Optional[int] = None, hasta: Optional[int] = None):
+    '''
+    Devuelve el top 3 de juegos más recomendados entre dos años de publicación (incluidos),
+    con las reseñas ingeridas en vivo.
+    '''
+    cubo = _cubo_intervalo('UsersRecommend', desde, hasta)
+    en_vivo = resenas.top(cubo, 'UsersRecommend', desde, hasta)
+    return cubo.top_titulos('UsersRecommend', desde, hasta) if en_vivo is None else en_vivo
+
+
+@app.get('/rango/UsersNotRecommend', tags=["Consultas por intervalo de años"])
+async def rango_users_not_recommend(desde: Optional[int] = None, hasta: Optional[int] = None):
+    '''
+    Devuelve el top 3 de juegos menos recomendados entre dos años de publicación (incluidos),
+    con las reseñas ingeridas en vivo.
+    '''
+    cubo = _cubo_intervalo('UsersNotRecommend', desde, hasta)
+    en_vivo = resenas.top(cubo, 'UsersNotRecommend', desde, hasta)
+    return cubo.top_titulos('UsersNotRecommend', desde, hasta) if en_vivo is None else en_vivo
+
+
+@app.get('/rango/sentiment_analysis', tags=["Consultas por intervalo de años"])
+async def rango_sentiment_analysis(desde: Optional[int] = None, hasta: Optional[int] = None):
+    '''
+    Devuelve la cantidad de reseñas por sentimiento entre dos años de lanzamiento (incluidos).
+    '''
+    return _cubo_intervalo('sentiment_analysis', desde, hasta).sentiment_analysis(desde, hasta)
+
+
+
+
+# Ingesta de reseñas en vivo (ver ingesta.py)
+
+class ResenaNueva(BaseModel):
+    title: str = Field(..., min_length=1, max_length=500)
+    reviews_posted: int = Field(..., ge=1970, le=2100, description="Año de publicación de la reseña")
+    reviews_recommend: bool
+    reviews_review: Optional[str] = Field(None, max_length=20000)
+    item_id: Optional[int] = Field(None, ge=0, le=2 ** 31 - 1)
+
+
+class LoteResenas(BaseModel):
+    resenas: List[ResenaNueva]
+
+
+@app.post('/ingesta/resenas', tags=["Ingesta"])
+async def ingesta_resenas(request: Request, lote: LoteResenas):
+    '''
+    Suma un lote de reseñas nuevas a los rankings de UsersRecommend y UsersNotRecommend
+    (por año, por lote y por intervalo de años), sin recargar los datos. Requiere el
+    encabezado `Authorization: Bearer <TOKEN_ADMIN>`.
+
+    Cada reseña se etiqueta con el análisis de sentimiento del ETL y cuenta como
+    recomendada (recomienda el juego, sentimiento neutro o positivo), no recomendada (no lo
+    recomienda, sentimiento negativo) o en ninguno de los dos rankings.
+
+    Respuestas:
+    - 200 OK: Reseñas recibidas, contadas en cada ranking y por sentimiento.
+    - 403 Forbidden: Sin TOKEN_ADMIN configurado o con un token incorrecto.
+    - 422 Unprocessable Entity: Lote vacío, con más de MAX_RESENAS_INGESTA reseñas o con
+      reseñas inválidas.
+    '''
+    _autorizar_admin(request, "Ingesta")
+    if not lote.resenas:
+        raise HTTPException(status_code=422, detail="El lote está vacío")
+    if len(lote.resenas) > configuracion.max_resenas_ingesta:
+        raise HTTPException(status_code=422, detail=f"El lote supera el máximo de {configuracion.max_resenas_ingesta} reseñas")
+    return await ejecucion.ejecutar('ingesta', resenas.ingerir, [dict(resena) for resena in lote.resenas])
+
+
+@app.get('/ingesta', tags=["Ingesta"])
+def estado_ingesta():
+    '''
+    Devuelve las reseñas ingeridas, descartadas y pendientes de compactar, las
+    compactaciones a Parquet y los años y títulos seguidos en cada ranking.
+    '''
+    return resenas.estado()
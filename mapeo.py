@@ -0,0 +1,176 @@
+'''
+Carga de los datasets desde archivos mapeados en memoria.
+
+Con varios workers de uvicorn cada proceso lee y descomprime los Parquet y arma sus
+propias copias de los DataFrames y de los índices de géneros, de modo que la memoria
+crece con la cantidad de workers. La exportación
+
+    python mapeo.py
+
+guarda lo que la API carga en el modo de consulta configurado (la muestra en 'muestra',
+los datasets completos en 'exacto') en archivos sin comprimir:
+
+- un archivo Arrow IPC por dataset; las columnas categóricas se guardan como
+  diccionarios cuyos índices tienen el mismo ancho que los códigos de pandas;
+- los índices de géneros como arreglos .npy (posiciones de todos los géneros
+  concatenadas, con sus offsets, y un bitmap por género).
+
+Con CARGA_DATOS=mmap la API abre esos archivos con mmap de solo lectura: las tablas
+Arrow, las columnas numéricas y categóricas de los DataFrames y los índices apuntan a
+las páginas del archivo, que el sistema operativo comparte entre todos los procesos.
+Iniciar un worker no descomprime nada y cada worker adicional casi no suma memoria
+residente propia. El modelo de recomendación también mapea su matriz (ver
+ModeloRecomendacion.cargar).
+
+En modo 'exacto' los datasets mapeados se consultan completos, como un único fragmento,
+en lugar de recorrerse row group por row group desde los Parquet.
+'''
+
+import json
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import configuracion
+import datos
+from agregados import huella_archivos
+from indice_generos import IndiceGeneros
+
+
+logger = logging.getLogger(__name__)
+
+
+def directorio_modo(directorio=None, modo=None):
+    return os.path.join(directorio or configuracion.directorio_mmap, modo or configuracion.modo_consulta)
+
+
+def _completo(nombre, raiz):
+    '''
+    Dataset completo de un dataset que el almacén recorre desde disco.
+    '''
+    partes = list(datos.leer_row_groups(nombre, raiz))
+    if isinstance(partes[0], pa.Table):
+        # Un archivo IPC usa un único diccionario por columna
+        return pa.concat_tables(partes).unify_dictionaries()
+    df = pd.concat(partes, ignore_index=True)
+    # Al concatenar partes con categorías distintas las columnas dejan de ser categóricas
+    for columna in ('genres', 'user_id'):
+        if columna in df and df[columna].dtype != 'category':
+            df[columna] = df[columna].astype('category')
+    return df
+
+
+def _escribir_ipc(tabla, ruta):
+    temporal = ruta + '.tmp'
+    with pa.OSFile(temporal, 'wb') as f:
+        with pa.ipc.new_file(f, tabla.schema) as writer:
+            writer.write_table(tabla)
+    os.replace(temporal, ruta)
+
+
+def _guardar_indice(indice, prefijo):
+    generos = indice.generos
+    longitudes = [len(indice.posiciones[g]) for g in generos]
+    offsets = np.concatenate([[0], np.cumsum(longitudes)]).astype(np.int64)
+    posiciones = np.concatenate([indice.posiciones[g] for g in generos]) if generos else np.empty(0, np.int32)
+    bitmaps = np.stack([indice.bitmaps[g] for g in generos]) if generos else np.empty((0, 0), np.uint8)
+    np.save(prefijo + '.offsets.npy', offsets)
+    np.save(prefijo + '.posiciones.npy', posiciones.astype(np.int32))
+    np.save(prefijo + '.bitmaps.npy', bitmaps)
+    return {"num_filas": indice.num_filas, "generos": generos}
+
+
+def exportar(almacen, directorio=None):
+    '''
+    Guarda los datasets del almacén (y sus índices de géneros) para cargarlos con mmap.
+
+    Parameters:
+    - almacen (AlmacenDatos): Almacén con los datasets cargados.
+    - directorio (str): Directorio de salida, por defecto el del modo del almacén dentro
+      de configuracion.directorio_mmap (en la raíz del almacén).
+
+    Returns:
+    - dict: Tamaño en bytes de cada archivo escrito.
+    '''
+    directorio = directorio or directorio_modo(os.path.join(almacen.raiz, configuracion.directorio_mmap), almacen.modo)
+    os.makedirs(directorio, exist_ok=True)
+    contenido = {"fuentes": huella_archivos(configuracion.rutas_datasets, almacen.raiz), "datasets": {}}
+
+    for nombre in sorted(set(almacen.datasets) | almacen.en_disco):
+        if nombre in almacen.datasets:
+            dataset, indice = almacen.datasets[nombre], almacen.indices.get(nombre)
+        else:
+            dataset = _completo(nombre, almacen.raiz)
+            indice = IndiceGeneros(dataset['genres']) if isinstance(dataset, pd.DataFrame) and 'genres' in dataset else None
+
+        es_tabla = isinstance(dataset, pa.Table)
+        # Las categorías pasan a diccionarios con índices del ancho de los códigos de pandas
+        tabla = dataset if es_tabla else pa.Table.from_pandas(dataset, preserve_index=False)
+        _escribir_ipc(tabla, os.path.join(directorio, f'{nombre}.arrow'))
+        descripcion = {"tipo": "arrow" if es_tabla else "pandas"}
+        if indice is not None:
+            descripcion["indice"] = _guardar_indice(indice, os.path.join(directorio, nombre))
+        contenido["datasets"][nombre] = descripcion
+
+    # La descripción se escribe al final: sin ella el directorio no se usa
+    with open(os.path.join(directorio, 'datasets.json'), 'w', encoding='utf-8') as f:
+        json.dump(contenido, f, ensure_ascii=False)
+    return {archivo: os.path.getsize(os.path.join(directorio, archivo)) for archivo in sorted(os.listdir(directorio))}
+
+
+def cargar(almacen, nombres=None, directorio=None):
+    '''
+    Carga en el almacén los datasets exportados, mapeados en memoria.
+
+    Parameters:
+    - almacen (AlmacenDatos): Almacén a completar.
+    - nombres (list): Datasets a cargar, por defecto todos los exportados.
+    - directorio (str): Directorio exportado, por defecto el del modo del almacén (en su raíz).
+
+    Returns:
+    - bool: False si no hay una exportación que corresponda a los datos actuales.
+    '''
+    directorio = directorio or directorio_modo(os.path.join(almacen.raiz, configuracion.directorio_mmap), almacen.modo)
+    ruta = os.path.join(directorio, 'datasets.json')
+    if not os.path.exists(ruta):
+        logger.info("No hay datasets exportados para mmap en %s", directorio)
+        return False
+    with open(ruta, encoding='utf-8') as f:
+        contenido = json.load(f)
+    if contenido["fuentes"] != huella_archivos(configuracion.rutas_datasets, almacen.raiz):
+        logger.warning("Los datasets de %s no corresponden a los datos actuales, se ignoran", directorio)
+        return False
+
+    for nombre, descripcion in contenido["datasets"].items():
+        if nombres is not None and nombre not in nombres:
+            continue
+        tabla = pa.ipc.open_file(pa.memory_map(os.path.join(directorio, f'{nombre}.arrow'))).read_all()
+        # split_blocks evita consolidar las columnas en bloques: cada una queda como vista del archivo
+        almacen.datasets[nombre] = tabla if descripcion["tipo"] == "arrow" else tabla.to_pandas(split_blocks=True)
+        if "indice" in descripcion:
+            prefijo = os.path.join(directorio, nombre)
+            almacen.indices[nombre] = IndiceGeneros.desde_arreglos(
+                descripcion["indice"]["num_filas"], descripcion["indice"]["generos"],
+                np.load(prefijo + '.offsets.npy'),
+                np.load(prefijo + '.posiciones.npy', mmap_mode='r'),
+                np.load(prefijo + '.bitmaps.npy', mmap_mode='r'),
+            )
+        logger.info("Dataset %s mapeado desde %s: %d filas", nombre, directorio, len(almacen.datasets[nombre]))
+    return True
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    inicio = time.perf_counter()
+    # La exportación siempre parte de los archivos fuente
+    configuracion.carga_datos = 'parquet'
+    almacen = datos.AlmacenDatos()
+    almacen.cargar()
+    tamanos = exportar(almacen)
+    logger.info("Datasets exportados para mmap en %s (%.1f s)", directorio_modo(modo=almacen.modo), time.perf_counter() - inicio)
+    for archivo, tamano in tamanos.items():
+        logger.info("  %s: %.1f MB", archivo, tamano / 2**20)
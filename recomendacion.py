@@ -0,0 +1,429 @@
+'''
+Modelo de recomendación item-item persistido en disco.
+
+El entrenamiento se ejecuta offline con:
+
+    python recomendacion.py
+
+Ajusta el TfidfVectorizer una sola vez sobre el texto título + géneros (más las columnas
+de configuracion.columnas_texto_recomendacion) de todo el catálogo, normaliza la matriz
+dispersa (L2) y precalcula los juegos más similares de cada item_id con el buscador
+configurado (exacto, LSH o particionado, ver similitud.py). Guarda el vectorizador, la matriz y la
+tabla de vecinos en configuracion.directorio_modelo, de modo que el endpoint solo tenga
+que buscar la respuesta. Con --muestra se entrena sobre la muestra del modo 'muestra'.
+'''
+
+import argparse
+import json
+import logging
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+import configuracion
+from agregados import huella_archivos
+from datos import AlmacenDatos
+from ejecucion import verificar_cancelacion
+from instrumentacion import tramo
+from similitud import crear_buscador
+
+
+logger = logging.getLogger(__name__)
+
+# Arreglos de la matriz CSR guardados también como .npy
+COMPONENTES_MATRIZ = ('data', 'indices', 'indptr')
+
+
+def _huella_modelo(raiz=''):
+    huella = huella_archivos([configuracion.parquet_file_path5], raiz)
+    # Un modelo entrenado con otras columnas de texto no corresponde a la configuración actual
+    if configuracion.columnas_texto_recomendacion:
+        huella["columnas_texto"] = configuracion.columnas_texto_recomendacion
+    return huella
+
+
+def _mapear_matriz(directorio, num_terminos):
+    '''
+    Matriz CSR armada sobre los arreglos .npy mapeados en memoria, o None si el modelo
+    se guardó antes de que existieran.
+    '''
+    rutas = [os.path.join(directorio, f'matriz_{componente}.npy') for componente in COMPONENTES_MATRIZ]
+    if not all(os.path.exists(ruta) for ruta in rutas):
+        return None
+    data, indices, indptr = (np.load(ruta, mmap_mode='r') for ruta in rutas)
+    # copy=False: la matriz usa los arreglos mapeados sin copiarlos
+    return sp.csr_matrix((data, indices, indptr), shape=(len(indptr) - 1, num_terminos), copy=False)
+
+
+def _ordenar_candidatos(scores, item_ids, titulos, excluir, n):
+    '''
+    Elige los n juegos más similares sin repetir títulos y sin incluir el juego consultado.
+
+    Parameters:
+    - scores (np.ndarray): Similitud de la consulta con cada juego.
+    - item_ids (np.ndarray): item_id de cada juego.
+    - titulos (np.ndarray): Título de cada juego.
+    - excluir (int): item_id del juego consultado.
+    - n (int): Cantidad de recomendaciones.
+
+    Returns:
+    - list: Tuplas (item_id, título, score) ordenadas por similitud.
+    '''
+    # Se ordena solo una porción de los candidatos; si los duplicados la agotan se amplía
+    m = min(len(scores), 4 * n + 1)
+    while True:
+        if m < len(scores):
+            candidatos = np.argpartition(-scores, m)[:m]
+        else:
+            candidatos = np.arange(len(scores))
+        candidatos = candidatos[np.argsort(-scores[candidatos], kind='stable')]
+
+        elegidos = []
+        vistos = set()
+        for i in candidatos:
+            if item_ids[i] == excluir or titulos[i] in vistos:
+                continue
+            vistos.add(titulos[i])
+            elegidos.append((int(item_ids[i]), titulos[i], float(scores[i])))
+            if len(elegidos) == n:
+                return elegidos
+        if m >= len(scores):
+            return elegidos
+        m = min(len(scores), m * 4)
+
+
+class ModeloRecomendacion:
+    '''
+    Vectorizador TF-IDF, matriz normalizada de juegos y tabla de vecinos precalculada.
+    '''
+
+    def __init__(self, vectorizador, matriz, juegos, vecinos=None):
+        self.vectorizador = vectorizador
+        self.matriz = matriz
+        self.juegos = juegos.reset_index(drop=True)
+        self.vecinos = vecinos
+        self._item_ids = self.juegos['item_id'].to_numpy()
+        self._titulos = self.juegos['title'].to_numpy(dtype=object)
+        self._filas_por_item = self.juegos.groupby('item_id').indices
+        self._buscador = None
+
+    @classmethod
+    def entrenar(cls, df, k=None, calcular_vecinos=True):
+        '''
+        Ajusta el modelo sobre el dataset RecomendacionJuego.
+
+        Parameters:
+        - df (pd.DataFrame): Dataset con las columnas 'item_id', 'title', 'texto' y, opcionalmente,
+          'filas' (cantidad de filas del dataset original que representa cada fila).
+        - k (int): Cantidad de vecinos a precalcular por juego.
+        - calcular_vecinos (bool): Si es False solo se ajusta el vectorizador y la matriz.
+
+        Returns:
+        - ModeloRecomendacion: El modelo entrenado.
+        '''
+        if 'filas' not in df:
+            df = df.assign(filas=1)
+        # Las filas repetidas tienen el mismo vector: alcanza con una por juego y texto
+        juegos = (df.astype({'title': str, 'texto': str})
+                    .groupby(['item_id', 'title', 'texto'], sort=False)['filas'].sum().reset_index())
+        filas = juegos['filas'].to_numpy(dtype=np.float64)
+
+        vectorizador = TfidfVectorizer()
+        vectorizador.fit(juegos['texto'])
+        # El IDF original se calculaba sobre todas las filas repetidas: se reproduce
+        # ponderando la frecuencia de documento de cada texto por su cantidad de filas
+        presencia = (vectorizador.transform(juegos['texto']) > 0).astype(np.float64)
+        frecuencia_documento = presencia.T @ filas
+        vectorizador.idf_ = np.log((1 + filas.sum()) / (1 + frecuencia_documento)) + 1
+
+        matriz = normalize(vectorizador.transform(juegos['texto'])).tocsr().astype(np.float32)
+
+        modelo = cls(vectorizador, matriz, juegos)
+        if calcular_vecinos:
+            modelo.vecinos = modelo.calcular_vecinos(k or configuracion.vecinos_por_juego)
+        return modelo
+
+    def vector_consulta(self, item_id):
+        '''
+        Vector TF-IDF normalizado del juego, o None si el item_id no está en el modelo.
+        '''
+        filas = self._filas_por_item.get(item_id)
+        if filas is None:
+            return None
+        return self.vectores_consulta([item_id])
+
+    def vectores_consulta(self, item_ids):
+        '''
+        Vectores TF-IDF normalizados de varios juegos presentes en el modelo, uno por fila.
+        Los juegos con un solo texto usan su fila de la matriz; el resto se vectoriza en
+        una sola llamada al vectorizador.
+        '''
+        vectores = self.matriz[[self._filas_por_item[i][0] for i in item_ids]]
+        varios = [j for j, i in enumerate(item_ids) if len(self._filas_por_item[i]) > 1]
+        if not varios:
+            return vectores
+        textos = [' '.join(self.juegos['texto'].iloc[self._filas_por_item[item_ids[j]]].unique()) for j in varios]
+        unidos = normalize(self.vectorizador.transform(textos)).astype(np.float32)
+        # Las filas de los juegos con varios textos se reemplazan por sus vectores unidos
+        orden = np.arange(len(item_ids))
+        orden[varios] = len(item_ids) + np.arange(len(varios))
+        return sp.vstack([vectores, unidos]).tocsr()[orden]
+
+    @property
+    def buscador(self):
+        '''
+        Buscador de juegos similares configurado (ver similitud.py), creado en el primer uso.
+        '''
+        if self._buscador is None:
+            self._buscador = crear_buscador(self.matriz)
+        return self._buscador
+
+    def _mas_similares(self, item_ids, k, tamano_bloque=512):
+        '''
+        Calcula los k juegos más similares de varios item_id por bloque de consultas, con
+        el buscador configurado.
+
+        Parameters:
+        - item_ids (list): item_id presentes en el modelo.
+        - k (int): Cantidad de juegos similares por consulta.
+        - tamano_bloque (int): Cantidad de juegos cuya similitud se calcula a la vez.
+
+        Yields:
+        - tuple: (item_id, lista de tuplas (item_id, título, score)).
+        '''
+        if not item_ids:
+            return
+        with tramo('vectorizacion'):
+            consultas = self.vectores_consulta(item_ids)
+        for inicio in range(0, len(item_ids), tamano_bloque):
+            verificar_cancelacion()
+            # Candidatos suficientes para elegir k títulos distintos sin el juego consultado
+            bloque = self.buscador.similitudes(consultas[inicio:inicio + tamano_bloque], minimo=4 * k + 1)
+            for item_id in item_ids[inicio:inicio + tamano_bloque]:
+                with tramo('similitud'):
+                    filas, scores = next(bloque)
+                with tramo('top_k'):
+                    if filas is None:
+                        elegidos = _ordenar_candidatos(scores, self._item_ids, self._titulos, item_id, k)
+                    else:
+                        elegidos = _ordenar_candidatos(scores, self._item_ids[filas], self._titulos[filas], item_id, k)
+                yield item_id, elegidos
+
+    def calcular_vecinos(self, k, tamano_bloque=512):
+        '''
+        Precalcula los k juegos más similares de cada item_id.
+
+        Parameters:
+        - k (int): Cantidad de vecinos por juego.
+        - tamano_bloque (int): Cantidad de juegos cuya similitud se calcula a la vez.
+
+        Returns:
+        - pd.DataFrame: Columnas 'item_id', 'puesto', 'vecino_item_id', 'title' y 'score'.
+        '''
+        filas = []
+        for item_id, elegidos in self._mas_similares(list(self._filas_por_item), k, tamano_bloque):
+            for puesto, (vecino, titulo, score) in enumerate(elegidos, start=1):
+                filas.append((item_id, puesto, vecino, titulo, score))
+        return pd.DataFrame(filas, columns=['item_id', 'puesto', 'vecino_item_id', 'title', 'score'])
+
+    def actualizar(self, agregadas=None, quitadas=None, tamano_bloque=512):
+        '''
+        Incorpora filas nuevas del dataset RecomendacionJuego y descuenta las reemplazadas,
+        sin recalcular toda la tabla de vecinos.
+
+        El vectorizador y la matriz se vuelven a ajustar sobre los juegos distintos, que es
+        barato. Los vecinos se recalculan solo para los juegos que cambiaron, los que
+        perdieron algún vecino y los que tienen, entre los juegos que cambiaron, un candidato
+        más similar que su último vecino guardado; el resto conserva su lista. Los scores de
+        las listas conservadas no reflejan el cambio de IDF, que solo recalcula un
+        entrenamiento completo (`python recomendacion.py`).
+
+        Parameters:
+        - agregadas (pd.DataFrame): Filas nuevas normalizadas ('item_id', 'title', 'texto', 'filas').
+        - quitadas (pd.DataFrame): Filas que dejan de existir, con las mismas columnas.
+        - tamano_bloque (int): Cantidad de juegos cuya similitud se calcula a la vez.
+
+        Returns:
+        - ModeloRecomendacion: El modelo actualizado.
+        '''
+        columnas = ['item_id', 'title', 'texto', 'filas']
+        partes = [self.juegos.reindex(columns=columnas).fillna({'filas': 1})]
+        if agregadas is not None:
+            partes.append(agregadas[columnas])
+        if quitadas is not None:
+            partes.append(quitadas[columnas].assign(filas=-quitadas['filas']))
+        juegos = (pd.concat(partes, ignore_index=True).astype({'title': str, 'texto': str})
+                    .groupby(['item_id', 'title', 'texto'], sort=False)['filas'].sum().reset_index())
+        modelo = ModeloRecomendacion.entrenar(juegos[juegos['filas'] > 0], calcular_vecinos=False)
+        if self.vecinos is None:
+            return modelo
+
+        k = int(self.vecinos['puesto'].max()) if len(self.vecinos) else configuracion.vecinos_por_juego
+        cambiados = set(pd.concat([df['item_id'] for df in (agregadas, quitadas) if df is not None]))
+        vigentes = set(modelo._filas_por_item)
+        vecinos = self.vecinos[~self.vecinos['item_id'].isin(cambiados) & ~self.vecinos['vecino_item_id'].isin(cambiados)
+                               & self.vecinos['item_id'].isin(vigentes)]
+        antes = self.vecinos.groupby('item_id').size()
+        despues = vecinos.groupby('item_id').size()
+        recalcular = (cambiados & vigentes) | {i for i in vigentes if despues.get(i, 0) < min(antes.get(i, 0), k)}
+
+        # Mayor similitud de cada juego con alguno de los juegos que cambiaron
+        filas_cambiadas = [f for i in sorted(cambiados & vigentes) for f in modelo._filas_por_item[i]]
+        mejor = np.zeros(modelo.matriz.shape[0], dtype=np.float32)
+        for inicio in range(0, len(filas_cambiadas), tamano_bloque):
+            verificar_cancelacion()
+            bloque = modelo.matriz @ modelo.matriz[filas_cambiadas[inicio:inicio + tamano_bloque]].T
+            mejor = np.maximum(mejor, bloque.max(axis=1).toarray().ravel())
+        mejor_por_item = pd.Series(mejor).groupby(modelo._item_ids).max()
+        ultimo = vecinos.groupby('item_id')['score'].min()
+        completos = despues[despues >= k].index
+        superados = mejor_por_item.reindex(ultimo.index) > ultimo
+        recalcular |= set(superados[superados].index) | (set(despues.index) - set(completos))
+
+        filas = []
+        for item_id, elegidos in modelo._mas_similares(sorted(recalcular), k, tamano_bloque):
+            for puesto, (vecino, titulo, score) in enumerate(elegidos, start=1):
+                filas.append((item_id, puesto, vecino, titulo, score))
+        nuevos = pd.DataFrame(filas, columns=vecinos.columns)
+        conservados = vecinos[~vecinos['item_id'].isin(recalcular)]
+        modelo.vecinos = (pd.concat([conservados, nuevos], ignore_index=True)
+                            .sort_values(['item_id', 'puesto'], kind='stable').reset_index(drop=True))
+        logger.info("Vecinos recalculados para %d de %d juegos", len(recalcular), len(vigentes))
+        return modelo
+
+    def recomendar(self, item_id, n=5):
+        '''
+        Devuelve los títulos de los n juegos más similares.
+
+        Parameters:
+        - item_id (int): ID del juego consultado.
+        - n (int): Cantidad de recomendaciones.
+
+        Returns:
+        - list or None: Títulos recomendados, None si el juego no está en el modelo.
+        '''
+        return self.recomendar_lote([item_id], n)[item_id]
+
+    def recomendar_lote(self, item_ids, n=5):
+        '''
+        Recomienda para varios juegos a la vez: con la tabla de vecinos es una búsqueda
+        por juego; sin ella, un único producto disperso entre los juegos pedidos y la matriz.
+
+        Parameters:
+        - item_ids (list): IDs de los juegos consultados.
+        - n (int): Cantidad de recomendaciones por juego.
+
+        Returns:
+        - dict: {item_id: lista de títulos, o None si el juego no está en el modelo}
+        '''
+        resultado = {item_id: None for item_id in item_ids}
+        conocidos = [item_id for item_id in resultado if item_id in self._filas_por_item]
+        if self.vecinos is not None and n <= configuracion.vecinos_por_juego:
+            with tramo('vecinos_precalculados'):
+                for item_id in conocidos:
+                    resultado[item_id] = self._titulos_vecinos.get(item_id, [])[:n]
+            return resultado
+
+        for item_id, elegidos in self._mas_similares(conocidos, n):
+            resultado[item_id] = [titulo for _, titulo, _ in elegidos]
+        return resultado
+
+    @property
+    def vecinos(self):
+        return self._vecinos
+
+    @vecinos.setter
+    def vecinos(self, vecinos):
+        self._vecinos = vecinos
+        self._titulos_vecinos = {} if vecinos is None else vecinos.groupby('item_id', sort=False)['title'].agg(list).to_dict()
+
+    def guardar(self, directorio=None):
+        '''
+        Guarda el vectorizador, la matriz, los juegos y los vecinos.
+
+        Parameters:
+        - directorio (str): Directorio de salida, por defecto configuracion.directorio_modelo.
+
+        Returns:
+        - dict: Tamaño en bytes de cada archivo guardado.
+        '''
+        directorio = directorio or configuracion.directorio_modelo
+        os.makedirs(directorio, exist_ok=True)
+        with open(os.path.join(directorio, 'vectorizador.pkl'), 'wb') as f:
+            pickle.dump(self.vectorizador, f)
+        sp.save_npz(os.path.join(directorio, 'matriz.npz'), self.matriz)
+        # Copia sin comprimir de los arreglos CSR, para mapearlos con CARGA_DATOS=mmap
+        for componente in COMPONENTES_MATRIZ:
+            np.save(os.path.join(directorio, f'matriz_{componente}.npy'), getattr(self.matriz, componente))
+        self.juegos.to_parquet(os.path.join(directorio, 'juegos.parquet'), index=False)
+        if self.vecinos is not None:
+            self.vecinos.to_parquet(os.path.join(directorio, 'vecinos.parquet'), index=False)
+        with open(os.path.join(directorio, 'fuentes.json'), 'w') as f:
+            json.dump(_huella_modelo(), f)
+        return {nombre: os.path.getsize(os.path.join(directorio, nombre)) for nombre in sorted(os.listdir(directorio))}
+
+    @classmethod
+    def cargar(cls, directorio=None, verificar=True, raiz=''):
+        '''
+        Carga un modelo guardado.
+
+        Parameters:
+        - directorio (str): Directorio del modelo, por defecto configuracion.directorio_modelo.
+        - verificar (bool): Si es False se carga aunque no corresponda a los datos actuales
+          (para actualizarlo con actualizar()).
+        - raiz (str): Directorio de artefactos contra el que se resuelven el directorio por
+          defecto y los datos de la verificación (ver instantaneas.py).
+
+        Returns:
+        - ModeloRecomendacion or None: El modelo, o None si no existe o no corresponde
+          a los datos actuales.
+        '''
+        directorio = directorio or os.path.join(raiz, configuracion.directorio_modelo)
+        ruta_fuentes = os.path.join(directorio, 'fuentes.json')
+        if not os.path.exists(ruta_fuentes):
+            return None
+        with open(ruta_fuentes) as f:
+            if verificar and json.load(f) != _huella_modelo(raiz):
+                logger.warning("El modelo de %s no corresponde a los datos actuales, se ignora", directorio)
+                return None
+
+        with open(os.path.join(directorio, 'vectorizador.pkl'), 'rb') as f:
+            vectorizador = pickle.load(f)
+        matriz = None
+        if configuracion.carga_datos == 'mmap':
+            matriz = _mapear_matriz(directorio, len(vectorizador.idf_))
+        if matriz is None:
+            matriz = sp.load_npz(os.path.join(directorio, 'matriz.npz')).tocsr()
+        juegos = pd.read_parquet(os.path.join(directorio, 'juegos.parquet'))
+        ruta_vecinos = os.path.join(directorio, 'vecinos.parquet')
+        vecinos = pd.read_parquet(ruta_vecinos) if os.path.exists(ruta_vecinos) else None
+        return cls(vectorizador, matriz, juegos, vecinos)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Entrena y guarda el modelo de recomendación")
+    parser.add_argument('--muestra', action='store_true',
+                        help="Entrena sobre la muestra del modo 'muestra' en lugar del catálogo completo")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # En modo 'exacto' el almacén carga todas las filas distintas del dataset de recomendación
+    almacen = AlmacenDatos('muestra' if args.muestra else 'exacto')
+    almacen.cargar(['RecomendacionJuego'])
+
+    inicio = time.perf_counter()
+    modelo = ModeloRecomendacion.entrenar(almacen.obtener('RecomendacionJuego'))
+    duracion = time.perf_counter() - inicio
+    tamanos = modelo.guardar()
+
+    logger.info("Modelo entrenado en %.1f s: %d juegos, %d términos, %d vecinos", duracion,
+                modelo.matriz.shape[0], modelo.matriz.shape[1], len(modelo.vecinos))
+    for nombre, tamano in tamanos.items():
+        logger.info("  %s: %.1f KB", nombre, tamano / 1024)
+    logger.info("Tamaño total del índice: %.1f KB", sum(tamanos.values()) / 1024)
@@ -0,0 +1,293 @@
+'''
+Modelo de recomendación usuario-juego persistido en disco.
+
+El entrenamiento se ejecuta offline con:
+
+    python recomendacion_usuarios.py
+
+Arma una matriz dispersa CSR usuario x juego a partir de los archivos de
+configuracion.rutas_interacciones que tienen 'user_id' e 'item_id': cada interacción vale
+log(1 + horas jugadas) más configuracion.peso_recomendacion si la reseña recomienda el
+juego (menos, si no lo recomienda). Los archivos se recorren por partes y solo se guardan
+los códigos de usuario y juego y el valor de cada interacción, así que la memoria crece
+con la cantidad de interacciones y no con el tamaño de los archivos.
+
+La matriz se factoriza con SVD truncada (scipy.sparse.linalg.svds) y se guardan los
+factores de usuarios (U * S) y de juegos (V). Recomendar es un producto escalar del
+factor del usuario con los de todos los juegos y un top-K que descarta los juegos que
+el usuario ya tiene.
+'''
+
+import json
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import scipy.sparse as sp
+from scipy.sparse.linalg import svds
+
+import columnar
+import configuracion
+import lectura
+from agregados import huella_archivos
+from instrumentacion import tramo
+
+
+logger = logging.getLogger(__name__)
+
+COLUMNAS_INTERACCION = ['user_id', 'item_id', 'playtime_forever', 'reviews_recommend']
+
+# Arreglos guardados como .npy (mapeados en memoria con CARGA_DATOS=mmap)
+ARREGLOS = ('factores_usuarios', 'factores_juegos', 'interacciones_indptr', 'interacciones_indices')
+
+
+def _columnas(ruta):
+    '''
+    Columnas de interacción presentes en un archivo: (nombre, nombre en el archivo).
+    '''
+    nombres = set(pq.read_schema(lectura.archivos(ruta)[0]).names)
+    en_archivo = COLUMNAS_INTERACCION
+    if configuracion.formato_datos == 'columnar':
+        en_archivo = columnar.columnas_hechos(COLUMNAS_INTERACCION)
+    return [(columna, archivo) for columna, archivo in zip(COLUMNAS_INTERACCION, en_archivo) if archivo in nombres]
+
+
+def _leer(ruta, columnas):
+    for tabla in lectura.escanear(ruta, columnas):
+        yield columnar.decodificar(tabla) if configuracion.formato_datos == 'columnar' else tabla
+
+
+def valores_interaccion(tabla):
+    '''
+    Valor de cada interacción de una tabla con 'playtime_forever' y/o 'reviews_recommend'.
+
+    Returns:
+    - np.ndarray: log(1 + horas) más o menos configuracion.peso_recomendacion (float32).
+    '''
+    valores = np.zeros(tabla.num_rows, dtype=np.float32)
+    if 'playtime_forever' in tabla.column_names:
+        minutos = pc.fill_null(tabla['playtime_forever'], 0).to_numpy().astype(np.float32)
+        valores += np.log1p(np.maximum(minutos, 0) / 60)
+    if 'reviews_recommend' in tabla.column_names:
+        recomienda = tabla['reviews_recommend']
+        signo = pc.if_else(recomienda, 1, -1).to_numpy(zero_copy_only=False)
+        valores += np.where(pc.is_valid(recomienda).to_numpy(zero_copy_only=False), signo, 0) * configuracion.peso_recomendacion
+    return valores
+
+
+def leer_interacciones(rutas=None):
+    '''
+    Recorre los archivos de interacciones y arma la matriz usuario x juego.
+
+    Parameters:
+    - rutas (list): Archivos (o directorios por lotes), por defecto configuracion.rutas_interacciones.
+
+    Returns:
+    - tuple: (sp.csr_matrix float32 con la suma de los valores de cada usuario y juego,
+      np.ndarray de user_id por fila, np.ndarray de item_id por columna).
+    '''
+    usuarios, juegos, valores = [], [], []
+    for ruta in rutas or configuracion.rutas_interacciones:
+        if not os.path.exists(ruta) or not lectura.archivos(ruta):
+            logger.warning("No se encontró el archivo %s, se omite", ruta)
+            continue
+        columnas = _columnas(ruta)
+        nombres = [columna for columna, _ in columnas]
+        if 'user_id' not in nombres or 'item_id' not in nombres or len(columnas) < 3:
+            logger.info("%s no tiene interacciones de usuarios, se omite", ruta)
+            continue
+        for tabla in _leer(ruta, [archivo for _, archivo in columnas]):
+            tabla = tabla.rename_columns(nombres)
+            usuarios.append(tabla['user_id'].cast(pa.string()))
+            juegos.append(tabla['item_id'].to_numpy())
+            valores.append(valores_interaccion(tabla))
+    if not usuarios:
+        raise FileNotFoundError("No hay archivos con interacciones de usuarios y juegos")
+
+    # Códigos de usuario: posición en la lista ordenada de usuarios distintos
+    codificados = pc.dictionary_encode(pa.chunked_array(usuarios).combine_chunks())
+    ids_usuarios = codificados.dictionary.to_numpy(zero_copy_only=False)
+    orden = np.argsort(ids_usuarios, kind='stable')
+    filas = np.argsort(orden).astype(np.int32)[codificados.indices.to_numpy()]
+    ids_juegos, columnas = np.unique(np.concatenate(juegos), return_inverse=True)
+
+    # Las interacciones repetidas del mismo usuario y juego se suman
+    matriz = sp.csr_matrix((np.concatenate(valores), (filas, columnas.astype(np.int32))),
+                           shape=(len(ids_usuarios), len(ids_juegos)), dtype=np.float32)
+    matriz.sum_duplicates()
+    return matriz, ids_usuarios[orden], ids_juegos
+
+
+def leer_titulos(ids_juegos, ruta=None):
+    '''
+    Título de cada juego, tomado del dataset de recomendación (None si no figura).
+    '''
+    ruta = ruta or configuracion.parquet_file_path5
+    titulos = pd.Series(None, index=ids_juegos, dtype=object)
+    if not os.path.exists(ruta) or not lectura.archivos(ruta):
+        return titulos
+    columnas = ['item_id', 'title']
+    if configuracion.formato_datos == 'columnar':
+        columnas = columnar.columnas_hechos(columnas)
+    partes = [tabla.rename_columns(['item_id', 'title']).to_pandas() for tabla in _leer(ruta, columnas)]
+    if partes:
+        conocidos = pd.concat(partes, ignore_index=True).drop_duplicates('item_id').set_index('item_id')['title']
+        titulos = conocidos.astype(object).reindex(ids_juegos)
+    return titulos
+
+
+class ModeloUsuarios:
+    '''
+    Factores de usuarios y juegos de la matriz de interacciones.
+    '''
+
+    def __init__(self, factores_usuarios, factores_juegos, usuarios, juegos, interacciones):
+        '''
+        Parameters:
+        - factores_usuarios (np.ndarray): Una fila por usuario (U * S).
+        - factores_juegos (np.ndarray): Una fila por juego (V).
+        - usuarios (np.ndarray): user_id de cada fila.
+        - juegos (pd.DataFrame): 'item_id' y 'title' de cada juego.
+        - interacciones (sp.csr_matrix): Matriz usuario x juego (solo se usan sus posiciones).
+        '''
+        self.factores_usuarios = factores_usuarios
+        self.factores_juegos = factores_juegos
+        self.usuarios = pd.Index(usuarios)
+        self.juegos = juegos.reset_index(drop=True)
+        self.interacciones = interacciones
+        self._titulos = self.juegos['title'].to_numpy(dtype=object)
+        # Los juegos sin título no se recomiendan
+        self._sin_titulo = np.flatnonzero(pd.isna(self._titulos))
+
+    @classmethod
+    def entrenar(cls, matriz, usuarios, juegos, factores=None):
+        '''
+        Factoriza la matriz de interacciones con SVD truncada.
+
+        Parameters:
+        - matriz (sp.csr_matrix): Matriz usuario x juego.
+        - usuarios (np.ndarray): user_id de cada fila.
+        - juegos (pd.DataFrame): 'item_id' y 'title' de cada columna.
+        - factores (int): Cantidad de factores, por defecto configuracion.factores_usuarios.
+
+        Returns:
+        - ModeloUsuarios: El modelo entrenado.
+        '''
+        factores = min(factores or configuracion.factores_usuarios, min(matriz.shape) - 1)
+        u, s, vt = svds(matriz, k=factores, random_state=0)
+        # svds devuelve los valores singulares en orden creciente
+        orden = np.argsort(-s)
+        factores_usuarios = (u[:, orden] * s[orden]).astype(np.float32)
+        factores_juegos = np.ascontiguousarray(vt[orden].T, dtype=np.float32)
+        return cls(factores_usuarios, factores_juegos, usuarios, juegos, matriz)
+
+    def recomendar(self, user_id, n=5):
+        '''
+        Devuelve los títulos de los n juegos con mayor puntaje para el usuario, sin los
+        juegos que ya tiene.
+
+        Parameters:
+        - user_id (str): ID del usuario.
+        - n (int): Cantidad de recomendaciones.
+
+        Returns:
+        - list or None: Títulos recomendados, None si el usuario no está en el modelo.
+        '''
+        fila = self.usuarios.get_indexer([user_id])[0]
+        if fila < 0:
+            return None
+        with tramo('similitud'):
+            scores = self.factores_juegos @ self.factores_usuarios[fila]
+        propios = self.interacciones.indices[self.interacciones.indptr[fila]:self.interacciones.indptr[fila + 1]]
+        scores[propios] = -np.inf
+        scores[self._sin_titulo] = -np.inf
+        disponibles = len(scores) - np.count_nonzero(np.isneginf(scores))
+        n = min(n, disponibles)
+        if n == 0:
+            return []
+        with tramo('top_k'):
+            mejores = np.argpartition(-scores, n - 1)[:n]
+            mejores = mejores[np.argsort(-scores[mejores], kind='stable')]
+        return [self._titulos[i] for i in mejores]
+
+    def guardar(self, directorio=None):
+        '''
+        Guarda los factores, los usuarios, los juegos y las posiciones de las interacciones.
+
+        Returns:
+        - dict: Tamaño en bytes de cada archivo guardado.
+        '''
+        directorio = directorio or configuracion.directorio_modelo_usuarios
+        os.makedirs(directorio, exist_ok=True)
+        arreglos = {
+            'factores_usuarios': self.factores_usuarios,
+            'factores_juegos': self.factores_juegos,
+            'interacciones_indptr': self.interacciones.indptr,
+            'interacciones_indices': self.interacciones.indices,
+        }
+        for nombre, arreglo in arreglos.items():
+            np.save(os.path.join(directorio, f'{nombre}.npy'), arreglo)
+        pq.write_table(pa.table({'user_id': pa.array(self.usuarios.to_numpy(), pa.string())}),
+                       os.path.join(directorio, 'usuarios.parquet'))
+        self.juegos.to_parquet(os.path.join(directorio, 'juegos.parquet'), index=False)
+        with open(os.path.join(directorio, 'fuentes.json'), 'w') as f:
+            json.dump(huella_archivos(configuracion.rutas_interacciones), f)
+        return {nombre: os.path.getsize(os.path.join(directorio, nombre)) for nombre in sorted(os.listdir(directorio))}
+
+    @classmethod
+    def cargar(cls, directorio=None, raiz=''):
+        '''
+        Carga un modelo guardado. Con CARGA_DATOS=mmap los arreglos se mapean en memoria.
+
+        Parameters:
+        - directorio (str): Directorio del modelo, por defecto configuracion.directorio_modelo_usuarios.
+        - raiz (str): Directorio de artefactos contra el que se resuelven el directorio por
+          defecto y los datos de la verificación (ver instantaneas.py).
+
+        Returns:
+        - ModeloUsuarios or None: El modelo, o None si no existe o no corresponde a los
+          datos actuales.
+        '''
+        directorio = directorio or os.path.join(raiz, configuracion.directorio_modelo_usuarios)
+        ruta_fuentes = os.path.join(directorio, 'fuentes.json')
+        if not os.path.exists(ruta_fuentes):
+            return None
+        with open(ruta_fuentes) as f:
+            if json.load(f) != huella_archivos(configuracion.rutas_interacciones, raiz):
+                logger.warning("El modelo de %s no corresponde a los datos actuales, se ignora", directorio)
+                return None
+
+        modo = 'r' if configuracion.carga_datos == 'mmap' else None
+        arreglos = {nombre: np.load(os.path.join(directorio, f'{nombre}.npy'), mmap_mode=modo) for nombre in ARREGLOS}
+        usuarios = pq.read_table(os.path.join(directorio, 'usuarios.parquet'))['user_id'].to_numpy(zero_copy_only=False)
+        juegos = pd.read_parquet(os.path.join(directorio, 'juegos.parquet'))
+        indptr, indices = arreglos['interacciones_indptr'], arreglos['interacciones_indices']
+        # Solo se usan las posiciones: los valores no se guardan
+        interacciones = sp.csr_matrix((np.ones(len(indices), dtype=np.int8), indices, indptr),
+                                      shape=(len(indptr) - 1, len(juegos)), copy=False)
+        return cls(arreglos['factores_usuarios'], arreglos['factores_juegos'], usuarios, juegos, interacciones)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    inicio = time.perf_counter()
+    matriz, usuarios, ids_juegos = leer_interacciones()
+    lectura_s = time.perf_counter() - inicio
+    juegos = pd.DataFrame({'item_id': ids_juegos, 'title': leer_titulos(ids_juegos).to_numpy()})
+
+    inicio = time.perf_counter()
+    modelo = ModeloUsuarios.entrenar(matriz, usuarios, juegos)
+    entrenamiento_s = time.perf_counter() - inicio
+    tamanos = modelo.guardar()
+
+    logger.info("Interacciones leídas en %.1f s: %d usuarios, %d juegos, %d interacciones (%.1f MB)", lectura_s,
+                matriz.shape[0], matriz.shape[1], matriz.nnz,
+                (matriz.data.nbytes + matriz.indices.nbytes + matriz.indptr.nbytes) / 2**20)
+    logger.info("Modelo entrenado en %.1f s con %d factores", entrenamiento_s, modelo.factores_usuarios.shape[1])
+    for nombre, tamano in tamanos.items():
+        logger.info("  %s: %.1f KB", nombre, tamano / 1024)
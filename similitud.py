@@ -0,0 +1,409 @@
+'''
+Búsqueda de los juegos más similares sobre la matriz TF-IDF normalizada del modelo
+de recomendación.
+
+- 'exacto': producto disperso de las consultas con toda la matriz. El costo de cada
+  consulta crece con el tamaño del catálogo, y precalcular los vecinos de todos los
+  juegos crece con su cuadrado.
+- 'lsh': hashing sensible a la localidad con proyecciones aleatorias. Cada tabla asigna
+  a cada juego una clave de `bits` bits: el signo de su proyección sobre `bits`
+  hiperplanos aleatorios. Dos vectores caen del mismo lado de un hiperplano con
+  probabilidad 1 - ángulo / pi, así que los juegos similares comparten clave en alguna
+  de las tablas. Cada consulta revisa también las claves que difieren en los bits cuya
+  proyección está más cerca de cero (multi-probe), y solo los juegos de esas claves se
+  puntúan con el producto exacto.
+- 'particionado': el mismo resultado que 'exacto', repartido en procesos. Las filas de la
+  matriz se dividen en rangos contiguos con la misma cantidad de valores no nulos; la
+  matriz se copia una vez a memoria compartida y cada proceso trabaja sobre su rango sin
+  copiarlo. Cada consulta se envía a todos los procesos (scatter), cada uno devuelve sus
+  `minimo` mejores juegos y el proceso de la API junta esas listas (gather). Como los
+  procesos no comparten el GIL, varias consultas a la vez aprovechan todos los núcleos.
+
+El buscador se elige con configuracion.buscador_similitud. `python benchmarks/buscadores.py`
+compara recall@K, latencia y consultas por segundo de 'lsh' y 'particionado' contra 'exacto'.
+'''
+
+import itertools
+import logging
+import pickle
+import threading
+import weakref
+from concurrent.futures import Future, wait as esperar_futuros
+from multiprocessing import get_context, shared_memory
+from multiprocessing.connection import wait
+
+import numpy as np
+import scipy.sparse as sp
+
+import configuracion
+from ejecucion import verificar_cancelacion
+
+
+logger = logging.getLogger(__name__)
+
+
+class BuscadorExacto:
+    '''
+    Similitud de cada consulta con todos los juegos.
+    '''
+
+    def __init__(self, matriz):
+        self.matriz = matriz
+
+    def similitudes(self, consultas, minimo=0):
+        '''
+        Parameters:
+        - consultas (sp.csr_matrix): Vectores normalizados de las consultas, uno por fila.
+        - minimo (int): Sin uso; el buscador exacto puntúa siempre todos los juegos.
+
+        Yields:
+        - tuple: (filas, scores) de cada consulta. filas es None cuando scores cubre todos
+          los juegos de la matriz.
+        '''
+        for scores in (consultas @ self.matriz.T).toarray():
+            yield None, scores
+
+
+class BuscadorLSH(BuscadorExacto):
+    '''
+    Candidatos por LSH de proyecciones aleatorias, puntuados con el producto exacto.
+    '''
+
+    def __init__(self, matriz, tablas=None, bits=None, sondeos=None, semilla=0):
+        '''
+        Parameters:
+        - matriz (sp.csr_matrix): Vectores normalizados de los juegos.
+        - tablas (int): Cantidad de tablas de hash.
+        - bits (int): Bits de la clave de cada tabla (hasta 62).
+        - sondeos (int): Bits que se invierten de a uno para revisar claves vecinas.
+        - semilla (int): Semilla de los hiperplanos.
+        '''
+        super().__init__(matriz)
+        self.tablas = tablas or configuracion.lsh_tablas
+        self.bits = bits or configuracion.lsh_bits
+        self.sondeos = configuracion.lsh_sondeos if sondeos is None else sondeos
+        rng = np.random.default_rng(semilla)
+        self.planos = rng.standard_normal((matriz.shape[1], self.tablas * self.bits)).astype(np.float32)
+        self._pesos = np.left_shift(np.int64(1), np.arange(self.bits, dtype=np.int64))
+
+        claves = self._claves(np.asarray(matriz @ self.planos))
+        # Por tabla: juegos ordenados por clave, para buscar cada clave con searchsorted
+        self._orden = np.argsort(claves, axis=0, kind='stable').T.astype(np.int32)
+        self._claves_ordenadas = np.take_along_axis(claves, self._orden.T, axis=0).T
+
+    def _claves(self, proyecciones):
+        signos = (proyecciones > 0).reshape(len(proyecciones), self.tablas, self.bits)
+        return signos.astype(np.int64) @ self._pesos
+
+    def _sondeadas(self, proyecciones):
+        # Clave de cada consulta en cada tabla y las que difieren en sus bits más inciertos
+        claves = self._claves(proyecciones)
+        if not self.sondeos:
+            return claves[:, :, None]
+        inciertos = np.argsort(np.abs(proyecciones.reshape(len(proyecciones), self.tablas, self.bits)), axis=2)
+        vecinas = claves[:, :, None] ^ self._pesos[inciertos[:, :, :self.sondeos]]
+        return np.concatenate([claves[:, :, None], vecinas], axis=2)
+
+    def candidatos(self, proyecciones):
+        '''
+        Pares (consulta, juego) de las consultas con los juegos que comparten alguna clave
+        sondeada.
+
+        Parameters:
+        - proyecciones (np.ndarray): Proyección de cada consulta sobre los hiperplanos.
+
+        Returns:
+        - tuple: (consultas, filas) ordenados por consulta y fila, sin pares repetidos.
+        '''
+        sondeadas = self._sondeadas(proyecciones)
+        numero_consulta = np.repeat(np.arange(len(proyecciones)), sondeadas.shape[2])
+        consultas, filas = [], []
+        for tabla in range(self.tablas):
+            claves = sondeadas[:, tabla, :].ravel()
+            desde = np.searchsorted(self._claves_ordenadas[tabla], claves, side='left')
+            largos = np.searchsorted(self._claves_ordenadas[tabla], claves, side='right') - desde
+            # Posiciones de cada rango [desde, desde + largo) concatenadas
+            posiciones = np.arange(largos.sum()) + np.repeat(desde - np.cumsum(largos) + largos, largos)
+            consultas.append(np.repeat(numero_consulta, largos))
+            filas.append(self._orden[tabla, posiciones])
+        numero_filas = np.int64(self.matriz.shape[0])
+        pares = np.unique(np.concatenate(consultas).astype(np.int64) * numero_filas + np.concatenate(filas))
+        return pares // numero_filas, pares % numero_filas
+
+    def similitudes(self, consultas, minimo=0):
+        '''
+        Parameters:
+        - consultas (sp.csr_matrix): Vectores normalizados de las consultas, uno por fila.
+        - minimo (int): Candidatos necesarios; con menos, la consulta se puntúa contra
+          todos los juegos.
+
+        Yields:
+        - tuple: (filas, scores) de cada consulta. filas es None cuando scores cubre todos
+          los juegos de la matriz.
+        '''
+        numero, filas = self.candidatos(np.asarray(consultas @ self.planos))
+        # Producto escalar de cada par candidato, sin calcular los demás
+        scores = np.asarray(consultas[numero].multiply(self.matriz[filas]).sum(axis=1)).ravel()
+        limites = np.searchsorted(numero, np.arange(consultas.shape[0] + 1))
+        for i in range(consultas.shape[0]):
+            if limites[i + 1] - limites[i] < minimo:
+                yield None, (consultas[i] @ self.matriz.T).toarray().ravel()
+            else:
+                yield filas[limites[i]:limites[i + 1]], scores[limites[i]:limites[i + 1]]
+
+
+def cortes_particiones(indptr, particiones):
+    '''
+    Filas donde empieza cada partición, con la misma cantidad de valores no nulos en cada una.
+
+    Parameters:
+    - indptr (np.ndarray): indptr de la matriz CSR.
+    - particiones (int): Cantidad de particiones buscada.
+
+    Returns:
+    - np.ndarray: Límites [0, ..., filas]; la partición i va de cortes[i] a cortes[i + 1].
+      Con menos filas que particiones hay menos particiones, ninguna vacía.
+    '''
+    objetivos = np.linspace(0, indptr[-1], particiones + 1)[1:-1]
+    cortes = np.concatenate([[0], np.searchsorted(indptr, objetivos), [len(indptr) - 1]])
+    return np.unique(cortes)
+
+
+def _atender(conexion, arreglos, desde, hasta, terminos):
+    # Proceso de una partición: puntúa las consultas contra las filas [desde, hasta) de la
+    # matriz compartida y devuelve los mejores juegos de cada consulta con su fila global
+    memorias = [shared_memory.SharedMemory(name=nombre) for nombre, _, _ in arreglos]
+    data, indices, indptr = (np.ndarray(forma, tipo, buffer=memoria.buf)
+                             for memoria, (_, forma, tipo) in zip(memorias, arreglos))
+    inicio, fin = indptr[desde], indptr[hasta]
+    particion = sp.csr_matrix((data[inicio:fin], indices[inicio:fin], indptr[desde:hasta + 1] - inicio),
+                              shape=(hasta - desde, terminos), copy=False)
+    try:
+        while True:
+            try:
+                mensaje = conexion.recv_bytes()
+            except EOFError:
+                break
+            if not mensaje:
+                break
+            numero, consultas, minimo = pickle.loads(mensaje)
+            try:
+                # particion @ consultas.T no convierte la partición: solo las consultas
+                scores = (particion @ consultas.T).T.toarray()
+                if minimo and minimo < scores.shape[1]:
+                    filas = np.sort(np.argpartition(-scores, minimo - 1, axis=1)[:, :minimo], axis=1)
+                    scores = np.take_along_axis(scores, filas, axis=1)
+                else:
+                    filas = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+                respuesta = (numero, filas.astype(np.int32) + np.int32(desde), scores, None)
+            except Exception as error:
+                respuesta = (numero, None, None, error)
+            conexion.send_bytes(pickle.dumps(respuesta, protocol=pickle.HIGHEST_PROTOCOL))
+    finally:
+        del particion, data, indices, indptr
+        for memoria in memorias:
+            memoria.close()
+
+
+class ParticionCaida(RuntimeError):
+    '''
+    El proceso de una partición terminó y el buscador particionado ya no puede responder.
+    '''
+
+
+class _Particiones:
+    '''
+    Procesos de las particiones, la memoria compartida de la matriz y el hilo que recibe
+    sus respuestas.
+    '''
+
+    def __init__(self, matriz, cortes):
+        self._memorias, self._conexiones, self._procesos, self._envios = [], [], [], []
+        self._lock = threading.Lock()
+        self._pendientes = {}
+        self._numeros = itertools.count()
+        self._error = None
+        self._cerrado = False
+        contexto = get_context('spawn')
+        try:
+            arreglos = []
+            for arreglo in (matriz.data, matriz.indices, matriz.indptr):
+                memoria = shared_memory.SharedMemory(create=True, size=max(arreglo.nbytes, 1))
+                self._memorias.append(memoria)
+                np.ndarray(arreglo.shape, arreglo.dtype, buffer=memoria.buf)[:] = arreglo
+                arreglos.append((memoria.name, arreglo.shape, arreglo.dtype.str))
+            for numero, (desde, hasta) in enumerate(zip(cortes[:-1], cortes[1:])):
+                propia, remota = contexto.Pipe()
+                proceso = contexto.Process(target=_atender, name=f"similitud-{numero}", daemon=True,
+                                           args=(remota, arreglos, int(desde), int(hasta), matriz.shape[1]))
+                proceso.start()
+                remota.close()
+                self._conexiones.append(propia)
+                self._procesos.append(proceso)
+                self._envios.append(threading.Lock())
+        except BaseException:
+            self.cerrar()
+            raise
+        self._recolector = threading.Thread(target=self._recolectar, name="similitud-recoleccion", daemon=True)
+        self._recolector.start()
+
+    def _recolectar(self):
+        conexiones = {conexion: i for i, conexion in enumerate(self._conexiones)}
+        sentinelas = {proceso.sentinel: i for i, proceso in enumerate(self._procesos)}
+        while True:
+            try:
+                listos = wait([*conexiones, *sentinelas])
+            except (OSError, ValueError):
+                # Conexiones cerradas por cerrar()
+                return
+            for listo in listos:
+                i = conexiones.get(listo)
+                try:
+                    if i is None:
+                        raise EOFError
+                    numero, filas, scores, error = pickle.loads(listo.recv_bytes())
+                except (EOFError, OSError):
+                    if not self._cerrado:
+                        particion = sentinelas.get(listo, i)
+                        self._fallar(f"Terminó el proceso de la partición {particion} de similitud")
+                    return
+                with self._lock:
+                    futuro = self._pendientes.pop((numero, i), None)
+                if futuro is None:
+                    continue
+                if error is not None:
+                    futuro.set_exception(error)
+                else:
+                    futuro.set_result((filas, scores))
+
+    def _fallar(self, mensaje):
+        # Se guarda el mensaje y no la excepción: su traceback retendría al buscador
+        logger.warning("%s: la similitud se calcula en el proceso de la API", mensaje)
+        with self._lock:
+            self._error = mensaje
+            pendientes, self._pendientes = self._pendientes, {}
+        for futuro in pendientes.values():
+            futuro.set_exception(ParticionCaida(mensaje))
+
+    def consultar(self, consultas, minimo):
+        '''
+        Envía las consultas a todas las particiones y espera sus respuestas.
+
+        Returns:
+        - list: (filas, scores) de cada partición, en el orden de las filas.
+
+        Raises:
+        - ParticionCaida: Si alguno de los procesos terminó.
+        '''
+        numero = next(self._numeros)
+        futuros = [Future() for _ in self._conexiones]
+        with self._lock:
+            if self._error is not None:
+                raise ParticionCaida(self._error)
+            for i, futuro in enumerate(futuros):
+                self._pendientes[(numero, i)] = futuro
+        mensaje = pickle.dumps((numero, consultas, minimo), protocol=pickle.HIGHEST_PROTOCOL)
+        for i, (envio, conexion) in enumerate(zip(self._envios, self._conexiones)):
+            try:
+                with envio:
+                    conexion.send_bytes(mensaje)
+            except OSError as error:
+                self._fallar(f"No se pudo enviar la consulta a la partición {i} de similitud")
+                raise ParticionCaida(self._error) from error
+        # Espera por tramos cortos para respetar el timeout de la consulta (ver ejecucion.py)
+        while esperar_futuros(futuros, timeout=0.05).not_done:
+            verificar_cancelacion()
+        return [futuro.result() for futuro in futuros]
+
+    def cerrar(self):
+        '''
+        Detiene los procesos y libera la memoria compartida.
+        '''
+        self._cerrado = True
+        for envio, conexion in zip(self._envios, self._conexiones):
+            try:
+                with envio:
+                    conexion.send_bytes(b"")
+            except (OSError, ValueError):
+                pass
+        for proceso in self._procesos:
+            proceso.join(timeout=5)
+            if proceso.is_alive():
+                proceso.terminate()
+                proceso.join()
+        for conexion in self._conexiones:
+            conexion.close()
+        for memoria in self._memorias:
+            memoria.close()
+            memoria.unlink()
+
+
+class BuscadorParticionado(BuscadorExacto):
+    '''
+    Similitud exacta repartida en procesos, cada uno con un rango de filas de la matriz.
+    '''
+
+    def __init__(self, matriz, particiones=None):
+        '''
+        Parameters:
+        - matriz (sp.csr_matrix): Vectores normalizados de los juegos.
+        - particiones (int): Cantidad de procesos, por defecto
+          configuracion.particiones_similitud.
+        '''
+        super().__init__(matriz)
+        self.cortes = cortes_particiones(matriz.indptr, particiones or configuracion.particiones_similitud)
+        self.particiones = len(self.cortes) - 1
+        self._particiones = _Particiones(matriz, self.cortes)
+        # Los procesos y la memoria compartida se liberan al liberarse el buscador (por
+        # ejemplo con la instantánea que lo contiene) o al terminar el proceso
+        self._cierre = weakref.finalize(self, self._particiones.cerrar)
+
+    def cerrar(self):
+        self._cierre()
+
+    def similitudes(self, consultas, minimo=0):
+        '''
+        Parameters:
+        - consultas (sp.csr_matrix): Vectores normalizados de las consultas, uno por fila.
+        - minimo (int): Juegos que devuelve cada partición por consulta; 0 devuelve todos.
+
+        Yields:
+        - tuple: (filas, scores) de cada consulta. filas es None cuando scores cubre todos
+          los juegos de la matriz.
+        '''
+        try:
+            partes = self._particiones.consultar(consultas, minimo)
+        except ParticionCaida:
+            yield from super().similitudes(consultas, minimo)
+            return
+        filas = np.concatenate([filas for filas, _ in partes], axis=1)
+        scores = np.concatenate([scores for _, scores in partes], axis=1)
+        for i in range(consultas.shape[0]):
+            # Sin mínimo las particiones devuelven todas sus filas, en orden
+            yield (None if not minimo else filas[i]), scores[i]
+
+
+BUSCADORES = {'exacto': BuscadorExacto, 'lsh': BuscadorLSH, 'particionado': BuscadorParticionado}
+
+
+def crear_buscador(matriz, nombre=None, **parametros):
+    '''
+    Crea el buscador configurado sobre la matriz del modelo.
+
+    Parameters:
+    - matriz (sp.csr_matrix): Vectores normalizados de los juegos.
+    - nombre (str): 'exacto', 'lsh' o 'particionado', por defecto
+      configuracion.buscador_similitud.
+    - parametros: Parámetros del buscador (por ejemplo tablas y bits para 'lsh' o
+      particiones para 'particionado').
+
+    Returns:
+    - BuscadorExacto, BuscadorLSH or BuscadorParticionado: El buscador.
+
+    Raises:
+    - ValueError: Si el nombre no corresponde a un buscador.
+    '''
+    nombre = nombre or configuracion.buscador_similitud
+    if nombre not in BUSCADORES:
+        raise ValueError(f"Buscador de similitud inválido: {nombre}. Usar {' o '.join(map(repr, BUSCADORES))}")
+    return BUSCADORES[nombre](matriz, **parametros)
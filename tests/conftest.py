@@ -0,0 +1,130 @@
+'''
+Datos sintéticos y arranque de la API para las pruebas.
+
+Los datos se generan una vez por sesión con benchmarks/generar_datos.py, iguales en dos
+directorios: en un solo row group y en row groups chicos (para recorrer varios en modo
+'exacto'). La fixture `api` arranca la API sobre uno de ellos con la configuración pedida y
+devuelve un TestClient; la configuración se cambia sobre el módulo configuracion, que los
+módulos de la API leen al usarla.
+'''
+
+import os
+import sys
+
+import pytest
+
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, 'benchmarks'))
+
+# La API arranca dentro del lifespan del cliente y sin hilos de vigilancia ni compactación
+os.environ.update(ARRANQUE_SEGUNDO_PLANO='0', VIGILANCIA_SEGUNDOS='0', COMPACTACION_SEGUNDOS='0')
+
+from fastapi.testclient import TestClient
+
+import configuracion
+import main
+from cache_respuestas import CacheRespuestas
+from generar_datos import GENEROS, generar
+from instantaneas import GestorInstantaneas
+
+
+FILAS = 4000
+FILAS_POR_ROW_GROUP = 500
+TOKEN = 'prueba'
+# Con este porcentaje la muestra del modo 'muestra' es el archivo completo (ver datos._leer_muestra)
+MUESTRA_COMPLETA = 100 * 80
+
+
+@pytest.fixture(scope='session')
+def datos(tmp_path_factory):
+    '''
+    Returns:
+    - dict: {'un_row_group': directorio, 'varios_row_groups': directorio}, con las mismas filas.
+    '''
+    directorios = {}
+    for nombre, filas_por_row_group in (('un_row_group', FILAS), ('varios_row_groups', FILAS_POR_ROW_GROUP)):
+        directorio = str(tmp_path_factory.mktemp(nombre))
+        generar(FILAS, directorio, filas_por_row_group=filas_por_row_group)
+        directorios[nombre] = directorio
+    return directorios
+
+
+@pytest.fixture
+def api(datos, tmp_path, monkeypatch):
+    '''
+    Arranca la API: api(directorio='varios_row_groups', modo='muestra', cubo=True,
+    muestra_completa=True, cache=False, ingesta=None) devuelve un TestClient ya iniciado.
+    Cada llamada arranca una API nueva, con su propia instantánea y, salvo que se pase el
+    nombre de uno anterior en `ingesta`, su propio directorio de ingesta.
+    '''
+    clientes = []
+
+    def iniciar(directorio='varios_row_groups', modo='muestra', cubo=True, muestra_completa=True, cache=False, ingesta=None):
+        for cliente in clientes:
+            cliente.__exit__(None, None, None)
+        clientes.clear()
+        monkeypatch.chdir(datos[directorio])
+        ingesta = tmp_path / (ingesta or f'ingesta_{len(os.listdir(tmp_path))}')
+        monkeypatch.setattr(configuracion, 'modo_consulta', modo)
+        monkeypatch.setattr(configuracion, 'cubo_agregados', cubo)
+        monkeypatch.setattr(configuracion, 'sample_percent', MUESTRA_COMPLETA if muestra_completa else 5)
+        monkeypatch.setattr(configuracion, 'directorio_ingesta', str(ingesta))
+        monkeypatch.setattr(configuracion, 'token_admin', TOKEN)
+        # Sin agregados ni modelo guardados: las consultas se calculan en vivo
+        monkeypatch.setattr(configuracion, 'ruta_agregados', str(tmp_path / 'sin_artefactos' / 'agregados.json.gz'))
+        monkeypatch.setattr(configuracion, 'directorio_modelo', str(tmp_path / 'sin_artefactos' / 'modelo_recomendacion'))
+        monkeypatch.setattr(configuracion, 'directorio_modelo_usuarios', str(tmp_path / 'sin_artefactos' / 'modelo_usuarios'))
+        monkeypatch.setattr(main, 'gestor', GestorInstantaneas(main._construir, main._validar))
+        monkeypatch.setattr(main, 'cache', CacheRespuestas(max_entradas=1024 if cache else 0, ttl=60))
+        cliente = TestClient(main.app)
+        cliente.__enter__()
+        clientes.append(cliente)
+        return cliente
+
+    yield iniciar
+    for cliente in clientes:
+        cliente.__exit__(None, None, None)
+
+
+def autorizacion():
+    return {'Authorization': f'Bearer {TOKEN}'}
+
+
+# Años de publicación de las reseñas y de lanzamiento de los juegos en los datos sintéticos
+ANIOS_RESENAS = list(range(2010, 2016))
+ANIOS_LANZAMIENTO = list(range(1990, 2022))
+
+
+def respuestas(cliente):
+    '''
+    Returns:
+    - dict: Respuesta (o código de error) de cada endpoint de consultas por género y por año,
+      con los números redondeados: las horas se suman en otro orden según los row groups.
+    '''
+    rutas = [f'/{endpoint}/{genero}' for endpoint in ('PlayTimeGenre', 'UserForGenre') for genero in [*GENEROS, 'Action,Indie']]
+    rutas += [f'/{endpoint}/{anio}' for endpoint in ('UsersRecommend', 'UsersNotRecommend') for anio in ANIOS_RESENAS]
+    rutas += [f'/sentiment_analysis/{anio}' for anio in ANIOS_LANZAMIENTO]
+    resultado = {}
+    for ruta in rutas:
+        respuesta = cliente.get(ruta)
+        resultado[ruta] = redondear(respuesta.json()) if respuesta.status_code == 200 else respuesta.status_code
+    for endpoint, cuerpo in (('PlayTimeGenre', {'generos': GENEROS}), ('UserForGenre', {'generos': GENEROS}),
+                             ('UsersRecommend', {'anios': ANIOS_RESENAS}), ('UsersNotRecommend', {'anios': ANIOS_RESENAS}),
+                             ('sentiment_analysis', {'anios': ANIOS_LANZAMIENTO})):
+        resultado[f'/lote/{endpoint}'] = redondear(cliente.post(f'/lote/{endpoint}', json=cuerpo).json())
+    return resultado
+
+
+def redondear(valor):
+    '''
+    Redondea los números de una respuesta a 6 decimales (NDJSON los escribe con 10).
+    '''
+    if isinstance(valor, float):
+        return round(valor, 6)
+    if isinstance(valor, dict):
+        return {clave: redondear(v) for clave, v in valor.items()}
+    if isinstance(valor, list):
+        return [redondear(v) for v in valor]
+    return valor
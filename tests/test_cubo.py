@@ -0,0 +1,67 @@
+import json
+from collections import Counter
+
+import pytest
+
+from conftest import ANIOS_LANZAMIENTO, ANIOS_RESENAS, respuestas
+
+
+def _filas(cliente, ruta):
+    respuesta = cliente.get(ruta, headers={'Accept': 'application/x-ndjson'})
+    assert respuesta.status_code == 200
+    return [json.loads(linea) for linea in respuesta.text.splitlines()]
+
+
+@pytest.mark.parametrize('modo', ['muestra', 'exacto'])
+def test_el_cubo_no_cambia_las_respuestas(api, modo):
+    sin_cubo = respuestas(api('un_row_group', modo, cubo=False))
+    assert respuestas(api('un_row_group', modo, cubo=True)) == sin_cubo
+
+
+def test_sin_cubo_no_hay_consultas_por_intervalo(api):
+    cliente = api(cubo=False)
+    for ruta in ('/rango/PlayTimeGenre/Action', '/rango/UsersRecommend', '/rango/UsersNotRecommend', '/rango/sentiment_analysis'):
+        assert cliente.get(ruta).status_code == 404
+
+
+@pytest.mark.parametrize('desde, hasta', [(2000, 2009), (None, 1995), (2015, None), (None, None)])
+def test_horas_de_un_genero_en_un_intervalo(api, desde, hasta):
+    cliente = api()
+    horas = {fila['Año']: fila['Horas'] for fila in _filas(cliente, '/PlayTimeGenre/Action')}
+    en_intervalo = {anio: h for anio, h in horas.items() if (desde is None or anio >= desde) and (hasta is None or anio <= hasta)}
+    parametros = {clave: valor for clave, valor in (('desde', desde), ('hasta', hasta)) if valor is not None}
+
+    respuesta = cliente.get('/rango/PlayTimeGenre/Action', params=parametros).json()
+    assert respuesta['Horas jugadas'] == pytest.approx(sum(en_intervalo.values()))
+    assert respuesta['Año de lanzamiento con más horas jugadas'] == max(en_intervalo, key=en_intervalo.get)
+
+
+@pytest.mark.parametrize('endpoint', ['UsersRecommend', 'UsersNotRecommend'])
+def test_top_de_un_intervalo_de_anios(api, endpoint):
+    cliente = api()
+    for anio in ANIOS_RESENAS:
+        assert cliente.get(f'/rango/{endpoint}', params={'desde': anio, 'hasta': anio}).json() == cliente.get(f'/{endpoint}/{anio}').json()
+
+    cantidades = Counter()
+    for anio in range(2011, 2014):
+        for fila in _filas(cliente, f'/{endpoint}/{anio}'):
+            cantidades[fila['title']] += fila['count']
+    top = cliente.get(f'/rango/{endpoint}', params={'desde': 2011, 'hasta': 2013}).json()
+    # Los empates pueden quedar en otro orden: se comparan las cantidades
+    assert [cantidades[titulo] for titulo in top.values()] == sorted(cantidades.values(), reverse=True)[:3]
+
+
+def test_sentimiento_de_un_intervalo_de_anios(api):
+    cliente = api()
+    total = Counter()
+    for anio in ANIOS_LANZAMIENTO:
+        respuesta = cliente.get(f'/sentiment_analysis/{anio}')
+        if respuesta.status_code == 200:
+            assert cliente.get('/rango/sentiment_analysis', params={'desde': anio, 'hasta': anio}).json() == respuesta.json()
+            total.update(respuesta.json())
+    assert sum(total.values()) > 0
+    assert cliente.get('/rango/sentiment_analysis').json() == dict(total)
+
+
+def test_intervalo_invalido(api):
+    assert api().get('/rango/UsersRecommend', params={'desde': 2014, 'hasta': 2012}).status_code == 422
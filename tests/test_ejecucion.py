@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+
+import pyarrow as pa
+import pytest
+
+import consultas
+import ejecucion
+import formatos
+
+
+def _hasta_cancelar(vista):
+    # Una consulta larga con puntos de control, como los recorridos por row groups
+    def consulta():
+        for _ in range(500):
+            time.sleep(0.01)
+            try:
+                ejecucion.verificar_cancelacion()
+            except ejecucion.Cancelado:
+                vista.set()
+                raise
+    return consulta
+
+
+def test_el_timeout_cancela_la_consulta_en_curso():
+    grupo = ejecucion.GrupoEjecucion('prueba', hilos=1, cola=2, timeout=0.1)
+    vista = threading.Event()
+    with pytest.raises(ejecucion.TiempoAgotado):
+        asyncio.run(grupo.ejecutar(_hasta_cancelar(vista)))
+    assert vista.wait(1)
+    time.sleep(0.05)
+    metricas = grupo.metricas()
+    assert (metricas['vencidas'], metricas['fallidas'], metricas['en_curso'], metricas['en_cola']) == (1, 1, 0, 0)
+
+
+def test_con_la_cola_llena_se_rechaza():
+    grupo = ejecucion.GrupoEjecucion('prueba', hilos=1, cola=1, timeout=5)
+    bloqueo = threading.Event()
+
+    async def probar():
+        ocupada = asyncio.create_task(grupo.ejecutar(bloqueo.wait, 5))
+        await asyncio.sleep(0.05)
+        en_espera = asyncio.create_task(grupo.ejecutar(time.sleep, 0))
+        await asyncio.sleep(0.05)
+        with pytest.raises(ejecucion.Saturado):
+            await grupo.ejecutar(time.sleep, 0)
+        bloqueo.set()
+        await asyncio.gather(ocupada, en_espera)
+
+    asyncio.run(probar())
+    metricas = grupo.metricas()
+    assert (metricas['rechazadas'], metricas['completadas'], metricas['en_cola']) == (1, 2, 0)
+
+
+def test_cancelar_una_consulta_en_espera_la_saca_de_la_cola():
+    grupo = ejecucion.GrupoEjecucion('prueba', hilos=1, cola=2, timeout=5)
+    bloqueo = threading.Event()
+    corrida = threading.Event()
+
+    async def probar():
+        ocupada = asyncio.create_task(grupo.ejecutar(bloqueo.wait, 5))
+        await asyncio.sleep(0.05)
+        en_espera = asyncio.create_task(grupo.ejecutar(corrida.set))
+        await asyncio.sleep(0.05)
+        assert grupo.metricas()['en_cola'] == 1
+        en_espera.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await en_espera
+        assert grupo.metricas()['en_cola'] == 0
+        bloqueo.set()
+        await ocupada
+
+    asyncio.run(probar())
+    assert not corrida.is_set()
+    assert grupo.metricas()['canceladas'] == 1
+
+
+def test_cancelar_una_consulta_en_curso_la_detiene():
+    grupo = ejecucion.GrupoEjecucion('prueba', hilos=1, cola=2, timeout=5)
+    vista = threading.Event()
+
+    async def probar():
+        tarea = asyncio.create_task(grupo.ejecutar(_hasta_cancelar(vista)))
+        await asyncio.sleep(0.05)
+        tarea.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await tarea
+
+    asyncio.run(probar())
+    assert vista.wait(1)
+    assert grupo.metricas()['canceladas'] == 1
+
+
+def test_una_respuesta_cortada_cierra_las_tablas_pendientes(monkeypatch):
+    monkeypatch.setitem(ejecucion.grupos, 'consultas', ejecucion.GrupoEjecucion('consultas', hilos=2, cola=2, timeout=0.2))
+    cerradas = threading.Event()
+
+    def tablas():
+        try:
+            yield pa.table({'a': [1]})
+            time.sleep(0.5)
+            yield pa.table({'a': [2]})
+            yield pa.table({'a': [3]})
+        finally:
+            cerradas.set()
+
+    async def probar():
+        # Vence el plazo de la segunda parte
+        partes = formatos.respuesta(tablas(), 'ndjson').body_iterator
+        assert await partes.__anext__()
+        with pytest.raises(ejecucion.TiempoAgotado):
+            await partes.__anext__()
+        assert await asyncio.to_thread(cerradas.wait, 1)
+
+        # El cliente se desconecta después de la primera parte
+        cerradas.clear()
+        partes = formatos.respuesta(tablas(), 'ndjson').body_iterator
+        await partes.__anext__()
+        await partes.aclose()
+        assert await asyncio.to_thread(cerradas.wait, 1)
+
+    asyncio.run(probar())
+
+
+def test_los_endpoints_responden_503_y_504(api, monkeypatch):
+    cliente = api(cubo=False)
+    monkeypatch.setattr(consultas, 'play_time_genre', lambda *args: time.sleep(0.5))
+
+    monkeypatch.setitem(ejecucion.grupos, 'consultas', ejecucion.GrupoEjecucion('consultas', hilos=1, cola=1, timeout=0.1))
+    assert cliente.get('/PlayTimeGenre/Action,Indie').status_code == 504
+    assert ejecucion.grupos['consultas'].metricas()['vencidas'] == 1
+
+    monkeypatch.setitem(ejecucion.grupos, 'consultas', ejecucion.GrupoEjecucion('consultas', hilos=1, cola=0, timeout=0.1))
+    respuesta = cliente.get('/PlayTimeGenre/Action,Indie')
+    assert respuesta.status_code == 503
+    assert respuesta.headers['Retry-After'] == '1'
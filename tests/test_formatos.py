@@ -0,0 +1,105 @@
+import json
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pytest
+
+import configuracion
+import formatos
+from conftest import GENEROS, redondear
+
+
+NDJSON = {'Accept': 'application/x-ndjson'}
+ARROW = {'Accept': 'application/vnd.apache.arrow.stream'}
+
+
+@pytest.mark.parametrize('accept, formato', [
+    (None, 'json'),
+    ('', 'json'),
+    ('text/html', 'json'),
+    ('*/*', 'json'),
+    ('application/x-ndjson', 'ndjson'),
+    ('application/jsonl', 'ndjson'),
+    ('Application/Vnd.Apache.Arrow.Stream', 'arrow'),
+    ('application/json;q=0.5, application/x-ndjson', 'ndjson'),
+    ('application/vnd.apache.arrow.stream;q=0.9, application/x-ndjson;q=0.8', 'arrow'),
+    ('*/*, application/x-ndjson', 'ndjson'),
+    ('application/x-ndjson;q=0, application/json', 'json'),
+    ('application/x-ndjson;q=abc', 'json'),
+])
+def test_negociar(accept, formato):
+    assert formatos.negociar(accept) == formato
+
+
+def _ndjson(respuesta):
+    assert respuesta.status_code == 200
+    assert respuesta.headers['content-type'].startswith(formatos.TIPOS['ndjson'])
+    return redondear([json.loads(linea) for linea in respuesta.text.splitlines()])
+
+
+def _arrow(respuesta):
+    assert respuesta.status_code == 200
+    assert respuesta.headers['content-type'].startswith(formatos.TIPOS['arrow'])
+    return redondear(pa.ipc.open_stream(respuesta.content).read_all().to_pylist())
+
+
+@pytest.mark.parametrize('ruta', ['/PlayTimeGenre/Action', '/UserForGenre/Indie', '/UsersRecommend/2012',
+                                  '/UsersNotRecommend/2013', '/sentiment_analysis/2005', '/PlayTimeGenre/Action,Indie?operador=o'])
+def test_ndjson_y_arrow_devuelven_las_mismas_filas(api, ruta):
+    cliente = api()
+    filas = _ndjson(cliente.get(ruta, headers=NDJSON))
+    assert filas
+    assert _arrow(cliente.get(ruta, headers=ARROW)) == filas
+
+
+def test_la_tabla_completa_coincide_con_la_respuesta_json(api):
+    cliente = api()
+    for anio in range(2010, 2016):
+        ranking = _ndjson(cliente.get(f'/UsersRecommend/{anio}', headers=NDJSON))
+        top = cliente.get(f'/UsersRecommend/{anio}').json()
+        assert list(top.values()) == [fila['title'] for fila in ranking[:3]]
+    for genero in GENEROS:
+        horas = _ndjson(cliente.get(f'/PlayTimeGenre/{genero}', headers=NDJSON))
+        respuesta = cliente.get(f'/PlayTimeGenre/{genero}').json()
+        assert list(respuesta.values()) == [max(horas, key=lambda fila: fila['Horas'])['Año']]
+
+
+@pytest.mark.parametrize('modo', ['muestra', 'exacto'])
+def test_filas_en_los_tres_formatos(api, datos, monkeypatch, modo):
+    cliente = api('varios_row_groups', modo)
+    # Varias partes por respuesta
+    monkeypatch.setattr(configuracion, 'filas_por_lote_respuesta', 100)
+    archivo = pq.read_table(f"{datos['varios_row_groups']}/Jupyter/df_UsersRecommend_gzip.parquet")
+    esperadas = pc.sum(pc.equal(archivo['reviews_posted'], 2012)).as_py()
+
+    ruta = '/filas/UsersRecommend?anio=2012'
+    filas = _ndjson(cliente.get(ruta, headers=NDJSON))
+    assert len(filas) == esperadas
+    assert {fila['reviews_posted'] for fila in filas} == {2012}
+    tabla = pa.ipc.open_stream(cliente.get(ruta, headers=ARROW).content)
+    assert len(list(tabla)) > 1
+    assert _arrow(cliente.get(ruta, headers=ARROW)) == filas
+    assert redondear(cliente.get(ruta).json()) == filas
+
+
+def test_filas_de_un_genero(api):
+    cliente = api()
+    filas = _ndjson(cliente.get('/filas/PlayTimeGenre?genero=Action', headers=NDJSON))
+    assert filas and all('Action' in fila['genres'] for fila in filas)
+    assert _arrow(cliente.get('/filas/PlayTimeGenre?genero=Action', headers=ARROW)) == filas
+
+
+def test_filas_con_errores(api):
+    cliente = api()
+    assert cliente.get('/filas/Otro', headers=NDJSON).status_code == 404
+    assert cliente.get('/filas/UsersRecommend?genero=Action', headers=NDJSON).status_code == 422
+
+
+def test_las_respuestas_por_partes_no_se_guardan_en_el_cache(api):
+    cliente = api(cache=True)
+    cliente.get('/UsersRecommend/2012')
+    json_cacheado = cliente.get('/UsersRecommend/2012')
+    assert (json_cacheado.headers['X-Cache'], json_cacheado.headers['Vary']) == ('HIT', 'Accept')
+    for _ in range(2):
+        assert 'X-Cache' not in cliente.get('/UsersRecommend/2012', headers=NDJSON).headers
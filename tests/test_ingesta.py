@@ -0,0 +1,128 @@
+import json
+
+import pytest
+
+import configuracion
+import main
+from conftest import autorizacion
+from ingesta import ResenasEnVivo
+
+
+ANIO = 2012
+
+
+def _ranking(cliente, endpoint, anio):
+    respuesta = cliente.get(f'/{endpoint}/{anio}', headers={'Accept': 'application/x-ndjson'})
+    return [json.loads(linea) for linea in respuesta.text.splitlines()]
+
+
+def _ingerir(cliente, titulo, cantidad, anio=ANIO):
+    resenas = [{'title': titulo, 'reviews_posted': anio, 'reviews_recommend': True, 'reviews_review': 'great game'}] * cantidad
+    respuesta = cliente.post('/ingesta/resenas', headers=autorizacion(), json={'resenas': resenas})
+    assert respuesta.status_code == 200
+    assert respuesta.json()['UsersRecommend'] == cantidad
+
+
+@pytest.mark.parametrize('cubo', [True, False])
+def test_una_resena_nueva_no_reemplaza_el_ranking(api, cubo):
+    cliente = api(cubo=cubo)
+    antes = cliente.get(f'/UsersRecommend/{ANIO}').json()
+    assert len(antes) == 3
+
+    _ingerir(cliente, 'Juego nuevo', 1)
+
+    assert cliente.get(f'/UsersRecommend/{ANIO}').json() == antes
+    assert cliente.post('/lote/UsersRecommend', json={'anios': [ANIO]}).json() == {str(ANIO): antes}
+
+
+@pytest.mark.parametrize('cubo', [True, False])
+def test_las_resenas_ingeridas_se_suman_al_ranking(api, cubo):
+    cliente = api(cubo=cubo)
+    ranking = _ranking(cliente, 'UsersRecommend', ANIO)
+    cuarto = ranking[3]
+    _ingerir(cliente, cuarto['title'], ranking[0]['count'] - cuarto['count'] + 1)
+
+    esperado = {'Puesto 1': cuarto['title'], 'Puesto 2': ranking[0]['title'], 'Puesto 3': ranking[1]['title']}
+    assert cliente.get(f'/UsersRecommend/{ANIO}').json() == esperado
+    assert cliente.post('/lote/UsersRecommend', json={'anios': [ANIO]}).json() == {str(ANIO): esperado}
+    # Los demás años no cambian
+    assert cliente.get(f'/UsersRecommend/{ANIO + 1}').json() == {
+        f'Puesto {i + 1}': fila['title'] for i, fila in enumerate(_ranking(cliente, 'UsersRecommend', ANIO + 1)[:3])}
+
+
+def _resenas(titulo, cantidad, anio=ANIO):
+    return [{'title': titulo, 'reviews_posted': anio, 'reviews_recommend': True, 'reviews_review': 'great game'}] * cantidad
+
+
+def test_los_workers_comparten_las_resenas_compactadas(tmp_path):
+    # Dos workers con el mismo directorio de ingesta
+    a, b = ResenasEnVivo(str(tmp_path), capacidad=64), ResenasEnVivo(str(tmp_path), capacidad=64)
+    a.cargar()
+    b.cargar()
+    a.ingerir(_resenas('Juego A', 3))
+    b.ingerir(_resenas('Juego B', 2))
+    assert a.generacion != b.generacion
+    assert 'Juego B' not in a.conteos('UsersRecommend', ANIO, ANIO)
+
+    assert a.compactar() == 3
+    # B suma lo que compactó A sin perder sus reseñas pendientes
+    assert b.sincronizar()
+    assert b.conteos('UsersRecommend', ANIO, ANIO) == {'Juego A': 3, 'Juego B': 2}
+    assert b.compactar() == 2
+    assert a.sincronizar()
+
+    assert a.conteos('UsersRecommend', ANIO, ANIO) == b.conteos('UsersRecommend', ANIO, ANIO) == {'Juego A': 3, 'Juego B': 2}
+    assert a.generacion == b.generacion != ''
+    assert a.estado()['ingeridas'] == b.estado()['ingeridas'] == 5
+    assert not a.sincronizar()
+
+
+def test_la_union_de_archivos_no_pierde_resenas(tmp_path, monkeypatch):
+    monkeypatch.setattr(configuracion, 'max_archivos_ingesta', 2)
+    a, b = ResenasEnVivo(str(tmp_path), capacidad=64), ResenasEnVivo(str(tmp_path), capacidad=64)
+    for i in range(3):
+        for worker in (a, b):
+            worker.ingerir(_resenas(f'Juego {i}', 1))
+            worker.compactar()
+    a.sincronizar()
+    assert len(a._archivos()) <= 2
+    assert a.conteos('UsersRecommend', ANIO, ANIO) == {f'Juego {i}': 2 for i in range(3)}
+
+    # Un worker nuevo arranca con las mismas reseñas
+    c = ResenasEnVivo(str(tmp_path), capacidad=64)
+    c.cargar()
+    assert c.conteos('UsersRecommend', ANIO, ANIO) == a.conteos('UsersRecommend', ANIO, ANIO)
+    assert c.generacion == a.generacion
+
+
+def test_las_resenas_compactadas_se_leen_al_arrancar(api, tmp_path):
+    cliente = api(ingesta='ingesta')
+    ranking = _ranking(cliente, 'UsersRecommend', ANIO)
+    _ingerir(cliente, ranking[3]['title'], ranking[0]['count'])
+    esperado = cliente.get(f'/UsersRecommend/{ANIO}').json()
+    assert esperado['Puesto 1'] == ranking[3]['title']
+    assert cliente.get('/ingesta').json()['pendientes'] == ranking[0]['count']
+
+    assert main.resenas.compactar() == ranking[0]['count']
+    estado = cliente.get('/ingesta').json()
+    assert (estado['pendientes'], estado['archivos'], estado['compactaciones']) == (0, 1, 1)
+    assert cliente.get(f'/UsersRecommend/{ANIO}').json() == esperado
+
+    # Al apagarse se compactan las pendientes; al arrancar se leen todas
+    _ingerir(cliente, 'Juego nuevo', 1, ANIO + 1)
+    cliente = api(ingesta='ingesta')
+    estado = cliente.get('/ingesta').json()
+    assert (estado['ingeridas'], estado['pendientes'], estado['archivos']) == (ranking[0]['count'] + 1, 0, 2)
+    assert cliente.get(f'/UsersRecommend/{ANIO}').json() == esperado
+    assert len(list((tmp_path / 'ingesta').glob('resenas_*.parquet'))) == 2
+
+
+def test_la_generacion_de_las_resenas_cambia_el_etag(api):
+    cliente = api(cache=True)
+    antes = cliente.get(f'/UsersRecommend/{ANIO}')
+    assert cliente.get(f'/UsersRecommend/{ANIO}', headers={'If-None-Match': antes.headers['ETag']}).status_code == 304
+    _ingerir(cliente, 'Juego nuevo', 1)
+    despues = cliente.get(f'/UsersRecommend/{ANIO}')
+    assert despues.headers['ETag'] != antes.headers['ETag']
+    main.resenas.compactar()
+    assert cliente.get(f'/UsersRecommend/{ANIO}').headers['ETag'] not in (antes.headers['ETag'], despues.headers['ETag'])
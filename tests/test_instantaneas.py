@@ -0,0 +1,98 @@
+import os
+import time
+
+import pytest
+
+import configuracion
+from conftest import FILAS, autorizacion
+from generar_datos import generar
+
+
+def _esperar_recarga(cliente):
+    for _ in range(600):
+        estado = cliente.get('/admin/instantanea').json()
+        if not estado['recarga']['en_curso']:
+            return estado
+        time.sleep(0.05)
+    raise AssertionError("La recarga no terminó")
+
+
+def _recargar(cliente, version=None):
+    respuesta = cliente.post('/admin/recargar', headers=autorizacion(), json={'version': version})
+    assert respuesta.status_code == 202
+    return _esperar_recarga(cliente)
+
+
+@pytest.fixture
+def instantaneas(tmp_path, monkeypatch):
+    '''
+    Directorio de instantáneas con dos versiones de datos distintos.
+    '''
+    directorio = tmp_path / 'instantaneas'
+    for semilla, version in enumerate(('2024-01-01', '2024-02-01')):
+        generar(FILAS, str(directorio / version), semilla=semilla)
+    monkeypatch.setattr(configuracion, 'directorio_instantaneas', str(directorio))
+    return directorio
+
+
+def test_recargar_requiere_el_token(api):
+    cliente = api()
+    assert cliente.post('/admin/recargar').status_code == 403
+    assert cliente.post('/admin/recargar', headers={'Authorization': 'Bearer otro'}).status_code == 403
+
+
+def test_recargar_publica_una_instantanea_nueva(api):
+    cliente = api(cache=True)
+    antes = cliente.get('/admin/instantanea').json()['vigente']
+    respuesta = cliente.get('/UsersRecommend/2012')
+
+    estado = _recargar(cliente)
+    assert estado['recarga']['error'] is None
+    assert estado['recargas'] == {'exito': 1, 'error': 0}
+    assert estado['vigente']['numero'] == antes['numero'] + 1
+    # Los mismos archivos: la misma versión, las mismas respuestas y el mismo ETag
+    assert estado['vigente']['version'] == antes['version']
+    despues = cliente.get('/UsersRecommend/2012')
+    assert despues.json() == respuesta.json()
+    assert despues.headers['ETag'] == respuesta.headers['ETag']
+
+
+def test_recargar_pasa_a_otra_version(api, instantaneas):
+    cliente = api(cache=True)
+    estado = cliente.get('/admin/instantanea').json()
+    assert estado['versiones'] == ['2024-01-01', '2024-02-01']
+    assert estado['vigente']['raiz'] == os.path.join(str(instantaneas), '2024-02-01')
+    ultima = cliente.get('/UsersRecommend/2012')
+
+    estado = _recargar(cliente, '2024-01-01')
+    assert estado['fijada'] == os.path.join(str(instantaneas), '2024-01-01')
+    assert estado['vigente']['raiz'] == estado['fijada']
+    anterior = cliente.get('/UsersRecommend/2012')
+    assert anterior.json() != ultima.json()
+    assert anterior.headers['ETag'] != ultima.headers['ETag']
+
+    # Sin versión se deja de fijar y se vuelve a la última
+    estado = _recargar(cliente)
+    assert estado['fijada'] is None
+    assert cliente.get('/UsersRecommend/2012').json() == ultima.json()
+
+
+def test_una_version_inexistente_no_se_carga(api, instantaneas):
+    cliente = api()
+    respuesta = cliente.post('/admin/recargar', headers=autorizacion(), json={'version': '../otra'})
+    assert respuesta.status_code == 404
+
+
+def test_una_instantanea_que_no_valida_no_se_publica(api, instantaneas):
+    cliente = api()
+    vigente = cliente.get('/admin/instantanea').json()['vigente']
+    respuesta = cliente.get('/UsersRecommend/2012').json()
+    incompleta = instantaneas / '2024-03-01'
+    generar(FILAS, str(incompleta), semilla=2)
+    os.remove(incompleta / 'Jupyter' / 'df_UsersRecommend_gzip.parquet')
+
+    estado = _recargar(cliente)
+    assert estado['recargas'] == {'exito': 0, 'error': 1}
+    assert estado['recarga']['error']
+    assert estado['vigente']['numero'] == vigente['numero']
+    assert cliente.get('/UsersRecommend/2012').json() == respuesta
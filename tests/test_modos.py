@@ -0,0 +1,37 @@
+import pytest
+
+from conftest import respuestas
+
+
+@pytest.fixture
+def exacto(api):
+    return respuestas(api('varios_row_groups', 'exacto', cubo=False))
+
+
+def test_las_respuestas_tienen_datos(exacto):
+    # Que las comparaciones no pasen porque todo responde 404
+    assert all(exacto[f'/PlayTimeGenre/{genero}'] != 404 for genero in ('Action', 'Indie', 'Action,Indie'))
+    assert all(len(exacto[f'/UsersRecommend/{anio}']) == 3 for anio in range(2010, 2016))
+    assert exacto['/lote/sentiment_analysis']
+
+
+def test_la_muestra_completa_responde_como_el_modo_exacto(api, exacto):
+    # Con un solo row group la muestra completa es el archivo entero
+    assert respuestas(api('un_row_group', 'muestra', cubo=False)) == exacto
+
+
+def test_el_modo_exacto_no_depende_de_los_row_groups(api, exacto):
+    assert respuestas(api('un_row_group', 'exacto', cubo=False)) == exacto
+
+
+def test_la_muestra_de_los_datasets_por_anio_toma_todos_los_row_groups(api, exacto):
+    muestra = respuestas(api('varios_row_groups', 'muestra', cubo=False))
+    por_anio = [ruta for ruta in exacto if any(f'/{endpoint}' in ruta for endpoint in ('UsersRecommend', 'UsersNotRecommend', 'sentiment_analysis'))]
+    assert len(por_anio) == 6 + 6 + 32 + 3
+    assert {ruta: muestra[ruta] for ruta in por_anio} == {ruta: exacto[ruta] for ruta in por_anio}
+
+
+def test_la_muestra_parcial_responde_con_datos_de_la_muestra(api, exacto):
+    muestra = respuestas(api('varios_row_groups', 'muestra', cubo=False, muestra_completa=False))
+    assert muestra.keys() == exacto.keys()
+    assert muestra != exacto